@@ -48,16 +48,24 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'nameless_api.authentication.CachedJWTAuthentication',
     )
 }
 
+SIMPLE_JWT = {
+    #Student accounts are keyed by email
+    'USER_ID_FIELD': 'student_email',
+}
+
 MIDDLEWARE = [
+    "nameless_api.middleware.MetricsMiddleware",
+    "nameless_api.middleware.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "nameless_api.middleware.ReplicaPinningMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -94,6 +102,11 @@ DATABASES = {
         "PASSWORD": local_settings.mysql_pwd,
     }
 }
+#Read replicas of default are added here and listed in DATABASE_REPLICAS, e.g.
+#"replica": {..., "TEST": {"MIRROR": "default"}}
+#feedback_man's ReplicaDatabaseTests run against a "replica" alias with a test database of its own instead
+#of a mirror, e.g. two local SQLite files.
+DATABASE_ROUTERS = ["feedback_man.routers.ReplicaRouter"]
 
 
 
@@ -151,4 +164,194 @@ EMAIL_HOST_USER = local_settings.nameless_email
 EMAIL_HOST_PASSWORD = local_settings.email_app_pwd 
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
-EMAIL_USE_SSL = False
\ No newline at end of file
+EMAIL_USE_SSL = False
+
+#Perspective API config
+PERSPECTIVE_API_KEY = local_settings.perspective_api_key
+PERSPECTIVE_DISCOVERY_URL = "https://commentanalyzer.googleapis.com/$discovery/rest?version=v1alpha1"
+#Endpoint used directly by the async views
+PERSPECTIVE_ANALYZE_URL = "https://commentanalyzer.googleapis.com/v1alpha1/comments:analyze"
+#Seconds a single HTTP request to Perspective may take
+PERSPECTIVE_TIMEOUT = 10
+#Seconds a moderation call may take in all, retries included, before its message is held
+PERSPECTIVE_DEADLINE = 3
+#Times a failed moderation call is retried within its deadline
+PERSPECTIVE_RETRIES = 2
+#Base and cap in seconds of the exponential, fully jittered delay between attempts
+PERSPECTIVE_RETRY_BASE_DELAY = 0.1
+PERSPECTIVE_RETRY_MAX_DELAY = 1
+#Consecutive failed attempts after which moderation calls fail fast
+PERSPECTIVE_BREAKER_FAILURES = 5
+#Seconds moderation calls fail fast before one trial call is let through
+PERSPECTIVE_BREAKER_RESET = 30
+#Connections an event loop may hold open to Perspective at once
+PERSPECTIVE_MAX_ASYNC_CONNECTIONS = 200
+#Maximum number of queued comments scored in one batch HTTP request
+PERSPECTIVE_MAX_BATCH = 20
+#Number of threads sending requests to Perspective per process
+PERSPECTIVE_WORKERS = 4
+
+#Message pipeline config
+#Seconds after which a job claimed by a worker that died may be claimed again
+PIPELINE_LOCK_TIMEOUT = 300
+#Upper bound in seconds on the retry delay of a failed job
+PIPELINE_MAX_BACKOFF = 300
+#Attempts after which a failing job is given up on and its message marked Failed
+PIPELINE_MAX_ATTEMPTS = 10
+
+#Email outbox config
+#Maximum number of outbox emails sent per SMTP session
+OUTBOX_BATCH_SIZE = 100
+#Seconds between per-teacher digest emails. None sends every message as its own email.
+OUTBOX_DIGEST_INTERVAL = None
+#Seconds a batch claimed by a sender is left to it before other senders may claim it
+OUTBOX_CLAIM_TIMEOUT = 300
+#Delay in seconds before the first retry of a failed email, doubled after every failure
+OUTBOX_RETRY_DELAY = 60
+#Upper bound in seconds on the retry delay of a failed email
+OUTBOX_MAX_BACKOFF = 60 * 60
+#Failed attempts after which an email is given up on
+OUTBOX_MAX_ATTEMPTS = 8
+
+#Search config
+#Fraction of a query's trigrams a teacher's name must contain to be returned by search
+TEACHER_SEARCH_MIN_SIMILARITY = 0.5
+#Nicknames students search courses by, keyed by lowercase subject and number
+COURSE_SEARCH_ALIASES = {
+    "cs2500": ["fundies", "fundies1"],
+    "cs2510": ["fundies2"],
+    "cs3500": ["ood"],
+}
+#Default and maximum number of courses returned by course autocomplete
+COURSE_AUTOCOMPLETE_LIMIT = 10
+COURSE_AUTOCOMPLETE_MAX_LIMIT = 50
+
+#Cache config
+#The search cache should use a backend shared by every worker process (e.g. file based)
+#so that catalog changes invalidate cached results everywhere
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "search": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "search",
+        "TIMEOUT": 300,
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+}
+SEARCH_CACHE_ALIAS = "search"
+#Size of the in-process LRU cache of search responses in front of the search cache
+SEARCH_CACHE_LOCAL_SIZE = 1024
+
+#Pagination config
+#Default and maximum number of results per page of the paginated endpoints
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+#Moderation verdict cache config
+#Seconds the Perspective scores of a message text are reused for identical texts
+MODERATION_VERDICT_TTL = 7 * 24 * 60 * 60
+#Size of the in-process LRU cache of verdicts in front of the verdict table
+MODERATION_VERDICT_LOCAL_SIZE = 10000
+#Seconds between purges of expired verdicts from the verdict table by the pipeline's outbox sender
+MODERATION_VERDICT_PURGE_INTERVAL = 60 * 60
+
+#Moderation threshold config
+#A message is malicious if any Perspective attribute scores above its threshold. After changing
+#them, run manage.py rethreshold to judge the stored messages against the new thresholds
+MODERATION_THRESHOLDS = {"TOXICITY": 0.7, "IDENTITY_ATTACK": 0.7, "INSULT": 0.7}
+
+#Moderation degraded mode config
+#What happens while Perspective is unavailable: "hold" messages (status Held) for the pipeline
+#workers to moderate once it is back, or "reject" new messages with 503 Service Unavailable
+#while the circuit breaker is open. Messages already accepted are held either way.
+MODERATION_DEGRADED_MODE = "hold"
+#Cache the circuit breaker's open state is shared through, so processes which leave moderation
+#to the pipeline workers reject messages too; it must be shared between processes in production
+MODERATION_BREAKER_CACHE_ALIAS = "default"
+
+#Moderation pre-screen config
+#Terms which get a message rejected without calling Perspective, matched as whole words
+#after normalizing case, leetspeak and letters stretched to three or more
+MODERATION_BLOCKLIST = []
+#Optional path of a file with one more blocklisted term per line
+MODERATION_BLOCKLIST_FILE = None
+
+#Message throttle config
+#Cache holding the per-student token buckets. Use a backend shared by every worker process
+#with atomic increments (e.g. memcached or redis) in production.
+THROTTLE_CACHE_ALIAS = "default"
+#Students may send MESSAGE_THROTTLE_RATE messages per MESSAGE_THROTTLE_PERIOD seconds,
+#in bursts of up to MESSAGE_THROTTLE_BURST
+MESSAGE_THROTTLE_RATE = 20
+MESSAGE_THROTTLE_PERIOD = 60 * 60
+MESSAGE_THROTTLE_BURST = 5
+#Each infraction slows a student's refill rate by this fraction of the normal interval
+MESSAGE_THROTTLE_INFRACTION_PENALTY = 1.0
+
+#Maximum teachers one batch message (to a course or a list of teachers) may go to
+MESSAGE_BATCH_MAX_TEACHERS = 20
+
+#Number of malicious messages after which a student account is deactivated
+MAX_INFRACTIONS = 5
+
+#Authentication cache config
+#Cache of the student accounts resolved from tokens. Use a backend shared by every worker
+#process in production so that account changes are seen everywhere.
+AUTH_USER_CACHE_ALIAS = "default"
+#Seconds an account stays in the shared cache
+AUTH_USER_CACHE_TTL = 60
+#Size and seconds to live of the in-process LRU cache in front of the shared cache. Other
+#processes may see a changed account this long after the change.
+AUTH_USER_CACHE_LOCAL_SIZE = 10000
+AUTH_USER_CACHE_LOCAL_TTL = 5
+#Trust the token alone on read-only endpoints, without looking the student up at all
+AUTH_STATELESS_READS = False
+
+#Metrics config
+#Record per-request timings and SQL counts, served in Prometheus format by the metrics endpoint
+METRICS_ENABLED = True
+
+#Profiling config
+#Profile requests on demand; the middleware is removed from the stack unless enabled
+PROFILING_ENABLED = False
+#Secret which profiles a request when sent in the X-Profile header or profile query parameter
+PROFILING_TOKEN = None
+#Fraction of all requests to profile
+PROFILING_SAMPLE_RATE = 0.0
+#"cprofile" for deterministic pstats files, or "sampler" for collapsed stacks (flamegraphs)
+PROFILING_MODE = "sampler"
+#Seconds between the sampler's stack samples
+PROFILING_SAMPLE_INTERVAL = 0.005
+#Profiles are written to a directory per URL route under this one
+PROFILING_DIR = BASE_DIR / "profiles"
+
+#Read replica config
+#Aliases in DATABASES of the read replicas of default, which serve catalog reads
+DATABASE_REPLICAS = []
+#Seconds catalog reads stay on the primary after a write by the same user, command or thread.
+#Set it above the usual replication lag.
+REPLICA_PIN_SECONDS = 5
+#Cache remembering which users wrote recently. Use a backend shared by every worker process in production.
+REPLICA_PIN_CACHE_ALIAS = "default"
+
+#Message archive config
+#Messages older than this many days are moved to compressed segment files by archive_messages
+ARCHIVE_AFTER_DAYS = 2 * 365
+#Directory of the segment files, one subdirectory per term
+ARCHIVE_DIR = BASE_DIR / "archive"
+#Messages deleted per transaction once archived, to keep row locks short
+ARCHIVE_DELETE_BATCH_SIZE = 1000
+
+#Near-duplicate detection config
+#Collapse floods of near-identical messages to a teacher into one moderation decision, and each student's
+#copies into one email
+DEDUP_ENABLED = True
+#Seconds after the first message of a flood during which its near duplicates are collapsed into it
+DEDUP_WINDOW = 60 * 60
+#Maximum differing bits of the 64-bit SimHashes of near duplicates. Each bit more catches more edited
+#copies, but splits fingerprints into narrower bands, so lookups compare against more candidates.
+DEDUP_MAX_DISTANCE = 6
+#Maximum flood leaders indexed per process; the oldest are evicted first
+DEDUP_MAX_ENTRIES = 100000
@@ -0,0 +1,95 @@
+"""
+Cache of the student accounts resolved from authentication tokens.
+
+Authenticated requests only need a handful of account fields, so those are cached per student in
+an in-process LRU in front of a shared cache, and accounts are rebuilt from them without a query.
+The other fields are deferred and loaded on access. Saving or deleting an account, and
+increment_infractions, invalidate the shared entry once committed; other processes' local entries
+expire after AUTH_USER_CACHE_LOCAL_TTL seconds.
+"""
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .lru import LRUCache
+
+#Fields kept in the cache: whatever authentication, permissions and throttling read
+CACHED_FIELDS = {"student_email", "num_infractions", "is_active", "is_staff", "is_superuser"}
+
+_local = None
+_local_lock = threading.Lock()
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def local_cache() -> LRUCache:
+    """Return the in-process LRU of accounts."""
+
+    global _local
+    if _local is None:
+        with _local_lock:
+            if _local is None:
+                _local = LRUCache(settings.AUTH_USER_CACHE_LOCAL_SIZE, settings.AUTH_USER_CACHE_LOCAL_TTL)
+    return _local
+
+
+def cache_key(pk) -> str:
+    return f"account:{pk}"
+
+
+def record(event: str):
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def lookup(model, pk):
+    """Return the cached account with the given primary key as an instance of model, or None."""
+
+    key = cache_key(pk)
+    fields = local_cache().get(key)
+    if fields is not None:
+        record("local_hits")
+    else:
+        fields = caches[settings.AUTH_USER_CACHE_ALIAS].get(key)
+        if fields is None:
+            record("misses")
+            return None
+        record("shared_hits")
+        local_cache().set(key, fields)
+
+    #from_db defers the fields left out, as long as the values come in field order
+    names = [field.attname for field in model._meta.concrete_fields if field.attname in fields]
+    return model.from_db(DEFAULT_DB_ALIAS, names, [fields[name] for name in names])
+
+
+def store(account):
+    """Cache the authentication fields of the account."""
+
+    key = cache_key(account.pk)
+    fields = {name: getattr(account, name) for name in CACHED_FIELDS}
+    caches[settings.AUTH_USER_CACHE_ALIAS].set(key, fields, settings.AUTH_USER_CACHE_TTL)
+    local_cache().set(key, fields)
+
+
+def invalidate(pk):
+    """Drop the cached account once the current transaction, if any, commits."""
+
+    def delete():
+        key = cache_key(pk)
+        local_cache().delete(key)
+        caches[settings.AUTH_USER_CACHE_ALIAS].delete(key)
+
+    transaction.on_commit(delete)
+
+
+def stats() -> dict:
+    """Return the hit and miss counters of this process, and the hit rate."""
+
+    with _stats_lock:
+        counts = {event: _stats[event] for event in ("local_hits", "shared_hits", "misses")}
+    lookups = sum(counts.values())
+    counts["hit_rate"] = (counts["local_hits"] + counts["shared_hits"]) / lookups if lookups else 0.0
+    return counts
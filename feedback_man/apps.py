@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class FeedbackManConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "feedback_man"
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,241 @@
+"""
+Archive of old messages in compressed, checksummed JSON Lines segment files.
+
+Messages are archived per academic term (see term_of) to ARCHIVE_DIR/<term>/<segment>.jsonl.gz,
+one JSON object per message with its email's sent_at and its moderation scores (null if unscored). Next to each segment, <segment>.jsonl.gz.sha256 holds its SHA-256
+in the format of sha256sum. A segment is only written under its final name once it is complete
+and its checksum is on disk. Archived rows are then deleted from the database in small batches,
+read back from the verified segment; <segment>.jsonl.gz.pending marks a segment whose rows are
+not all deleted yet, so an interrupted run is finished by the next one.
+
+read() and scan() stream archived messages for audits without loading them into the database.
+"""
+import gzip
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import scoring
+from .models import Course, Message
+
+#Terms by the month (exclusive) they end in
+TERMS = [(5, Course.Semester.SPRING), (7, Course.Semester.SUMMER_1), (9, Course.Semester.SUMMER_2),
+         (13, Course.Semester.FALL)]
+SUFFIX = ".jsonl.gz"
+
+
+class ArchiveError(Exception):
+    """A segment file is missing its checksum or does not match it."""
+
+
+def term_of(moment: datetime) -> str:
+    """Return the academic term of the moment in the local time zone, e.g. 2023-FA."""
+
+    local = timezone.localtime(moment)
+    for end, semester in TERMS:
+        if local.month < end:
+            return f"{local.year}-{semester}"
+
+
+def term_key(term: str) -> tuple:
+    """Sort key of a term: its year, then its semester in the order of the year."""
+
+    year, _, semester = term.partition("-")
+    order = [code for _, code in TERMS]
+    return int(year), order.index(semester) if semester in order else len(order)
+
+
+def archive_dir(directory=None) -> Path:
+    return Path(directory or settings.ARCHIVE_DIR)
+
+
+def archivable(before: datetime):
+    """
+    Return the messages created before the given time which are done with: moderated, and
+    emailed if they were queued for email.
+    """
+
+    return (Message.objects.filter(created_at__lt=before)
+            .exclude(status__in=[Message.Status.PENDING, Message.Status.HELD])
+            .filter(Q(outbox_email__isnull=True) | Q(outbox_email__sent_at__isnull=False)))
+
+
+def encode(value):
+    if isinstance(value, datetime):
+        #Full precision, unlike DjangoJSONEncoder
+        return value.isoformat()
+    raise TypeError(f"Cannot archive {type(value).__name__}")
+
+
+def digest(path: Path) -> str:
+    sha = hashlib.sha256()
+    with path.open("rb") as fp:
+        for block in iter(lambda: fp.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class SegmentWriter:
+    """Writes one segment under a temporary name until closed."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.partial = path.with_name(path.name + ".partial")
+        self.partial.parent.mkdir(parents=True, exist_ok=True)
+        self.raw = self.partial.open("wb")
+        self.file = gzip.GzipFile(fileobj=self.raw, mode="wb")
+        self.count = 0
+
+    def write(self, record: dict):
+        self.file.write(json.dumps(record, default=encode, separators=(",", ":")).encode() + b"\n")
+        self.count += 1
+
+    def close(self) -> Path:
+        """Finish the segment and give it its final name, checksum and pending marker."""
+
+        self.file.close()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        self.raw.close()
+        #Marked pending before it exists under its final name, so its rows are never left behind
+        pending_path(self.path).touch()
+        checksum_path(self.path).write_text(f"{digest(self.partial)}  {self.path.name}\n")
+        os.replace(self.partial, self.path)
+        return self.path
+
+
+def checksum_path(segment: Path) -> Path:
+    return segment.with_name(segment.name + ".sha256")
+
+
+def pending_path(segment: Path) -> Path:
+    return segment.with_name(segment.name + ".pending")
+
+
+def archive(before: datetime, directory=None, chunk_size: int = 2000, segment_rows: int = 100_000) -> list:
+    """
+    Write the archivable messages created before the given time to new segments and return
+    their paths. The messages are not deleted; see delete_archived.
+    """
+
+    stamp = timezone.now().strftime("%Y%m%dT%H%M%S")
+    fields = [field.attname for field in Message._meta.concrete_fields]
+    writers = {}
+    parts = {}
+    segments = []
+    #Deleting the messages deletes their emails and scores too
+    related = {"sent_at": F("outbox_email__sent_at"),
+               **{column: F(f"scores__{column}") for column in scoring.COLUMNS.values()}}
+    rows = archivable(before).order_by("pk").values(*fields, **related)
+    for row in rows.iterator(chunk_size=chunk_size):
+        term = term_of(row["created_at"])
+        writer = writers.get(term)
+        if writer is None:
+            parts[term] = parts.get(term, 0) + 1
+            path = archive_dir(directory) / term / f"messages-{term}-{stamp}-{parts[term]:03d}{SUFFIX}"
+            writer = writers[term] = SegmentWriter(path)
+        writer.write(row)
+        if writer.count >= segment_rows:
+            segments.append(writer.close())
+            del writers[term]
+    segments += [writer.close() for writer in writers.values()]
+    return segments
+
+
+def delete_archived(segment: Path, batch_size: int = None, pause: float = 0.0) -> int:
+    """
+    Delete the messages of a verified segment from the database in transactions of at most
+    batch_size rows, sleeping pause seconds between them, and clear its pending marker.
+    Return the number of messages deleted.
+    """
+
+    batch_size = batch_size or settings.ARCHIVE_DELETE_BATCH_SIZE
+    deleted = 0
+    batch = []
+
+    def flush():
+        nonlocal deleted
+        with transaction.atomic():
+            deleted += Message.objects.filter(pk__in=batch).delete()[1].get(Message._meta.label, 0)
+        batch.clear()
+        if pause:
+            time.sleep(pause)
+
+    for record in read(segment):
+        batch.append(record["id"])
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    pending_path(segment).unlink(missing_ok=True)
+    return deleted
+
+
+def pending_segments(directory=None) -> list:
+    """
+    Return the segments whose messages are not all deleted from the database yet. The leftovers
+    of segments interrupted before they were complete are removed; their messages are still
+    in the database.
+    """
+
+    pending = []
+    for marker in archive_dir(directory).glob(f"*/*{SUFFIX}.pending"):
+        segment = marker.with_name(marker.name[:-len(".pending")])
+        if segment.exists():
+            pending.append(segment)
+        else:
+            for leftover in (segment.with_name(segment.name + ".partial"), checksum_path(segment), marker):
+                leftover.unlink(missing_ok=True)
+    return sorted(pending)
+
+
+def segments(terms: list = None, directory=None) -> list:
+    """Return the paths of the archived segments, of the given terms only if any, oldest term first."""
+
+    root = archive_dir(directory)
+    if terms:
+        paths = [path for term in terms for path in (root / term).glob(f"*{SUFFIX}")]
+    else:
+        paths = root.glob(f"*/*{SUFFIX}")
+    return sorted(paths, key=lambda path: (term_key(path.parent.name), path.name))
+
+
+def verify(segment: Path):
+    """Raise ArchiveError unless the segment matches its checksum."""
+
+    try:
+        expected = checksum_path(segment).read_text().split()[0]
+    except (FileNotFoundError, IndexError):
+        raise ArchiveError(f"{segment} has no checksum")
+    if digest(segment) != expected:
+        raise ArchiveError(f"{segment} does not match its checksum")
+
+
+def read(segment: Path, check: bool = True):
+    """Yield the archived messages of a segment as dicts, after verifying its checksum unless check is False."""
+
+    if check:
+        verify(segment)
+    with gzip.open(segment, "rb") as fp:
+        for line in fp:
+            yield json.loads(line)
+
+
+def scan(terms: list = None, directory=None, check: bool = True, **match):
+    """
+    Yield the archived messages of every segment (of the given terms only if any) whose fields
+    equal the keyword arguments, e.g. scan(teacher_id="jan.vitek@northeastern.edu", is_malicious=True).
+    """
+
+    for segment in segments(terms, directory):
+        for record in read(segment, check):
+            if all(record.get(field) == value for field, value in match.items()):
+                yield record
@@ -0,0 +1,97 @@
+"""
+One message from a student to several teachers at once, e.g. every teacher of a course.
+
+The shared text is moderated once, every Message row is inserted with one bulk_create and the
+accepted ones are queued in the email outbox with another, all in one transaction. The outbox
+sender then delivers them together over one SMTP session.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import dedup, moderation, scoring
+from .models import Message, MessageJob, OutboxEmail
+
+REJECTED = ("This message contains toxic or offensive content and will not be sent to the teachers. "
+            "Your account has sent {infractions} malicious messages.{suspended}")
+QUEUED = "This message has been queued for delivery to {count} teachers."
+
+
+def create_messages(student, teachers: list, body: str, **fields) -> list:
+    """Insert a message from the student to each teacher with one bulk_create and return them with their ids."""
+
+    now = timezone.now()
+    messages = [Message(student=student, teacher=teacher, message_body=body, created_at=now, **fields)
+                for teacher in teachers]
+    Message.objects.bulk_create(messages)
+    if any(message.pk is None for message in messages):
+        #MySQL does not return the primary keys of bulk inserted rows: read them back by sender and time
+        ids = dict(Message.objects.filter(student=student, created_at=now, teacher__in=teachers)
+                   .values_list("teacher_id", "id"))
+        for message in messages:
+            message.pk = ids[message.teacher_id]
+    return messages
+
+
+def send_to_teachers(student, teachers: list, body: str) -> tuple:
+    """
+    Moderate the text once and send it from the student to every teacher. Near duplicates of a
+    clean message the student recently sent to one of the teachers are suppressed for that teacher.
+    Returns (messages, result) where result is a dict with a status and message.
+    If moderation fails, the messages are queued for the pipeline workers instead (and held if
+    Perspective is unavailable) and result is None.
+    """
+
+    checked = Message(message_body=body)
+    try:
+        malicious = checked.is_malicious_msg()
+    except moderation.ModerationUnavailable as e:
+        available_at = timezone.now() + timedelta(seconds=e.retry_after)
+        with transaction.atomic():
+            messages = create_messages(student, teachers, body, status=Message.Status.HELD)
+            MessageJob.objects.bulk_create([MessageJob(message=message, available_at=available_at)
+                                            for message in messages])
+        return messages, None
+    except Exception:
+        with transaction.atomic():
+            messages = create_messages(student, teachers, body)
+            MessageJob.objects.bulk_create([MessageJob(message=message) for message in messages])
+        return messages, None
+
+    if malicious:
+        with transaction.atomic():
+            messages = create_messages(student, teachers, body, is_malicious=True, status=Message.Status.REJECTED)
+            scoring.store(messages, checked.moderation_scores)
+        for message in messages:
+            leader = dedup.leader_of(message)
+            if leader is None:
+                dedup.decide(message, True)
+            elif leader.malicious:
+                dedup.join(leader, message)
+        #One text, one infraction
+        infractions = student.increment_infractions()
+        suspended = "" if student.is_active else " Your account has been suspended."
+        return messages, {"Rejected": REJECTED.format(infractions=infractions, suspended=suspended)}
+
+    with transaction.atomic():
+        messages = create_messages(student, teachers, body)
+        scoring.store(messages, checked.moderation_scores)
+        delivered = []
+        suppressed = []
+        for message in messages:
+            leader = dedup.leader_of(message)
+            if leader is None:
+                dedup.decide(message, False)
+            #The text was moderated here, so only a clean leader's flood is joined
+            if leader is None or leader.malicious is not False or dedup.join(leader, message):
+                delivered.append(message)
+            else:
+                message.status = Message.Status.SUPPRESSED
+                suppressed.append(message.pk)
+        Message.objects.filter(pk__in=suppressed).update(status=Message.Status.SUPPRESSED)
+        OutboxEmail.objects.bulk_create([
+            OutboxEmail(message=message, recipient=message.teacher_id, body=body, created_at=message.created_at)
+            for message in delivered
+        ])
+    return messages, {"Success": QUEUED.format(count=len(delivered))}
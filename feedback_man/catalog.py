@@ -0,0 +1,299 @@
+"""
+Bulk ingestion of teacher and course catalogs.
+
+Catalog dumps are read as a stream of course records:
+
+    {"subject": "CS", "course_num": 2500, "class_name": "Fundamentals of Computer Science 1",
+     "semester": "FA", "year": 2023,
+     "teachers": [{"name": "Ben Lerner", "email": "b.lerner@northeastern.edu", "college": "Khoury"}]}
+
+either as a JSON array, JSON Lines, or CSV with one row per course and teacher pairing (columns
+subject, course_num, class_name, semester, year, teacher_name, teacher_email, college).
+Records are upserted in chunks with bulk_create(update_conflicts=True); only new or changed
+teachers and courses are written, and only missing Course.teachers links are inserted.
+Teachers are never unlinked from courses by ingestion.
+
+MySQL's ON DUPLICATE KEY UPDATE takes no conflict target and fires on any unique key, so a new
+teacher whose name (also unique) belongs to another teacher would overwrite that teacher instead
+of being inserted. Such teachers are skipped and reported on every backend before upserting.
+"""
+import csv
+import json
+from dataclasses import dataclass, field
+
+from django.db import connections, router, transaction
+
+from .models import Course, Teacher
+from .search import bump_catalog_version, index_courses, index_teachers
+
+COURSE_KEY = ("subject", "course_num", "semester", "year")
+
+
+@dataclass
+class IngestStats:
+    """Counts of the rows read and written by an ingestion run."""
+
+    records: int = 0
+    skipped: int = 0
+    teachers_created: int = 0
+    teachers_updated: int = 0
+    courses_created: int = 0
+    courses_updated: int = 0
+    teachers_skipped: int = 0
+    links_created: int = 0
+    errors: list = field(default_factory=list)
+
+    @property
+    def changed(self) -> bool:
+        return any((self.teachers_created, self.teachers_updated, self.courses_created,
+                    self.courses_updated, self.links_created))
+
+
+def iter_json_array(fp, read_size: int = 1 << 16):
+    """Yield the objects of a top-level JSON array from a text file without loading it whole."""
+
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    started = False
+    eof = False
+    while True:
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= len(buffer) and not eof:
+            chunk = fp.read(read_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        if pos >= len(buffer):
+            raise ValueError("Unexpected end of JSON array")
+        if not started:
+            if buffer[pos] != "[":
+                raise ValueError("Catalog JSON must be an array of course records")
+            started = True
+            pos += 1
+            continue
+        if buffer[pos] == "]":
+            return
+        try:
+            obj, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = fp.read(read_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        yield obj
+        pos = end
+
+
+def iter_json_lines(fp):
+    """Yield the object on each non-empty line of a JSON Lines file."""
+
+    for line in fp:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_csv(fp):
+    """Yield a course record for each row of a CSV file of course and teacher pairings."""
+
+    for row in csv.DictReader(fp):
+        teachers = []
+        if row.get("teacher_email"):
+            teachers.append({"name": row["teacher_name"], "email": row["teacher_email"],
+                             "college": row.get("college", "")})
+        yield {
+            "subject": row["subject"],
+            "course_num": row["course_num"],
+            "class_name": row["class_name"],
+            "semester": row["semester"],
+            "year": row["year"],
+            "teachers": teachers,
+        }
+
+
+def read_records(fp, file_format: str):
+    """Yield course records from the open file in the given format: json, jsonl or csv."""
+
+    readers = {"json": iter_json_array, "jsonl": iter_json_lines, "csv": iter_csv}
+    return readers[file_format](fp)
+
+
+def clean_record(record: dict) -> dict:
+    """Validate and normalize a course record. Raises ValueError if it is unusable."""
+
+    semester = str(record["semester"]).upper()
+    if semester not in Course.Semester.values:
+        raise ValueError(f"Unknown semester {record['semester']!r}")
+    return {
+        "subject": str(record["subject"]).strip().upper(),
+        "course_num": int(record["course_num"]),
+        "class_name": str(record["class_name"]).strip(),
+        "semester": semester,
+        "year": int(record["year"]),
+        "teachers": [
+            {"teacher_name": teacher["name"].strip(), "email": teacher["email"].strip().lower(),
+             "college": teacher.get("college", "").strip()}
+            for teacher in record.get("teachers", [])
+        ],
+    }
+
+
+def conflict_target(model, fields: list) -> dict:
+    """
+    Return the unique_fields argument of an upsert of the model on the given fields, or nothing
+    on backends which take no conflict target (MySQL).
+    """
+
+    if connections[router.db_for_write(model)].features.supports_update_conflicts_with_target:
+        return {"unique_fields": fields}
+    return {}
+
+
+def upsert_teachers(teachers: dict, stats: IngestStats) -> set:
+    """
+    Create or update the given teachers (keyed by email), writing only new or changed rows.
+    A teacher whose name belongs to a teacher with another email is skipped and reported.
+    Returns the emails of the given teachers which exist afterwards.
+    """
+
+    existing = {
+        email: (name, college)
+        for email, name, college in Teacher.objects.filter(email__in=teachers)
+        .values_list("email", "teacher_name", "college")
+    }
+    owners = dict(
+        Teacher.objects.filter(teacher_name__in={teacher["teacher_name"] for teacher in teachers.values()})
+        .values_list("teacher_name", "email")
+    )
+    changed = []
+    for email, teacher in teachers.items():
+        if existing.get(email) == (teacher["teacher_name"], teacher["college"]):
+            continue
+        #The first teacher of the chunk with a new name claims it
+        owner = owners.setdefault(teacher["teacher_name"], email)
+        if owner != email:
+            stats.teachers_skipped += 1
+            stats.errors.append(f"teacher {email}: the name {teacher['teacher_name']!r} belongs to {owner}")
+            continue
+        changed.append(Teacher(**teacher))
+    if not changed:
+        return set(existing)
+
+    Teacher.objects.bulk_create(changed, update_conflicts=True, update_fields=["teacher_name", "college"],
+                                **conflict_target(Teacher, ["email"]))
+    index_teachers(changed)
+    created = sum(1 for teacher in changed if teacher.email not in existing)
+    stats.teachers_created += created
+    stats.teachers_updated += len(changed) - created
+    return set(existing) | {teacher.email for teacher in changed}
+
+
+def existing_courses(keys) -> dict:
+    """Return a dict of course key to (pk, class_name) for the courses with the given keys."""
+
+    keys = set(keys)
+    candidates = Course.objects.filter(
+        subject__in={key[0] for key in keys},
+        course_num__in={key[1] for key in keys},
+        year__in={key[3] for key in keys},
+    ).values_list("pk", "class_name", *COURSE_KEY)
+    return {tuple(row[2:]): row[:2] for row in candidates if tuple(row[2:]) in keys}
+
+
+def upsert_courses(courses: dict, stats: IngestStats) -> dict:
+    """
+    Create or update the given courses (keyed by COURSE_KEY), writing only new or changed rows.
+    Returns a dict of course key to primary key.
+    """
+
+    existing = existing_courses(courses)
+    changed = [
+        Course(**{name: value for name, value in course.items() if name != "teachers"})
+        for key, course in courses.items()
+        if key not in existing or existing[key][1] != course["class_name"]
+    ]
+    if changed:
+        Course.objects.bulk_create(changed, update_conflicts=True, update_fields=["class_name"],
+                                   **conflict_target(Course, list(COURSE_KEY)))
+        ids = {key: pk for key, (pk, _) in existing_courses(courses).items()}
+        for course in changed:
+            course.pk = ids[tuple(getattr(course, name) for name in COURSE_KEY)]
+        index_courses(changed)
+        created = sum(1 for course in changed if tuple(getattr(course, name) for name in COURSE_KEY) not in existing)
+        stats.courses_created += created
+        stats.courses_updated += len(changed) - created
+    else:
+        ids = {key: pk for key, (pk, _) in existing.items()}
+    return ids
+
+
+def link_teachers(courses: dict, ids: dict, emails: set, stats: IngestStats):
+    """Insert the Course.teachers links to the given teachers of the given courses which do not exist yet."""
+
+    Link = Course.teachers.through
+    wanted = {
+        (ids[key], teacher["email"])
+        for key, course in courses.items()
+        for teacher in course["teachers"]
+        if teacher["email"] in emails
+    }
+    existing = set(
+        Link.objects.filter(course_id__in=set(ids.values())).values_list("course_id", "teacher_id")
+    )
+    missing = wanted - existing
+    Link.objects.bulk_create(
+        [Link(course_id=course_id, teacher_id=email) for course_id, email in missing],
+        ignore_conflicts=True,
+    )
+    stats.links_created += len(missing)
+
+
+def ingest_chunk(records: list, stats: IngestStats):
+    """Upsert one chunk of cleaned course records in a single transaction."""
+
+    teachers = {}
+    courses = {}
+    for record in records:
+        key = tuple(record[name] for name in COURSE_KEY)
+        course = courses.setdefault(key, {**record, "teachers": []})
+        course["class_name"] = record["class_name"]
+        course["teachers"].extend(record["teachers"])
+        for teacher in record["teachers"]:
+            teachers[teacher["email"]] = teacher
+
+    with transaction.atomic():
+        emails = upsert_teachers(teachers, stats)
+        ids = upsert_courses(courses, stats)
+        link_teachers(courses, ids, emails, stats)
+
+
+def ingest(records, chunk_size: int = 1000) -> IngestStats:
+    """
+    Upsert the course records and their teachers chunk_size records at a time.
+    Records which fail validation are skipped and reported in the returned stats.
+    """
+
+    stats = IngestStats()
+    chunk = []
+    for record in records:
+        stats.records += 1
+        try:
+            chunk.append(clean_record(record))
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            stats.skipped += 1
+            stats.errors.append(f"record {stats.records}: {e!r}")
+            continue
+        if len(chunk) == chunk_size:
+            ingest_chunk(chunk, stats)
+            chunk = []
+    if chunk:
+        ingest_chunk(chunk, stats)
+
+    if stats.changed:
+        bump_catalog_version()
+    return stats
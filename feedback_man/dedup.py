@@ -0,0 +1,248 @@
+"""
+Near-duplicate detection of messages to the same teacher, to collapse floods.
+
+Each message text gets a 64-bit SimHash over its normalized words and word pairs, so lightly
+edited copies (changed words, leetspeak, punctuation) get fingerprints a few bits apart. The
+fingerprints of recent messages are indexed per teacher in DEDUP_MAX_DISTANCE + 1 bands: two
+fingerprints within DEDUP_MAX_DISTANCE bits agree on at least one whole band, so a lookup is one
+dict probe per band. The first message of a flood (its leader) is moderated; its copies, from
+any student, are not moderated again but share its decision, so a flood sent from several
+accounts costs one moderation call. Delivery is collapsed per student: a student's copies of a
+message they already sent are suppressed (or rejected without another infraction), while another
+student's copy of a clean message is delivered, since different students often send a teacher the
+same short text ("Thanks for a great class"), and a copy of a malicious one is rejected.
+A copy whose leader is still being moderated waits up to PERSPECTIVE_DEADLINE seconds for its
+decision, and is otherwise held and looked up again later rather than decided without it.
+Entries are evicted DEDUP_WINDOW seconds after their leader arrived, and beyond DEDUP_MAX_ENTRIES.
+The index is per process.
+"""
+import hashlib
+import threading
+import time
+from collections import Counter, deque
+
+from django.conf import settings
+
+from . import moderation
+from .prescreen import normalize
+
+BITS = 64
+MASK = (1 << BITS) - 1
+
+
+def features(text: str) -> list:
+    """Return the words and adjacent word pairs of the normalized text."""
+
+    words = normalize(text).split()
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+
+def simhash(text: str) -> int:
+    """Return the 64-bit SimHash of the text's features."""
+
+    weights = [0] * BITS
+    for feature in features(text):
+        value = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "big")
+        for bit in range(BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class LeaderUndecided(moderation.ModerationUnavailable):
+    """The message is a near duplicate of a flood leader whose moderation decision is not known yet."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(retry_after, "A near duplicate of this message is still being moderated")
+
+
+class Leader:
+    """The first message of a flood to a teacher, its moderation decision once made, and the students in the flood."""
+
+    __slots__ = ("teacher", "fingerprint", "message_id", "arrived", "malicious", "students")
+
+    def __init__(self, teacher, student, fingerprint: int, message_id: int, arrived: float):
+        self.teacher = teacher
+        self.fingerprint = fingerprint
+        self.message_id = message_id
+        self.arrived = arrived
+        #None until the leader has been moderated
+        self.malicious = None
+        #Students who sent a message of the flood which was delivered or rejected
+        self.students = {student}
+
+
+class NearDuplicateIndex:
+    """Banded SimHash index of the flood leaders of the last window seconds, per teacher."""
+
+    def __init__(self, window: float, max_distance: int, max_entries: int):
+        self.window = window
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        bands = max_distance + 1
+        width = BITS // bands
+        #(shift, mask) of each band, the last one taking the leftover bits
+        self.bands = [(band * width, (1 << (width if band < bands - 1 else BITS - band * width)) - 1)
+                      for band in range(bands)]
+        self.buckets = {}
+        self.leaders = deque()
+        self.by_message = {}
+        self.lock = threading.Lock()
+        #Notified whenever a leader is decided
+        self.decided = threading.Condition(self.lock)
+
+    def keys(self, teacher, fingerprint: int) -> list:
+        return [(teacher, band, fingerprint >> shift & mask) for band, (shift, mask) in enumerate(self.bands)]
+
+    def evict(self, now: float):
+        while self.leaders and (len(self.leaders) > self.max_entries or now - self.leaders[0].arrived > self.window):
+            leader = self.leaders.popleft()
+            del self.by_message[leader.message_id]
+            for key in self.keys(leader.teacher, leader.fingerprint):
+                bucket = self.buckets[key]
+                bucket.remove(leader)
+                if not bucket:
+                    del self.buckets[key]
+
+    def leader_of(self, teacher, student, fingerprint: int, message_id: int, now: float = None):
+        """
+        Return the leader of the flood to the teacher the message belongs to, or None after making the
+        message the leader of a new one.
+        """
+
+        now = time.monotonic() if now is None else now
+        keys = self.keys(teacher, fingerprint)
+        with self.lock:
+            self.evict(now)
+            if message_id in self.by_message:
+                #Moderated again after a retry
+                return None
+            for key in keys:
+                for leader in self.buckets.get(key, ()):
+                    if distance(leader.fingerprint, fingerprint) <= self.max_distance:
+                        return leader
+            leader = Leader(teacher, student, fingerprint, message_id, now)
+            self.leaders.append(leader)
+            self.by_message[message_id] = leader
+            for key in keys:
+                self.buckets.setdefault(key, []).append(leader)
+            #Leaders beyond max_entries go now rather than at the next lookup
+            self.evict(now)
+        return None
+
+    def decide(self, message_id: int, malicious: bool):
+        """Record the moderation decision of a leader."""
+
+        with self.decided:
+            leader = self.by_message.get(message_id)
+            if leader is not None:
+                leader.malicious = malicious
+                self.decided.notify_all()
+
+    def wait(self, leader: Leader, timeout: float) -> bool:
+        """Wait up to timeout seconds for the leader to be decided; return whether it was."""
+
+        with self.decided:
+            return self.decided.wait_for(lambda: leader.malicious is not None, timeout)
+
+    def join(self, leader: Leader, student) -> bool:
+        """Add the student to the leader's flood and return whether they were not in it yet."""
+
+        with self.lock:
+            if student in leader.students:
+                return False
+            leader.students.add(student)
+            return True
+
+    def __len__(self):
+        return len(self.leaders)
+
+
+_index = None
+_index_lock = threading.Lock()
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def get_index() -> NearDuplicateIndex:
+    """Return the process-wide near-duplicate index."""
+
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = NearDuplicateIndex(settings.DEDUP_WINDOW, settings.DEDUP_MAX_DISTANCE, settings.DEDUP_MAX_ENTRIES)
+    return _index
+
+
+def leader_of(message):
+    """
+    Return the Leader of the recent flood to the message's teacher the message is a near duplicate
+    of, or None if it is not one (it then leads a new flood) or detection is disabled.
+    """
+
+    if not settings.DEDUP_ENABLED:
+        return None
+    leader = get_index().leader_of(message.teacher_id, message.student_id, simhash(message.message_body), message.pk)
+    with _stats_lock:
+        _stats["checked"] += 1
+    return leader
+
+
+def undecided(leader: Leader) -> LeaderUndecided:
+    """Return the error to hold a copy of the undecided leader with, until it can be decided."""
+
+    return LeaderUndecided(max(settings.PERSPECTIVE_DEADLINE, moderation.get_breaker().retry_after()))
+
+
+def wait(leader: Leader):
+    """
+    Wait for the leader's moderation decision, as long as moderating it may take. Raises
+    LeaderUndecided if it is not decided in time, or right away while Perspective is unavailable.
+    """
+
+    if leader.malicious is None and (moderation.get_breaker().retry_after()
+                                     or not get_index().wait(leader, settings.PERSPECTIVE_DEADLINE)):
+        raise undecided(leader)
+
+
+def join(leader: Leader, message) -> bool:
+    """
+    Add the message's student to the flood of the decided leader, and return whether they are new
+    to it: their copy is then delivered or rejected like the leader, and otherwise not sent again.
+    """
+
+    new = get_index().join(leader, message.student_id)
+    with _stats_lock:
+        _stats["rejected" if leader.malicious else "shared" if new else "suppressed"] += 1
+    return new
+
+
+def decide(message, malicious: bool):
+    """Record the moderation decision of a message which leads a flood."""
+
+    if settings.DEDUP_ENABLED:
+        get_index().decide(message.pk, malicious)
+
+
+def stats() -> dict:
+    """
+    Return this process's near-duplicate counters: messages checked, duplicates suppressed (a
+    student's copies, not delivered again), delivered with the decision shared from another
+    student's message, and rejected with their malicious leader, and leaders indexed.
+    """
+
+    with _stats_lock:
+        checked, suppressed, shared, rejected = (_stats[event] for event in ("checked", "suppressed", "shared",
+                                                                              "rejected"))
+    return {
+        "checked": checked,
+        "suppressed": suppressed,
+        "shared": shared,
+        "rejected": rejected,
+        "duplicate_rate": (suppressed + shared + rejected) / checked if checked else 0.0,
+        "leaders": len(get_index()),
+    }
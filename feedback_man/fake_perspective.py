@@ -0,0 +1,205 @@
+"""
+A local stand-in for the Perspective comment analyzer API.
+
+Serves a minimal discovery document, the comments:analyze method and the batch endpoint
+so that the moderation client can be exercised and benchmarked without network access.
+Scores are deterministic: any comment containing one of TOXIC_WORDS scores 0.9 on every
+requested attribute, everything else scores 0.1. Every response is delayed by the server's
+latency to simulate the network round trip, and a share error_rate of the analyze and batch
+requests fail with error_status, to simulate an outage. Both can be changed while serving.
+"""
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TOXIC_WORDS = {"idiot", "stupid", "moron", "hate"}
+
+ANALYZE_PATH = "/v1alpha1/comments:analyze"
+BATCH_PATH = "/batch"
+DISCOVERY_PATH = "/$discovery/rest"
+
+
+def score_comment(body: dict) -> dict:
+    """Build an analyze response for the given analyze request body."""
+
+    words = set(body["comment"]["text"].lower().split())
+    value = 0.9 if words & TOXIC_WORDS else 0.1
+    return {
+        "attributeScores": {
+            attribute: {"summaryScore": {"value": value, "type": "PROBABILITY"}}
+            for attribute in body.get("requestedAttributes", {})
+        },
+        "languages": ["en"],
+    }
+
+
+def discovery_document(root_url: str) -> dict:
+    """Return the smallest discovery document googleapiclient will build a client from."""
+
+    return {
+        "kind": "discovery#restDescription",
+        "discoveryVersion": "v1",
+        "id": "commentanalyzer:v1alpha1",
+        "name": "commentanalyzer",
+        "version": "v1alpha1",
+        "rootUrl": root_url,
+        "servicePath": "",
+        "batchPath": BATCH_PATH.lstrip("/"),
+        "parameters": {
+            "key": {"type": "string", "location": "query"},
+        },
+        "schemas": {
+            "AnalyzeCommentRequest": {"id": "AnalyzeCommentRequest", "type": "object"},
+            "AnalyzeCommentResponse": {"id": "AnalyzeCommentResponse", "type": "object"},
+        },
+        "resources": {
+            "comments": {
+                "methods": {
+                    "analyze": {
+                        "id": "commentanalyzer.comments.analyze",
+                        "path": ANALYZE_PATH.lstrip("/"),
+                        "flatPath": ANALYZE_PATH.lstrip("/"),
+                        "httpMethod": "POST",
+                        "parameters": {},
+                        "parameterOrder": [],
+                        "request": {"$ref": "AnalyzeCommentRequest"},
+                        "response": {"$ref": "AnalyzeCommentResponse"},
+                    }
+                }
+            }
+        },
+    }
+
+
+class PerspectiveHandler(BaseHTTPRequestHandler):
+    """Request handler implementing the discovery, analyze and batch endpoints."""
+
+    protocol_version = "HTTP/1.1"
+    #Headers and body are written separately; without this, delayed ACKs stall each response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        if self.path.split("?")[0] != DISCOVERY_PATH:
+            return self._send(404, b"{}")
+        self.server.counts["discovery"] += 1
+        root_url = f"http://{self.headers['Host']}/"
+        self._send(200, json.dumps(discovery_document(root_url)).encode())
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self.path.split("?")[0]
+        with self.server.track_request():
+            time.sleep(self.server.latency)
+        if path in (ANALYZE_PATH, BATCH_PATH) and self.server.inject_error():
+            self.server.counts["errors"] += 1
+            error = {"error": {"code": self.server.error_status, "message": "Injected error"}}
+            return self._send(self.server.error_status, json.dumps(error).encode())
+        if path == ANALYZE_PATH:
+            self.server.counts["analyze"] += 1
+            return self._send(200, json.dumps(score_comment(json.loads(body))).encode())
+        if path == BATCH_PATH:
+            self.server.counts["batch"] += 1
+            return self._batch(body)
+        self._send(404, b"{}")
+
+    def _batch(self, body: bytes):
+        """Answer a multipart/mixed batch by scoring every embedded analyze request."""
+
+        header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+        request = BytesParser(policy=HTTP).parsebytes(header + body)
+        boundary = "batch_nameless_boundary"
+        parts = []
+        for part in request.iter_parts():
+            inner = part.get_payload(decode=True).decode()
+            comment = json.loads(inner.split("\r\n\r\n", 1)[1] if "\r\n\r\n" in inner else inner.split("\n\n", 1)[1])
+            self.server.counts["comments"] += 1
+            payload = json.dumps(score_comment(comment))
+            content_id = part["Content-ID"].strip("<>")
+            parts.append(
+                f"--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                "HTTP/1.1 200 OK\r\n"
+                "Content-Type: application/json; charset=UTF-8\r\n"
+                f"Content-Length: {len(payload)}\r\n\r\n"
+                f"{payload}\r\n"
+            )
+        parts.append(f"--{boundary}--\r\n")
+        self._send(200, "".join(parts).encode(), f"multipart/mixed; boundary={boundary}")
+
+    def _send(self, status: int, content: bytes, content_type: str = "application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class FakePerspectiveServer(ThreadingHTTPServer):
+    """
+    A threaded HTTP server standing in for Perspective. Use as a context manager to
+    serve from a background thread on a free local port.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address=("127.0.0.1", 0), latency: float = 0.0, error_rate: float = 0.0,
+                 error_status: int = 503, seed: int = 0):
+        super().__init__(address, PerspectiveHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.counts = {"discovery": 0, "analyze": 0, "batch": 0, "comments": 0, "errors": 0, "peak_in_flight": 0}
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self.in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        self._thread = None
+
+    def inject_error(self) -> bool:
+        """Return whether to fail the current request, error_rate of the time."""
+
+        with self._random_lock:
+            return self._random.random() < self.error_rate
+
+    @contextmanager
+    def track_request(self):
+        """Count a request as in flight, recording the most ever in flight at once."""
+
+        with self._in_flight_lock:
+            self.in_flight += 1
+            self.counts["peak_in_flight"] = max(self.counts["peak_in_flight"], self.in_flight)
+        try:
+            yield
+        finally:
+            with self._in_flight_lock:
+                self.in_flight -= 1
+
+    @property
+    def discovery_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{DISCOVERY_PATH}"
+
+    @property
+    def analyze_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{ANALYZE_PATH}"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,58 @@
+"""
+A small thread-safe in-process LRU cache with per-entry expiry, used as the first level in
+front of the shared Django caches.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+_missing = object()
+
+
+class LRUCache:
+    """
+    A thread-safe LRU cache holding at most maxsize entries, each expiring ttl seconds after
+    it was set (or never, if ttl is None).
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the value for key, or default if it is missing or expired."""
+
+        with self._lock:
+            entry = self._entries.get(key, _missing)
+            if entry is _missing:
+                return default
+            value, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = _missing):
+        """Store value under key, evicting the least recently used entry if the cache is full."""
+
+        ttl = self.ttl if ttl is _missing else ttl
+        expires = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
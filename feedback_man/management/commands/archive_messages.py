@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from feedback_man import archive
+
+
+class Command(BaseCommand):
+    help = ("Move messages older than a cutoff out of the database into compressed, checksummed JSON Lines "
+            "segment files per term, then delete them in small batches. Finishes the deletions of an "
+            "interrupted run first. Run one at a time.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.ARCHIVE_AFTER_DAYS,
+                            help="Archive messages created more than this many days ago.")
+        parser.add_argument("--dir", help="Archive directory, ARCHIVE_DIR by default.")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Messages read per database round trip.")
+        parser.add_argument("--segment-rows", type=int, default=100_000, help="Maximum messages per segment file.")
+        parser.add_argument("--batch-size", type=int, default=settings.ARCHIVE_DELETE_BATCH_SIZE,
+                            help="Messages deleted per transaction.")
+        parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between delete batches.")
+
+    def handle(self, *args, **options):
+        for segment in archive.pending_segments(options["dir"]):
+            deleted = archive.delete_archived(segment, options["batch_size"], options["pause"])
+            self.stdout.write(f"Finished {segment.name}: deleted {deleted} messages")
+
+        before = timezone.now() - timedelta(days=options["days"])
+        segments = archive.archive(before, options["dir"], options["chunk_size"], options["segment_rows"])
+        total = 0
+        for segment in segments:
+            deleted = archive.delete_archived(segment, options["batch_size"], options["pause"])
+            total += deleted
+            self.stdout.write(f"Archived {segment.name}: deleted {deleted} messages")
+        self.stdout.write(f"Archived {total} messages created before {before:%Y-%m-%d} in {len(segments)} segments")
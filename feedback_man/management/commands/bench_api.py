@@ -0,0 +1,237 @@
+import json
+import random
+import statistics
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from unittest import mock
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from rest_framework_simplejwt.tokens import AccessToken
+
+from feedback_man import accounts, moderation, synthetic, verdicts
+from feedback_man.models import Course, Message, StudentAccount
+from nameless_api import cache
+
+#Scores of a clean message, returned by the stubbed moderation calls
+CLEAN_SCORES = {attribute: 0.1 for attribute in moderation.ATTRIBUTES}
+
+
+async def clean_scores(text):
+    return CLEAN_SCORES
+
+
+class Command(BaseCommand):
+    help = ("Load-test every API endpoint on a throwaway test database filled with a synthetic catalog, "
+            "with moderation stubbed out, and report latency percentiles, throughput and SQL queries per "
+            "request. Results are written as JSON for comparison between commits.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--teachers", type=int, default=2000)
+        parser.add_argument("--courses", type=int, default=5000)
+        parser.add_argument("--students", type=int, default=1000)
+        parser.add_argument("--messages", type=int, default=20000)
+        parser.add_argument("--requests", type=int, default=500, help="Requests per endpoint.")
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--warmup", type=int, default=20, help="Unrecorded requests per endpoint.")
+        parser.add_argument("--endpoints", nargs="+", help="Only run the endpoints with these names.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", type=Path, default=Path("bench_api.json"))
+        parser.add_argument("--compare", type=Path, help="Earlier results to report changes against.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            with override_settings(
+                MESSAGE_THROTTLE_BURST=10 ** 9,
+                EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+            ), mock.patch.object(moderation, "analyze", lambda text: CLEAN_SCORES), \
+                    mock.patch.object(moderation, "aanalyze", clean_scores):
+                start = time.perf_counter()
+                catalog = synthetic.generate(options["teachers"], options["courses"], options["students"],
+                                             options["messages"], seed=options["seed"])
+                self.stdout.write(f"Generated the catalog in {time.perf_counter() - start:.1f}s")
+                results = self.run_endpoints(catalog, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            "meta": {
+                "commit": self.commit(),
+                "created": datetime.now(timezone.utc).isoformat(),
+                "database": connection.vendor,
+                "options": {name: options[name] for name in (
+                    "teachers", "courses", "students", "messages", "requests", "concurrency", "warmup", "seed"
+                )},
+            },
+            "endpoints": results,
+        }
+        options["output"].write_text(json.dumps(report, indent=2) + "\n")
+        self.stdout.write(f"Wrote {options['output']}")
+
+        if options["compare"]:
+            self.compare(json.loads(options["compare"].read_text())["endpoints"], results)
+
+    def endpoints(self, catalog, rng) -> dict:
+        """Return {name: (method, make_request)} where make_request() returns (path, data, headers)."""
+
+        students = StudentAccount.objects.filter(pk__in=catalog.students[:100])
+        tokens = {student.pk: f"Bearer {AccessToken.for_user(student)}" for student in students}
+        #Each student's own messages, the only ones they may look up
+        sent = {}
+        for student_id, message_id in Message.objects.filter(student__in=students).values_list("student_id", "id"):
+            sent.setdefault(student_id, []).append(message_id)
+        senders = sorted(sent)
+        token_list = list(tokens.values())
+        #The most messaged teacher, whose inbox is the deepest
+        inbox = catalog.teachers[0] if catalog.teachers else None
+        admin = StudentAccount.objects.create_superuser("bench.admin@northeastern.edu", "bench")
+        admin_token = f"Bearer {AccessToken.for_user(admin)}"
+        offerings = list(Course.objects.filter(pk__in=rng.sample(catalog.courses, min(200, len(catalog.courses))))
+                         .values_list("subject", "course_num", "class_name"))
+
+        def teacher_query():
+            return rng.choice(synthetic.LAST_NAMES + synthetic.FIRST_NAMES)[:rng.randint(3, 6)].lower()
+
+        def course_query():
+            subject, course_num, _ = rng.choice(offerings)
+            return rng.choice([f"{subject} {course_num}", subject.lower(), f"{subject}{course_num}"])
+
+        def autocomplete_query():
+            subject, course_num, class_name = rng.choice(offerings)
+            return rng.choice([f"{subject} {str(course_num)[:2]}", class_name.split()[0][:4].lower()])
+
+        def message():
+            #Sent by the student of the token auth() picks
+            return {"teacher": rng.choice(catalog.teachers), "message_body": f"benchmark message {rng.random()}"}
+
+        def auth():
+            return {"HTTP_AUTHORIZATION": rng.choice(token_list)}
+
+        def message_status():
+            student = rng.choice(senders)
+            return f"/message/{rng.choice(sent[student])}", None, {"HTTP_AUTHORIZATION": tokens[student]}
+
+        endpoints = {}
+        for prefix in ("", "async/"):
+            name = prefix.replace("/", "_")
+            endpoints.update({
+                f"{name}search_teacher": ("get", lambda p=prefix: (
+                    f"/{p}search/teacher/{teacher_query()}", None, auth())),
+                f"{name}search_course": ("get", lambda p=prefix: (
+                    f"/{p}search/course/{course_query()}", None, auth())),
+                f"{name}autocomplete_course": ("get", lambda p=prefix: (
+                    f"/{p}search/course/autocomplete/{autocomplete_query()}", None, auth())),
+                f"{name}get_teacher": ("get", lambda p=prefix: (
+                    f"/{p}teacher/{rng.choice(catalog.teachers)}", None, auth())),
+                f"{name}send_message": ("post", lambda p=prefix: (f"/{p}message", message(), auth())),
+            })
+        if senders:
+            endpoints["message_status"] = ("get", message_status)
+        if catalog.messages:
+            endpoints["message_history"] = ("get", lambda: ("/message/history", None, auth()))
+        if inbox:
+            endpoints["teacher_inbox"] = ("get", lambda: (
+                f"/teacher/{inbox}/inbox", None, {"HTTP_AUTHORIZATION": admin_token}))
+        endpoints["cache_stats"] = ("get", lambda: ("/stats/cache", None, {"HTTP_AUTHORIZATION": admin_token}))
+        return endpoints
+
+    def run_endpoints(self, catalog, options) -> dict:
+        rng = random.Random(options["seed"])
+        endpoints = self.endpoints(catalog, rng)
+        results = {}
+        for name, (method, make_request) in endpoints.items():
+            if options["endpoints"] and name not in options["endpoints"]:
+                continue
+            self.clear_caches()
+            requests = [make_request() for _ in range(options["warmup"] + options["requests"])]
+            self.drive(method, requests[:options["warmup"]], options["concurrency"])
+
+            start = time.perf_counter()
+            samples = self.drive(method, requests[options["warmup"]:], options["concurrency"])
+            elapsed = time.perf_counter() - start
+
+            results[name] = self.summarize(samples, elapsed)
+            self.stdout.write(
+                f"{name:<28} {results[name]['throughput']:>8.1f} req/s  p50 {results[name]['p50_ms']:7.2f} ms  "
+                f"p95 {results[name]['p95_ms']:7.2f} ms  p99 {results[name]['p99_ms']:7.2f} ms  "
+                f"{results[name]['mean_queries']:5.1f} queries  {results[name]['errors']} errors"
+            )
+        return results
+
+    def drive(self, method: str, requests: list, concurrency: int) -> list:
+        """Send the requests from a pool of threads and return a (seconds, queries, status) sample per request."""
+
+        def send(request):
+            path, data, headers = request
+            client = Client()
+            with CaptureQueriesContext(connection) as queries:
+                began = time.perf_counter()
+                if method == "post":
+                    response = client.post(path, data, content_type="application/json", **headers)
+                else:
+                    response = client.get(path, **headers)
+                elapsed = time.perf_counter() - began
+            return elapsed, len(queries), response.status_code
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            return list(pool.map(send, requests))
+
+    def summarize(self, samples: list, elapsed: float) -> dict:
+        latencies = sorted(seconds * 1000 for seconds, _, _ in samples)
+        queries = [count for _, count, _ in samples]
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+        return {
+            "requests": len(samples),
+            "errors": sum(1 for _, _, status in samples if status >= 400),
+            "throughput": len(samples) / elapsed,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "mean_queries": statistics.mean(queries),
+            "max_queries": max(queries),
+        }
+
+    def clear_caches(self):
+        """Empty every cache, so each endpoint starts cold."""
+
+        for alias in caches:
+            caches[alias].clear()
+        cache.local_cache().clear()
+        verdicts.local_cache().clear()
+        accounts.local_cache().clear()
+
+    def compare(self, before: dict, after: dict):
+        self.stdout.write("Change against the earlier results:")
+        for name, result in after.items():
+            if name not in before:
+                continue
+            old = before[name]
+            self.stdout.write(
+                f"{name:<28} throughput {self.change(old['throughput'], result['throughput'])}  "
+                f"p95 {self.change(old['p95_ms'], result['p95_ms'])}  "
+                f"queries {old['mean_queries']:.1f} -> {result['mean_queries']:.1f}"
+            )
+
+    def change(self, old: float, new: float) -> str:
+        return f"{(new - old) / old * 100:+6.1f}%" if old else "   n/a"
+
+    def commit(self):
+        """Return the checked out git commit, if any."""
+
+        try:
+            return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,104 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import ThreadSensitiveContext
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework_simplejwt.tokens import AccessToken
+
+from feedback_man.fake_perspective import FakePerspectiveServer
+from feedback_man.models import Message, StudentAccount, Teacher
+
+
+class Command(BaseCommand):
+    help = ("Benchmark message submission through the async view against the synchronous, thread per "
+            "request path, with moderation served by a local stand-in for Perspective, on a throwaway "
+            "test database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=500)
+        parser.add_argument("--threads", type=int, default=16,
+                            help="Worker threads of the synchronous (WSGI) deployment.")
+        parser.add_argument("--concurrency", type=int, default=250,
+                            help="Requests in flight at once against the async view.")
+        parser.add_argument("--latency", type=float, default=0.2,
+                            help="Simulated round trip time of the stand-in server in seconds.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            with FakePerspectiveServer(latency=options["latency"]) as server, override_settings(
+                PERSPECTIVE_DISCOVERY_URL=server.discovery_url,
+                PERSPECTIVE_ANALYZE_URL=server.analyze_url,
+                MESSAGE_THROTTLE_BURST=10 ** 9,
+                EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+            ):
+                teacher = Teacher.objects.create(email="bench@northeastern.edu", teacher_name="Bench Teacher",
+                                                 college="Khoury")
+                student = StudentAccount.objects.create_user("bench.student@northeastern.edu", "bench")
+
+                for name, run in (("sync, thread per request", self.run_sync),
+                                  ("async view", self.run_async)):
+                    for key in server.counts:
+                        server.counts[key] = 0
+                    texts = [f"{name} message number {i}" for i in range(options["messages"])]
+                    start = time.perf_counter()
+                    latencies = run(texts, teacher, student, options)
+                    elapsed = time.perf_counter() - start
+                    self.report(name, latencies, elapsed, server.counts["peak_in_flight"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def run_sync(self, texts: list, teacher, student, options) -> list:
+        """Submit and moderate each message on a pool of threads, as WSGI worker threads would."""
+
+        def submit(text):
+            began = time.perf_counter()
+            try:
+                Message.objects.create(student=student, teacher=teacher, message_body=text).email_message()
+            finally:
+                connection.close()
+            return time.perf_counter() - began
+
+        with ThreadPoolExecutor(options["threads"]) as pool:
+            return list(pool.map(submit, texts))
+
+    def run_async(self, texts: list, teacher, student, options) -> list:
+        """Submit every message to the async view from one event loop."""
+
+        async def submit_all():
+            client = AsyncClient()
+            token = f"Bearer {AccessToken.for_user(student)}"
+            slots = asyncio.Semaphore(options["concurrency"])
+
+            async def submit(text):
+                #Like the ASGI handler, give each request its own thread for synchronous database work
+                async with slots, ThreadSensitiveContext():
+                    began = time.perf_counter()
+                    response = await client.post(
+                        "/async/message",
+                        {"teacher": teacher.pk, "message_body": text},
+                        content_type="application/json",
+                        AUTHORIZATION=token,
+                    )
+                    assert response.status_code == 201, response.content
+                    return time.perf_counter() - began
+
+            return await asyncio.gather(*(submit(text) for text in texts))
+
+        return asyncio.run(submit_all())
+
+    def report(self, name: str, latencies: list, elapsed: float, peak: int):
+        latencies = sorted(latencies)
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        self.stdout.write(
+            f"{name:<26} {len(latencies) / elapsed:>9.1f} msgs/sec  "
+            f"p50 {statistics.median(latencies) * 1000:8.1f} ms  p95 {p95 * 1000:8.1f} ms  "
+            f"peak moderation calls in flight: {peak}"
+        )
@@ -0,0 +1,106 @@
+import asyncio
+import time
+from collections import Counter
+
+from asgiref.sync import ThreadSensitiveContext
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework_simplejwt.tokens import AccessToken
+
+from feedback_man import moderation
+from feedback_man.fake_perspective import FakePerspectiveServer
+from feedback_man.models import StudentAccount, Teacher
+
+
+class Command(BaseCommand):
+    help = ("Benchmark message submission through the async view while the local stand-in for Perspective "
+            "is healthy, slow, failing and recovered, on a throwaway test database, and report latency "
+            "percentiles and how many messages were moderated or held.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=300, help="Messages per phase.")
+        parser.add_argument("--concurrency", type=int, default=50, help="Requests in flight at once.")
+        parser.add_argument("--latency", type=float, default=0.05,
+                            help="Round trip time of the stand-in server in seconds while healthy.")
+        parser.add_argument("--slow-latency", type=float, default=30.0,
+                            help="Round trip time of the stand-in server in seconds while slow.")
+        parser.add_argument("--deadline", type=float, default=1.0, help="PERSPECTIVE_DEADLINE in seconds.")
+        parser.add_argument("--breaker-reset", type=float, default=2.0,
+                            help="PERSPECTIVE_BREAKER_RESET in seconds, waited out between the outage phases.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            with FakePerspectiveServer(latency=options["latency"]) as server, override_settings(
+                PERSPECTIVE_DISCOVERY_URL=server.discovery_url,
+                PERSPECTIVE_ANALYZE_URL=server.analyze_url,
+                PERSPECTIVE_DEADLINE=options["deadline"],
+                PERSPECTIVE_BREAKER_RESET=options["breaker_reset"],
+                MODERATION_DEGRADED_MODE="hold",
+                MESSAGE_THROTTLE_BURST=10 ** 9,
+                DEDUP_ENABLED=False,
+            ):
+                #A breaker built from the overridden settings
+                moderation._breaker = None
+                teacher = Teacher.objects.create(email="bench@northeastern.edu", teacher_name="Bench Teacher",
+                                                 college="Khoury")
+                student = StudentAccount.objects.create_user("bench.student@northeastern.edu", "bench")
+
+                for phase, latency, error_rate in (("healthy", options["latency"], 0.0),
+                                                   ("slow", options["slow_latency"], 0.0),
+                                                   ("failing", options["latency"], 1.0),
+                                                   ("recovered", options["latency"], 0.0)):
+                    if phase in ("failing", "recovered"):
+                        #Let the breaker try a trial call
+                        time.sleep(options["breaker_reset"])
+                    server.latency, server.error_rate = latency, error_rate
+                    before = moderation.stats()
+                    texts = [f"{phase} message number {i}" for i in range(options["messages"])]
+                    latencies, statuses = self.run(texts, teacher, student, options)
+                    after = moderation.stats()
+                    self.report(phase, latencies, statuses,
+                                {event: after[event] - before[event] for event in ("failures", "short_circuited")})
+        finally:
+            moderation._breaker = None
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def run(self, texts: list, teacher, student, options) -> tuple:
+        """Submit every message to the async view from one event loop; return latencies and statuses."""
+
+        statuses = Counter()
+
+        async def submit_all():
+            client = AsyncClient()
+            token = f"Bearer {AccessToken.for_user(student)}"
+            slots = asyncio.Semaphore(options["concurrency"])
+
+            async def submit(text):
+                async with slots, ThreadSensitiveContext():
+                    began = time.perf_counter()
+                    response = await client.post(
+                        "/async/message",
+                        {"teacher": teacher.pk, "message_body": text},
+                        content_type="application/json",
+                        AUTHORIZATION=token,
+                    )
+                    statuses[response.json().get("status", response.status_code)] += 1
+                    return time.perf_counter() - began
+
+            return await asyncio.gather(*(submit(text) for text in texts))
+
+        return asyncio.run(submit_all()), statuses
+
+    def report(self, phase: str, latencies: list, statuses: Counter, gateway: dict):
+        latencies = sorted(latencies)
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        outcome = ", ".join(f"{count} {status}" for status, count in sorted(statuses.items(), key=str))
+        self.stdout.write(
+            f"{phase:<10} p50 {p50 * 1000:8.1f} ms  p99 {p99 * 1000:8.1f} ms  max {latencies[-1] * 1000:8.1f} ms  "
+            f"{outcome}  failed attempts: {gateway['failures']}  failed fast: {gateway['short_circuited']}  "
+            f"breaker: {moderation.get_breaker().state}"
+        )
@@ -0,0 +1,54 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from googleapiclient import discovery
+
+from feedback_man.fake_perspective import FakePerspectiveServer
+from feedback_man.moderation import PerspectiveClient, parse_scores
+
+
+class Command(BaseCommand):
+    help = "Benchmark Perspective client throughput against a local stand-in server."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=500)
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--max-batch", type=int, default=20)
+        parser.add_argument("--latency", type=float, default=0.05,
+                            help="Simulated round trip time of the stand-in server in seconds.")
+
+    def handle(self, *args, **options):
+        texts = [f"message number {i} you idiot" if i % 10 == 0 else f"message number {i}"
+                 for i in range(options["messages"])]
+
+        with FakePerspectiveServer(latency=options["latency"]) as server:
+            def rebuild(text):
+                #The old behaviour: fetch the discovery document and build a client per message
+                client = discovery.build(
+                    "commentanalyzer",
+                    "v1alpha1",
+                    developerKey="bench",
+                    discoveryServiceUrl=server.discovery_url,
+                    static_discovery=False,
+                )
+                body = {"comment": {"text": text}, "requestedAttributes": {"TOXICITY": {}}}
+                return parse_scores(client.comments().analyze(body=body).execute())
+
+            shared = PerspectiveClient("bench", server.discovery_url, max_batch=1, workers=options["threads"])
+            batched = PerspectiveClient("bench", server.discovery_url, max_batch=options["max_batch"],
+                                        workers=max(1, options["threads"] // 4))
+
+            for name, score in (("rebuild per message", rebuild),
+                                ("shared client", shared.analyze),
+                                ("shared client, batched", batched.analyze)):
+                for key in server.counts:
+                    server.counts[key] = 0
+                start = time.perf_counter()
+                with ThreadPoolExecutor(options["threads"]) as pool:
+                    list(pool.map(score, texts))
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f"{name:<24} {len(texts) / elapsed:>9.1f} msgs/sec  "
+                    f"http requests: {server.counts['discovery'] + server.counts['analyze'] + server.counts['batch']}"
+                )
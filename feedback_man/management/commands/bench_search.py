@@ -0,0 +1,58 @@
+import itertools
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from feedback_man.managers import regex_token_search
+from feedback_man.models import Teacher
+from feedback_man.search import rebuild_teacher_index
+from feedback_man.synthetic import teacher_names
+
+
+class Command(BaseCommand):
+    help = ("Benchmark teacher name search through the trigram index against the regex scan "
+            "on a throwaway test database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+        parser.add_argument("--queries", nargs="+", default=["ben", "lerner", "amal ahmed", "vit"])
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            names = teacher_names()
+            total = 0
+            for size in sorted(options["sizes"]):
+                self.stdout.write(f"Loading {size} teachers...")
+                teachers = [
+                    Teacher(teacher_name=name, college="Khoury", email=f"teacher{total + i}@northeastern.edu")
+                    for i, name in enumerate(itertools.islice(names, size - total))
+                ]
+                Teacher.objects.bulk_create(teachers, batch_size=5000)
+                total = size
+                rebuild_teacher_index()
+
+                for query in options["queries"]:
+                    regex = self.time(lambda: list(Teacher.objects.filter(teacher_name__iregex=regex_token_search(query))),
+                                      options["repeat"])
+                    indexed = self.time(lambda: list(Teacher.objects.search_teacher_name(query)), options["repeat"])
+                    self.stdout.write(f"{size:>9} teachers  {query!r:<14} regex {regex * 1000:9.2f} ms  "
+                                      f"trigram {indexed * 1000:9.2f} ms")
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def time(self, search, repeat: int) -> float:
+        """Return the median wall time in seconds of running the search repeat times."""
+
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            search()
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings)
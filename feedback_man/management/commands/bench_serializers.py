@@ -0,0 +1,63 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.renderers import JSONRenderer
+
+from feedback_man import synthetic
+from feedback_man.models import Course, Teacher
+from nameless_api import fast_serializers
+from nameless_api.serializers import CourseSerializer, TeacherSerializer
+from nameless_api.views import COURSE_TEACHERS, FAST_COURSE, FAST_TEACHER
+
+
+class Command(BaseCommand):
+    help = ("Benchmark fetching, serializing and rendering teachers and courses with the DRF serializers "
+            "against the fast path on a throwaway test database, in rows per second, and check that both "
+            "render the same bytes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=5000, help="Teachers and courses per run.")
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            synthetic.generate(options["rows"], options["rows"])
+            renderer = "orjson" if fast_serializers.orjson is not None else "json"
+            self.stdout.write(f"{'':<8} {'DRF':>14} {'fast':>14} {'fast+' + renderer:>14}")
+            for name, queryset, serializer_class, fast in (
+                ("teacher", Teacher.objects.order_by("pk"), TeacherSerializer, FAST_TEACHER),
+                ("course", Course.objects.order_by("pk"), CourseSerializer, FAST_COURSE),
+            ):
+                def drf():
+                    rows = queryset.prefetch_related(COURSE_TEACHERS) if queryset.model is Course else queryset
+                    return JSONRenderer().render(serializer_class(rows, many=True).data)
+
+                def fast_path():
+                    return JSONRenderer().render(fast.serialize(list(fast.values(queryset))))
+
+                def fast_render():
+                    return fast_serializers.render_json(fast.serialize(list(fast.values(queryset))))
+
+                bodies = {drf(), fast_path(), fast_render()}
+                if len(bodies) != 1:
+                    raise CommandError(f"The {name} fast path renders different bytes than {serializer_class.__name__}")
+                rates = [options["rows"] / self.time(run, options["repeat"]) for run in (drf, fast_path, fast_render)]
+                self.stdout.write(f"{name:<8} " + " ".join(f"{rate:>9.0f} rows/s" for rate in rates))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def time(self, run, repeat: int) -> float:
+        """Return the median wall time in seconds of calling run repeat times."""
+
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings)
@@ -0,0 +1,40 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from feedback_man import catalog
+
+
+class Command(BaseCommand):
+    help = ("Load teachers and courses from a JSON, JSON Lines or CSV catalog dump, upserting in chunks. "
+            "Re-running with an updated dump only writes the rows which changed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", type=Path)
+        parser.add_argument("--format", choices=["json", "jsonl", "csv"],
+                            help="Format of the dump. Guessed from the file extension by default.")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or {".json": "json", ".jsonl": "jsonl", ".ndjson": "jsonl",
+                                            ".csv": "csv"}.get(path.suffix.lower())
+        if file_format is None:
+            raise CommandError(f"Cannot guess the format of {path}; pass --format")
+
+        start = time.perf_counter()
+        with path.open(newline="", encoding="utf-8") as fp:
+            stats = catalog.ingest(catalog.read_records(fp, file_format), options["chunk_size"])
+        elapsed = time.perf_counter() - start
+
+        for error in stats.errors[:20]:
+            self.stderr.write(f"Skipped {error}")
+        self.stdout.write(
+            f"Read {stats.records} records ({stats.skipped} skipped) in {elapsed:.2f}s, "
+            f"{stats.records / elapsed if elapsed else 0:.0f} records/sec\n"
+            f"Teachers: {stats.teachers_created} created, {stats.teachers_updated} updated, "
+            f"{stats.teachers_skipped} skipped\n"
+            f"Courses: {stats.courses_created} created, {stats.courses_updated} updated\n"
+            f"Course teacher links: {stats.links_created} created"
+        )
@@ -0,0 +1,55 @@
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from feedback_man import scoring
+from feedback_man.models import Message
+
+
+class Command(BaseCommand):
+    help = ("Judge every sent or rejected message with stored moderation scores against "
+            "MODERATION_THRESHOLDS, in the database and without calling Perspective, update which are "
+            "malicious and report how the decisions changed. Statuses are left as they are.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threshold", action="append", default=[], metavar="ATTRIBUTE=SCORE",
+                            help="Try another threshold of an attribute, e.g. TOXICITY=0.8. Only with --dry-run, "
+                                 "since new messages are judged against MODERATION_THRESHOLDS.")
+        parser.add_argument("--dry-run", action="store_true", help="Report the changes without making them.")
+        parser.add_argument("--chunk-size", type=int, default=10000, help="Messages per transaction.")
+
+    def handle(self, *args, **options):
+        overrides = {}
+        for option in options["threshold"]:
+            attribute, _, score = option.partition("=")
+            try:
+                overrides[attribute.upper()] = float(score)
+            except ValueError:
+                raise CommandError(f"Invalid threshold {option}, expected ATTRIBUTE=SCORE")
+        if overrides and not options["dry_run"]:
+            raise CommandError("--threshold only goes with --dry-run; change MODERATION_THRESHOLDS instead")
+        try:
+            thresholds = scoring.get_thresholds(overrides)
+        except ImproperlyConfigured as e:
+            raise CommandError(e)
+
+        self.stdout.write("Thresholds: " + ", ".join(f"{attribute} > {score}" for attribute, score in thresholds.items()))
+        start = time.perf_counter()
+        confusion = scoring.rethreshold(thresholds, options["chunk_size"], options["dry_run"])
+        elapsed = time.perf_counter() - start
+
+        total = sum(confusion.values())
+        self.stdout.write(f"{'':<14} {'now clean':>12} {'now malicious':>14}")
+        for old, label in ((False, "was clean"), (True, "was malicious")):
+            self.stdout.write(f"{label:<14} {confusion[old, False]:>12} {confusion[old, True]:>14}")
+        verb = "Would change" if options["dry_run"] else "Changed"
+        self.stdout.write(f"{verb} {confusion[False, True] + confusion[True, False]} decisions of {total} "
+                          f"scored messages in {elapsed:.1f}s")
+        if confusion[False, True] or confusion[True, False]:
+            self.stdout.write("Statuses are unchanged: newly malicious messages were already delivered and "
+                              "stay Sent, newly clean ones were never delivered and stay Rejected")
+        unscored = Message.objects.filter(is_malicious=True, scores__isnull=True).count()
+        if unscored:
+            self.stdout.write(f"{unscored} malicious messages have no scores (pre-screen or near-duplicate "
+                              f"rejections) and were left as they are")
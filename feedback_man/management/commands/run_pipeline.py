@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from feedback_man import pipeline
+
+
+class Command(BaseCommand):
+    help = "Run a pool of workers that moderate and deliver queued messages."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--batch-size", type=int, default=10)
+        parser.add_argument("--poll-interval", type=float, default=1.0)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Starting {options['workers']} pipeline workers")
+        pipeline.run_pool(options["workers"], options["batch_size"], options["poll_interval"])
@@ -0,0 +1,31 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from feedback_man import outbox
+
+
+class Command(BaseCommand):
+    help = "Send every due email in the outbox, one SMTP session per batch."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument("--async", dest="use_async", action="store_true",
+                            help="Send with the asyncio SMTP client.")
+
+    def handle(self, *args, **options):
+        if options["use_async"]:
+            total = asyncio.run(self.adrain_all(options["batch_size"]))
+        else:
+            total = 0
+            #A batch may fail entirely; its emails are then no longer due
+            while outbox.due_emails().exists():
+                total += outbox.drain(options["batch_size"])
+        self.stdout.write(f"Sent {total} outbox emails")
+
+    async def adrain_all(self, batch_size: int) -> int:
+        total = 0
+        while await outbox.due_emails().aexists():
+            total += await outbox.adrain(batch_size)
+        return total
@@ -1,7 +1,10 @@
 from django.contrib.auth.models import BaseUserManager
+from django.conf import settings
 from django.db import models
+from django.db.models import Count
 from django.utils import timezone
 import re
+import math
 import functools
 
 class StudentManager(BaseUserManager):
@@ -49,17 +52,40 @@ class TeacherManager(models.Manager):
     def search_teacher_name(self, name: str):
         """
         Search for teachers matching the given name in the database.
-        Returns a QuerySet of all teachers who fit the search.
+        Returns a QuerySet of all teachers who fit the search, best matches first.
+
+        Looks up the query's trigrams in the TeacherTrigram index and ranks teachers by how many
+        of them their name contains. Teachers sharing fewer than TEACHER_SEARCH_MIN_SIMILARITY
+        of the query's trigrams are left out.
         """
-        return self.filter(teacher_name__iregex=regex_token_search(name))
+        grams = trigrams(name, query=True)
+        if not grams:
+            return self.none()
+
+        min_matches = max(1, math.ceil(len(grams) * settings.TEACHER_SEARCH_MIN_SIMILARITY))
+        return (self.filter(trigrams__gram__in=grams)
+                .annotate(matches=Count("trigrams"))
+                .filter(matches__gte=min_matches)
+                .order_by("-matches", "teacher_name"))
     
 class CourseManager(models.Manager):
     def search_course_name(self, name: str):
         """"
         Search for courses matching the given name in the database.
         Returns a QuerySet of all courses who fit the search.
+
+        Every word of the query must be a prefix of one of the course's tokens in the
+        CourseSearchToken index, so "cs 25", "CS2500", "fundam" and "fundies fall 2023" all find
+        Fundamentals of Computer Science 1.
         """
-        return self.filter(course_name__iregex=regex_token_search(name))
+        tokens = re.sub(r"[\W_]+", " ", name.lower()).split()
+        if not tokens:
+            return self.none()
+
+        courses = self.all()
+        for token in tokens:
+            courses = courses.filter(search_tokens__token__istartswith=token)
+        return courses.distinct().order_by("subject", "course_num", "-year", "semester", "id")
 
 
 
@@ -69,4 +95,40 @@ def regex_token_search(query: str):
     each token in the query.
     """
     #regex of all tokens in the passed name with zero or more characters in between/on the ends of each
-    return functools.reduce(lambda regex, token: regex + re.escape(token+"*+"), query.split(), r"*+")
\ No newline at end of file
+    return functools.reduce(lambda regex, token: regex + re.escape(token) + ".*", query.split(), ".*")
+
+
+def trigrams(text: str, query: bool = False) -> set:
+    """
+    Return the set of lowercase trigrams of each word in the text. Words are padded with two
+    leading spaces and one trailing space, so short words and word starts have trigrams too.
+    Queries are not padded at the end, so a partially typed word matches every word it begins.
+    """
+    grams = set()
+    for token in re.sub(r"[\W_]+", " ", text.lower()).split():
+        padded = "  " + token + ("" if query else " ")
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+SEMESTER_WORDS = {"FA": ["fall"], "SP": ["spring"], "S1": ["summer", "1"], "S2": ["summer", "2"]}
+
+
+def course_tokens(subject: str, course_num, class_name: str, semester: str, year) -> set:
+    """
+    Return the set of lowercase search tokens of a course: its subject, number, subject and number
+    combined (e.g. "cs2500"), the words of its name, its semester and year, and any nicknames
+    listed for it in COURSE_SEARCH_ALIASES.
+    """
+    subject = subject.lower()
+    tokens = set(re.sub(r"[\W_]+", " ", f"{subject} {class_name}".lower()).split())
+    tokens.update(word for word in SEMESTER_WORDS.get(semester, []))
+    if semester:
+        tokens.add(semester.lower())
+    if year is not None:
+        tokens.add(str(year))
+    if course_num is not None:
+        code = f"{subject}{course_num}".replace(" ", "")
+        tokens.update([str(course_num), code])
+        tokens.update(settings.COURSE_SEARCH_ALIASES.get(code, []))
+    return {token[:64] for token in tokens}
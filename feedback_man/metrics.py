@@ -0,0 +1,156 @@
+"""
+In-process performance metrics, exported in the Prometheus text format.
+
+Histograms and counters are kept per process with fixed buckets, so recording a value is one
+lock and a bisect, cheap enough to leave on in production. Scrape every worker process to see
+all traffic. Request metrics are recorded by nameless_api.middleware.MetricsMiddleware; spans
+time sections of work such as moderation and email delivery wherever they run, including the
+pipeline workers.
+"""
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+#Upper bounds of the latency buckets, in seconds
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+#Upper bounds of the query count buckets
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+REGISTRY = []
+
+
+def format_labels(names: tuple, values: tuple, **extra) -> str:
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """A monotonically increasing count per combination of label values."""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{format_labels(self.labels, labels)} {value}" for labels, value in values]
+        return lines
+
+
+class Histogram:
+    """Counts of observed values in cumulative buckets, with their sum, per combination of label values."""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = TIME_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels):
+        #Bucket counts are kept per bucket and only made cumulative when rendered
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self) -> list:
+        with self._lock:
+            values = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, labels, le=bound)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+REQUESTS = Counter("nameless_requests_total", "API requests by route, method and response status.",
+                   ("route", "method", "status"))
+REQUEST_SECONDS = Histogram("nameless_request_duration_seconds", "Wall time of API requests by route.",
+                            ("route", "method"))
+REQUEST_QUERIES = Histogram("nameless_request_queries", "SQL queries run per API request by route.",
+                            ("route", "method"), QUERY_BUCKETS)
+REQUEST_QUERY_SECONDS = Histogram("nameless_request_query_duration_seconds",
+                                  "Time spent in SQL queries per API request by route.", ("route", "method"))
+SPAN_SECONDS = Histogram("nameless_span_duration_seconds",
+                         "Wall time of timed sections of work, such as moderation and email delivery.", ("span",))
+
+
+@contextmanager
+def span(name: str):
+    """Time the enclosed block as the named span."""
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        SPAN_SECONDS.observe(time.perf_counter() - start, name)
+
+
+def timed(name: str):
+    """Decorator timing every call of the function, or coroutine function, as the named span."""
+
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @wraps(function)
+            async def wrapper(*args, **kwargs):
+                with span(name):
+                    return await function(*args, **kwargs)
+        else:
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with span(name):
+                    return function(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+class QueryRecorder:
+    """A database execute wrapper counting the queries it sees and the time they take."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+
+
+def render() -> str:
+    """Return every metric of this process in the Prometheus text exposition format."""
+
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,55 @@
+# Generated by Django 4.1.4 on 2026-10-18 17:08
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("feedback_man", "0005_remove_studentaccount_id_remove_teacher_id_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="status",
+            field=models.CharField(
+                choices=[("PE", "Pending"), ("RE", "Rejected"), ("SE", "Sent")],
+                default="PE",
+                max_length=2,
+            ),
+        ),
+        migrations.CreateModel(
+            name="MessageJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "available_at",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+                ("attempts", models.IntegerField(default=0)),
+                ("locked_by", models.CharField(blank=True, max_length=64)),
+                ("locked_at", models.DateTimeField(null=True)),
+                (
+                    "message",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="job",
+                        to="feedback_man.message",
+                    ),
+                ),
+            ],
+        ),
+    ]
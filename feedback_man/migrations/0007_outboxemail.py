@@ -0,0 +1,53 @@
+# Generated by Django 4.1.4 on 2026-10-18 17:10
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("feedback_man", "0006_message_status_messagejob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OutboxEmail",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("recipient", models.EmailField(max_length=256)),
+                ("body", models.TextField()),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("sent_at", models.DateTimeField(null=True)),
+                (
+                    "message",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="outbox_email",
+                        to="feedback_man.message",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["sent_at", "created_at"],
+                        name="feedback_ma_sent_at_903696_idx",
+                    ),
+                    models.Index(
+                        fields=["recipient", "sent_at"],
+                        name="feedback_ma_recipie_1fd0aa_idx",
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 4.1.4 on 2026-10-18 17:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from feedback_man.managers import trigrams
+
+
+def index_teacher_names(apps, schema_editor, chunk_size=1000):
+    Teacher = apps.get_model("feedback_man", "Teacher")
+    TeacherTrigram = apps.get_model("feedback_man", "TeacherTrigram")
+    #bulk_create materializes what it is given, so insert a chunk of teachers at a time
+    chunk = []
+    teachers = Teacher.objects.only("pk", "teacher_name").iterator(chunk_size=chunk_size)
+    for teacher in teachers:
+        chunk.extend(
+            TeacherTrigram(teacher_id=teacher.pk, gram=gram)
+            for gram in trigrams(teacher.teacher_name)
+        )
+        if len(chunk) >= chunk_size:
+            TeacherTrigram.objects.bulk_create(chunk)
+            chunk = []
+    TeacherTrigram.objects.bulk_create(chunk)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("feedback_man", "0007_outboxemail"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TeacherTrigram",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("gram", models.CharField(max_length=3)),
+                (
+                    "teacher",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="trigrams",
+                        to="feedback_man.teacher",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["gram", "teacher"], name="feedback_ma_gram_a8cc96_idx"
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("teacher", "gram"), name="unique_teacher_trigram"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(index_teacher_names, migrations.RunPython.noop),
+    ]
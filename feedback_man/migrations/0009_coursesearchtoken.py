@@ -0,0 +1,74 @@
+# Generated by Django 4.1.4 on 2026-10-18 17:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from feedback_man.managers import course_tokens
+
+
+def index_courses(apps, schema_editor, chunk_size=1000):
+    Course = apps.get_model("feedback_man", "Course")
+    CourseSearchToken = apps.get_model("feedback_man", "CourseSearchToken")
+    #bulk_create materializes what it is given, so insert a chunk of courses at a time
+    chunk = []
+    for course in Course.objects.iterator(chunk_size=chunk_size):
+        chunk.extend(
+            CourseSearchToken(course_id=course.pk, token=token)
+            for token in course_tokens(
+                course.subject,
+                course.course_num,
+                course.class_name,
+                course.semester,
+                course.year,
+            )
+        )
+        if len(chunk) >= chunk_size:
+            CourseSearchToken.objects.bulk_create(chunk)
+            chunk = []
+    CourseSearchToken.objects.bulk_create(chunk)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("feedback_man", "0008_teachertrigram"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CourseSearchToken",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("token", models.CharField(max_length=64)),
+                (
+                    "course",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="search_tokens",
+                        to="feedback_man.course",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["token", "course"], name="feedback_ma_token_f0dcf0_idx"
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("course", "token"), name="unique_course_search_token"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(index_courses, migrations.RunPython.noop),
+    ]
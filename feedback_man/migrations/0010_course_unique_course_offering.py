@@ -0,0 +1,20 @@
+# Generated by Django 4.1.4 on 2026-10-18 17:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("feedback_man", "0009_coursesearchtoken"),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name="course",
+            constraint=models.UniqueConstraint(
+                fields=("subject", "course_num", "semester", "year"),
+                name="unique_course_offering",
+            ),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.1.4 on 2026-10-18 17:15
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("feedback_man", "0010_course_unique_course_offering"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ModerationVerdict",
+            fields=[
+                (
+                    "digest",
+                    models.CharField(max_length=64, primary_key=True, serialize=False),
+                ),
+                ("scores", models.JSONField()),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+            ],
+        ),
+    ]
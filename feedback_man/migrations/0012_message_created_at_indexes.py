@@ -0,0 +1,33 @@
+# Generated by Django 4.1.4 on 2026-10-18 17:38
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("feedback_man", "0011_moderationverdict"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="created_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["teacher", "is_malicious", "-created_at", "-id"],
+                name="message_teacher_inbox",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["student", "is_malicious", "-created_at", "-id"],
+                name="message_student_history",
+            ),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.1.4 on 2026-10-18 17:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("feedback_man", "0012_message_created_at_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="message",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("PE", "Pending"),
+                    ("RE", "Rejected"),
+                    ("SE", "Sent"),
+                    ("SU", "Suppressed"),
+                ],
+                default="PE",
+                max_length=2,
+            ),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.1.4 on 2026-10-18 17:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("feedback_man", "0013_message_status_suppressed"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MessageScores",
+            fields=[
+                (
+                    "message",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="scores",
+                        serialize=False,
+                        to="feedback_man.message",
+                    ),
+                ),
+                ("toxicity", models.PositiveSmallIntegerField(default=0)),
+                ("identity_attack", models.PositiveSmallIntegerField(default=0)),
+                ("insult", models.PositiveSmallIntegerField(default=0)),
+            ],
+        ),
+    ]
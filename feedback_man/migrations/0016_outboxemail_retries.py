@@ -0,0 +1,35 @@
+# Generated by Django 4.1.4 on 2026-10-18 18:09
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("feedback_man", "0015_message_status_held"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="outboxemail",
+            name="feedback_ma_sent_at_903696_idx",
+        ),
+        migrations.AddField(
+            model_name="outboxemail",
+            name="attempts",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="outboxemail",
+            name="next_attempt_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name="outboxemail",
+            index=models.Index(
+                fields=["sent_at", "next_attempt_at"],
+                name="feedback_ma_sent_at_67d8de_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.1.4 on 2026-10-18 21:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("feedback_man", "0016_outboxemail_retries"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="message",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("PE", "Pending"),
+                    ("RE", "Rejected"),
+                    ("SE", "Sent"),
+                    ("SU", "Suppressed"),
+                    ("HE", "Held"),
+                    ("FA", "Failed"),
+                ],
+                default="PE",
+                max_length=2,
+            ),
+        ),
+    ]
@@ -1,11 +1,12 @@
-from django.db import models
+from asgiref.sync import sync_to_async
+from django.db import models, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
 from django.conf import settings
 from .managers import StudentManager, TeacherManager, CourseManager
-from django.core.mail import send_mail
-from googleapiclient import discovery
-import json
-from ...nameless_root import local_settings
+from . import accounts, dedup, metrics, moderation, prescreen, scoring, verdicts
+import time
 
 # Create your models here.
 # TODO: Test cases for model methods
@@ -26,6 +27,28 @@ class Teacher(models.Model):
         return self.teacher_name
 
 
+class TeacherTrigram(models.Model):
+    """
+    A trigram of a teacher's name, indexed for name search.
+    Kept in sync with the Teacher table by the signal handlers in feedback_man.signals.
+    """
+
+    teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE, related_name="trigrams")
+    gram = models.CharField(max_length=3)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["gram", "teacher"]),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["teacher", "gram"], name="unique_teacher_trigram"),
+        ]
+
+    def __str__(self):
+        """Return a string representation of the trigram: the trigram itself."""
+        return self.gram
+
+
 class Course(models.Model):
     """A model class for representing a course in the database.
     Shares a many-to-many relationship with the Teacher table."""
@@ -48,11 +71,39 @@ class Course(models.Model):
 
     objects = CourseManager()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["subject", "course_num", "semester", "year"],
+                name="unique_course_offering",
+            ),
+        ]
+
     def __str__(self):
         """Return a string representation of the course: the course number and name."""
         return f"{self.course_num} {self.class_name}"
 
 
+class CourseSearchToken(models.Model):
+    """
+    A search token of a course (subject, number, name word, semester, year or nickname),
+    indexed for prefix search. Kept in sync with the Course table by feedback_man.signals.
+    """
+
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name="search_tokens")
+    token = models.CharField(max_length=64)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["token", "course"]),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["course", "token"], name="unique_course_search_token"),
+        ]
+
+    def __str__(self):
+        """Return a string representation of the token: the token itself."""
+        return self.token
 
 
 class StudentAccount(AbstractBaseUser, PermissionsMixin):
@@ -65,9 +116,8 @@ class StudentAccount(AbstractBaseUser, PermissionsMixin):
     REQUIRED_FIELDS = []
     is_staff = models.BooleanField(default=False)
     is_superuser = models.BooleanField(default=False)
+    #Set to False by increment_infractions once the student reaches MAX_INFRACTIONS
     is_active = models.BooleanField(default=True)
-    #TODO: Functionality for banning accounts when too many malicious messages
-    #by setting this to false
 
     objects = StudentManager()
     
@@ -79,68 +129,250 @@ class StudentAccount(AbstractBaseUser, PermissionsMixin):
     def increment_infractions(self):
         """
         Increment the number of infractions committed by the student and
-        return the new total.
+        return the new total. The account is deactivated once the total reaches MAX_INFRACTIONS.
+
+        The increment and the deactivation are a single UPDATE, so concurrent increments are
+        never lost, and the row lock is only held until the new total has been read back.
         """
 
-        self.num_infractions += 1
-        self.save(update_fields=["num_infractions"])
+        account = StudentAccount.objects.filter(pk=self.pk)
+        with transaction.atomic():
+            account.update(
+                #Assigned before num_infractions: MySQL evaluates SET clauses left to right
+                is_active=Case(
+                    When(num_infractions__gte=settings.MAX_INFRACTIONS - 1, then=Value(False)),
+                    default=F("is_active"),
+                ),
+                num_infractions=F("num_infractions") + 1,
+            )
+            self.num_infractions, self.is_active = account.values_list("num_infractions", "is_active").get()
+        #update() sends no post_save signal
+        accounts.invalidate(self.pk)
         return self.num_infractions
 
 
+SUPPRESSED_RESULT = {"Suppressed": "A message like this one was just sent to the teacher, so this one will not be sent again."}
+REPEATED_RESULT = {"Rejected": "A message like this one was just rejected for toxic or offensive content, so this one "
+                               "will not be sent to the teacher either."}
+
+
 class Message(models.Model):
     """A model class for representing an anonymous message from a student to a teacher of a class."""
 
+    class Status(models.TextChoices):
+        PENDING = 'PE', 'Pending'
+        REJECTED = 'RE', 'Rejected'
+        SENT = 'SE', 'Sent'
+        SUPPRESSED = 'SU', 'Suppressed'
+        HELD = 'HE', 'Held'
+        #Could not be moderated or delivered, and given up on
+        FAILED = 'FA', 'Failed'
+
     student = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE)
     message_body = models.TextField()
     is_malicious = models.BooleanField(default=False)
+    status = models.CharField(
+        max_length=2,
+        choices=Status.choices,
+        default=Status.PENDING,
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+
+    #The Perspective scores of the last is_malicious_msg call, None if it did not score the text
+    moderation_scores = None
+
+    class Meta:
+        #Keyset pagination of a teacher's inbox and a student's history reads these in index order.
+        #is_malicious is a key column rather than a partial index condition, which MySQL lacks.
+        indexes = [
+            models.Index(fields=["teacher", "is_malicious", "-created_at", "-id"], name="message_teacher_inbox"),
+            models.Index(fields=["student", "is_malicious", "-created_at", "-id"], name="message_student_history"),
+        ]
 
     def email_message(self):
         """
         Check the message for malicious content. If it is malicious, mark as malicious and increment the student account's infractions.
-        If it is not malicious, send the message as an email.
+        If it is not malicious, queue the message in the outbox to be emailed to the teacher.
+        Raises moderation.ModerationUnavailable if Perspective cannot score it now.
+        Near duplicates of a message recently sent to the same teacher are not moderated again but share
+        its decision; see apply_moderation. They raise dedup.LeaderUndecided, a ModerationUnavailable,
+        if that message is not decided in time.
 
         Returns a dict with a status and message.
         """
 
-        if self.is_malicious_msg():
-            self.is_malicious = True
-            self.save(update_fields=['is_malicious'])
+        leader = dedup.leader_of(self)
+        if leader is not None:
+            dedup.wait(leader)
+        malicious = self.is_malicious_msg() if leader is None else leader.malicious
+        return self.apply_moderation(leader, malicious)
 
-            num_infractions = self.student.increment_infractions()
+    def apply_moderation(self, leader, malicious):
+        """
+        Act on the moderation of the message in one transaction, for email_message and aemail_message:
+        reject it or queue it in the outbox according to malicious. A near duplicate of the decided
+        message leader, from a student who already sent the flood a message, is instead suppressed, or
+        rejected without another infraction with a malicious leader.
 
-            return {"Rejected":f"This message contains toxic or offensive content and will not \
-                    be sent to the teacher. Your account has sent {num_infractions} malicious messages."}
-        else:
-            send_mail("Message from one of your students", self.message_body, from_email=None, recipient_list=[self.teacher.email])
-            return {"Success":"This message has been sent to the teacher."}
+        Returns a dict with a status and message.
+        """
 
+        if leader is not None and not dedup.join(leader, self):
+            if leader.malicious:
+                #The student was already charged an infraction for the flood
+                self.is_malicious = True
+                self.status = self.Status.REJECTED
+                self.save(update_fields=['is_malicious', 'status'])
+                return REPEATED_RESULT
+            self.status = self.Status.SUPPRESSED
+            self.save(update_fields=['status'])
+            return SUPPRESSED_RESULT
+        if leader is None:
+            dedup.decide(self, malicious)
+
+        with transaction.atomic():
+            scoring.store([self], self.moderation_scores)
+            if malicious:
+                self.is_malicious = True
+                self.status = self.Status.REJECTED
+                self.save(update_fields=['is_malicious', 'status'])
+
+                num_infractions = self.student.increment_infractions()
+                suspended = "" if self.student.is_active else " Your account has been suspended."
+
+                return {"Rejected":f"This message contains toxic or offensive content and will not \
+                        be sent to the teacher. Your account has sent {num_infractions} malicious messages.{suspended}"}
+            else:
+                if self.status == self.Status.HELD:
+                    self.status = self.Status.PENDING
+                    self.save(update_fields=['status'])
+                OutboxEmail.objects.create(message=self, recipient=self.teacher_id, body=self.message_body)
+                return {"Success":"This message has been queued for delivery to the teacher."}
+
+    @metrics.timed("is_malicious_msg")
     def is_malicious_msg(self):
-        """Check if this message is malicious or not."""
+        """
+        Check if this message is malicious or not.
+        Texts containing a blocklisted term are rejected by the local pre-screen, and texts scored
+        recently are answered from the verdict cache, both without calling Perspective.
+        A text is malicious if any attribute scores above its threshold in MODERATION_THRESHOLDS.
+        """
+
+        self.moderation_scores = None
+        if prescreen.screen(self.message_body):
+            return True
+
+        scores = verdicts.lookup(self.message_body)
+        if scores is None:
+            start = time.perf_counter()
+            with metrics.span("perspective"):
+                scores = moderation.analyze(self.message_body)
+            verdicts.store(self.message_body, scores, api_seconds=time.perf_counter() - start)
+        self.moderation_scores = scores
+        return scoring.exceeds(scores)
+
+    async def aemail_message(self):
+        """
+        Asynchronous email_message, which moderates the message without blocking the event loop.
+        """
+
+        leader = dedup.leader_of(self)
+        if leader is not None:
+            await sync_to_async(dedup.wait, thread_sensitive=False)(leader)
+        malicious = await self.ais_malicious_msg() if leader is None else leader.malicious
+        return await sync_to_async(self.apply_moderation)(leader, malicious)
+
+    @metrics.timed("is_malicious_msg")
+    async def ais_malicious_msg(self):
+        """
+        Asynchronous is_malicious_msg. Perspective is called with the async HTTP client, so an event loop
+        can hold many moderation calls in flight at once.
+        """
+
+        self.moderation_scores = None
+        if prescreen.screen(self.message_body):
+            return True
 
-        attributes = {"TOXICITY": {},
-                    "IDENTITY_ATTACK": {},
-                    "INSULT": {}}
+        scores = await verdicts.alookup(self.message_body)
+        if scores is None:
+            start = time.perf_counter()
+            with metrics.span("perspective"):
+                scores = await moderation.aanalyze(self.message_body)
+            await verdicts.astore(self.message_body, scores, api_seconds=time.perf_counter() - start)
+        self.moderation_scores = scores
+        return scoring.exceeds(scores)
 
-        client = discovery.build(
-                    "commentanalzyer",
-                    "v1alpha1",
-                    developerKey=local_settings.perspective_api_key,
-                    discoveryServiceUrl="https://commentanalyzer.googleapis.com/$discovery/rest?version=v1alpha1",
-                    static_discovery=False,
-                )
 
-        analyze_request = {
-            "comment": {"text": self.message_body},
-            "requestedAttributes": attributes
-        }
-        response = client.comments().analyze(body=analyze_request).execute()
+class MessageJob(models.Model):
+    """
+    A queued moderation-and-delivery job for a message.
+    Jobs are claimed by pipeline workers and deleted once the message has been handled.
+    """
 
-        attribute_scores = json.loads(response)["attributeScores"]
-        for score in attribute_scores:
-            if score["summaryScore"]["value"] > 0.7:
-                return True
+    message = models.OneToOneField(Message, on_delete=models.CASCADE, related_name="job")
+    available_at = models.DateTimeField(default=timezone.now, db_index=True)
+    attempts = models.IntegerField(default=0)
+    locked_by = models.CharField(max_length=64, blank=True)
+    locked_at = models.DateTimeField(null=True)
 
-        return False
+    def __str__(self):
+        """Return a string representation of the job: the message it handles."""
+        return f"Job for message {self.message_id}"
+
+
+class OutboxEmail(models.Model):
+    """
+    An email to a teacher waiting in the outbox.
+    The outbox sender delivers pending emails in bulk and marks them and their messages as sent.
+    Failed emails are retried at next_attempt_at, and given up on after OUTBOX_MAX_ATTEMPTS attempts.
+    """
+
+    message = models.OneToOneField(Message, on_delete=models.CASCADE, related_name="outbox_email")
+    recipient = models.EmailField(max_length=256)
+    body = models.TextField()
+    created_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["sent_at", "next_attempt_at"]),
+            models.Index(fields=["recipient", "sent_at"]),
+        ]
+
+    def __str__(self):
+        """Return a string representation of the email: its recipient."""
+        return f"Email to {self.recipient}"
 
 
+class ModerationVerdict(models.Model):
+    """
+    The Perspective scores of a message text, keyed by the SHA-256 of the normalized text.
+    Backs the verdict cache in feedback_man.verdicts.
+    """
+
+    digest = models.CharField(max_length=64, primary_key=True)
+    scores = models.JSONField()
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        """Return a string representation of the verdict: the text digest."""
+        return self.digest
+
+
+class MessageScores(models.Model):
+    """
+    The Perspective scores a message was moderated with, in ten-thousandths (see feedback_man.scoring).
+    Messages rejected by the pre-screen or as near duplicates have none.
+    """
+
+    message = models.OneToOneField(Message, on_delete=models.CASCADE, primary_key=True, related_name="scores")
+    toxicity = models.PositiveSmallIntegerField(default=0)
+    identity_attack = models.PositiveSmallIntegerField(default=0)
+    insult = models.PositiveSmallIntegerField(default=0)
+
+    def __str__(self):
+        """Return a string representation of the scores: the message they belong to."""
+        return f"Scores of message {self.message_id}"
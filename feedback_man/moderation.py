@@ -0,0 +1,452 @@
+"""
+Long-lived client for the Perspective comment analyzer API.
+
+Building a googleapiclient service fetches the discovery document over the network, so the
+service is built once per process and shared. googleapiclient's transport is not
+thread-safe, so each thread executes requests over its own httplib2.Http. Comments submitted
+while another request is in flight are queued and sent together in one batch HTTP request.
+
+The async path posts straight to the analyze REST endpoint with a shared httpx.AsyncClient, so
+an event loop can hold many moderation calls in flight. Without httpx installed it falls back to
+running the synchronous client in a worker thread.
+
+analyze and aanalyze are the gateway the rest of the app moderates through. A call gets
+PERSPECTIVE_DEADLINE seconds in all. Timeouts, network errors, throttling and server errors
+are retried up to PERSPECTIVE_RETRIES times after a fully jittered exponential delay, as long
+as the deadline allows. Every attempt goes through a circuit breaker: after
+PERSPECTIVE_BREAKER_FAILURES consecutive failed attempts, calls fail fast for
+PERSPECTIVE_BREAKER_RESET seconds, then one trial call decides whether to close it again. A text
+which cannot be scored raises ModerationUnavailable, and callers hold its message for later
+(see MODERATION_DEGRADED_MODE) rather than wait.
+
+The breaker itself is per process, but whenever it opens or closes the state is published to the
+MODERATION_BREAKER_CACHE_ALIAS cache, so processes which never call Perspective themselves (e.g.
+the synchronous API, which leaves moderation to the pipeline workers) see the outage too.
+"""
+import asyncio
+import itertools
+import math
+import queue
+import random
+import threading
+import time
+import weakref
+from collections import Counter
+from concurrent.futures import Future
+
+import httplib2
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from googleapiclient import discovery
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+ATTRIBUTES = ("TOXICITY", "IDENTITY_ATTACK", "INSULT")
+
+
+class ModerationUnavailable(Exception):
+    """Perspective did not score a text before the deadline, or the circuit breaker is open."""
+
+    def __init__(self, retry_after: float, reason: str = "Perspective is unavailable"):
+        super().__init__(f"{reason}, retry in {retry_after:.1f}s")
+        #Seconds until the circuit breaker lets calls through again, 0 if it is closed
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast after failure_threshold consecutive failures. While open, it lets one trial
+    call through every reset_timeout seconds: its success closes the breaker, its failure keeps
+    it open.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Return whether a call may go ahead, as the trial call if the breaker is open."""
+
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            now = self.clock()
+            #Also lets another trial through if the last one never reported back
+            if now - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.opened_at = now
+                return True
+            return False
+
+    def success(self) -> bool:
+        """Record a successful call and return whether it closed the breaker."""
+
+        with self.lock:
+            closed = self.state != self.CLOSED
+            self.state = self.CLOSED
+            self.failures = 0
+            return closed
+
+    def failure(self) -> bool:
+        """Record a failed call and return whether it opened the breaker."""
+
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+                return True
+            return False
+
+    def retry_after(self) -> float:
+        """Return the seconds until calls are let through again, 0 if they are now."""
+
+        with self.lock:
+            if self.state == self.CLOSED:
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_timeout - self.clock())
+
+
+class PerspectiveClient:
+    """
+    A thread-safe Perspective client which builds its service once and batches queued comments.
+
+    Comments are handed to a small pool of dispatcher threads. Each dispatcher takes every
+    comment waiting in the queue (up to max_batch) and scores them in a single HTTP request,
+    so batching happens exactly when messages queue up and adds no latency otherwise.
+    """
+
+    def __init__(self, api_key: str, discovery_url: str, max_batch: int = 20, workers: int = 4,
+                 timeout: float = None):
+        self.api_key = api_key
+        self.discovery_url = discovery_url
+        #Socket timeout of each HTTP request, so a hung connection cannot hold a dispatcher forever
+        self.timeout = timeout
+        self.max_batch = max_batch
+        self.workers = workers
+        self._service = None
+        self._build_lock = threading.Lock()
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._dispatchers = []
+        self._dispatch_lock = threading.Lock()
+
+    @property
+    def service(self):
+        """The googleapiclient service, built on first use."""
+
+        if self._service is None:
+            with self._build_lock:
+                if self._service is None:
+                    self._service = discovery.build(
+                        "commentanalyzer",
+                        "v1alpha1",
+                        developerKey=self.api_key,
+                        discoveryServiceUrl=self.discovery_url,
+                        static_discovery=False,
+                        http=self._http(),
+                    )
+        return self._service
+
+    def _http(self) -> httplib2.Http:
+        """Return the calling thread's HTTP transport."""
+
+        if not hasattr(self._local, "http"):
+            self._local.http = httplib2.Http(timeout=self.timeout)
+        return self._local.http
+
+    def _analyze_request(self, text: str):
+        body = {
+            "comment": {"text": text},
+            "requestedAttributes": {attribute: {} for attribute in ATTRIBUTES},
+        }
+        return self.service.comments().analyze(body=body)
+
+    def analyze_many(self, texts: list) -> list:
+        """
+        Score every text in one HTTP request and return a list of {attribute: score} dicts in the
+        same order, with the error in the slot of each comment Perspective did not score, so one
+        refused comment does not fail the others. Raises if the request itself fails.
+        """
+
+        if len(texts) == 1:
+            return [parse_scores(self._analyze_request(texts[0]).execute(http=self._http()))]
+
+        results = [None] * len(texts)
+
+        def callback(request_id, response, exception):
+            results[int(request_id)] = exception or parse_scores(response)
+
+        batch = self.service.new_batch_http_request(callback=callback)
+        for i, text in enumerate(texts):
+            batch.add(self._analyze_request(text), request_id=str(i))
+        batch.execute(http=self._http())
+        return results
+
+    def submit(self, text: str) -> Future:
+        """Queue the text for scoring and return a Future of its {attribute: score} dict."""
+
+        self._start_dispatchers()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def analyze(self, text: str) -> dict:
+        """Score a single text, batching it with any other comments waiting to be sent."""
+
+        return self.submit(text).result()
+
+    def _start_dispatchers(self):
+        if len(self._dispatchers) == self.workers:
+            return
+        with self._dispatch_lock:
+            while len(self._dispatchers) < self.workers:
+                thread = threading.Thread(target=self._dispatch, daemon=True)
+                thread.start()
+                self._dispatchers.append(thread)
+
+    def _dispatch(self):
+        """Dispatcher loop: take every waiting comment and score them in one request."""
+
+        while True:
+            pending = [self._queue.get()]
+            while len(pending) < self.max_batch:
+                try:
+                    pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            pending = [(text, future) for text, future in pending if future.set_running_or_notify_cancel()]
+            if not pending:
+                continue
+            try:
+                results = self.analyze_many([text for text, _ in pending])
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(pending, results):
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+
+
+def parse_scores(response: dict) -> dict:
+    """Reduce an analyze response to a dict of {attribute: summary score}."""
+
+    return {
+        attribute: score["summaryScore"]["value"]
+        for attribute, score in response["attributeScores"].items()
+    }
+
+
+_client = None
+_client_lock = threading.Lock()
+_breaker = None
+_breaker_lock = threading.Lock()
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def get_client() -> PerspectiveClient:
+    """Return the process-wide Perspective client, creating it from settings on first use."""
+
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PerspectiveClient(
+                    settings.PERSPECTIVE_API_KEY,
+                    settings.PERSPECTIVE_DISCOVERY_URL,
+                    max_batch=settings.PERSPECTIVE_MAX_BATCH,
+                    workers=settings.PERSPECTIVE_WORKERS,
+                    timeout=settings.PERSPECTIVE_TIMEOUT,
+                )
+    return _client
+
+
+def get_breaker() -> CircuitBreaker:
+    """Return the process-wide circuit breaker of moderation calls."""
+
+    global _breaker
+    if _breaker is None:
+        with _breaker_lock:
+            if _breaker is None:
+                _breaker = CircuitBreaker(settings.PERSPECTIVE_BREAKER_FAILURES, settings.PERSPECTIVE_BREAKER_RESET)
+    return _breaker
+
+
+#Shared cache key of the wall clock time until which some process's breaker is open
+SHARED_BREAKER_KEY = "moderation:breaker:open-until"
+
+
+def publish_breaker(breaker: CircuitBreaker):
+    """Publish that the breaker opened, or closed if it has no retry_after, to the shared cache."""
+
+    cache = caches[settings.MODERATION_BREAKER_CACHE_ALIAS]
+    retry_after = breaker.retry_after()
+    if retry_after:
+        cache.set(SHARED_BREAKER_KEY, time.time() + retry_after, math.ceil(retry_after))
+    else:
+        cache.delete(SHARED_BREAKER_KEY)
+
+
+def shared_retry_after() -> float:
+    """Return the seconds until the breaker any process last published open lets calls through, 0 if none."""
+
+    open_until = caches[settings.MODERATION_BREAKER_CACHE_ALIAS].get(SHARED_BREAKER_KEY)
+    return max(0.0, open_until - time.time()) if open_until else 0.0
+
+
+def succeeded(breaker: CircuitBreaker):
+    if breaker.success():
+        publish_breaker(breaker)
+
+
+def record(event: str):
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def retryable(error: Exception) -> bool:
+    """
+    Return whether a failed attempt may succeed if tried again: timeouts, network errors,
+    throttling and server errors, but not requests Perspective refused (e.g. unsupported languages).
+    """
+
+    #googleapiclient's HttpError has an httplib2 resp, httpx's HTTPStatusError a response
+    status = getattr(getattr(error, "resp", None), "status", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status is None or status == 429 or status >= 500
+
+
+def attempt_failed(breaker: CircuitBreaker, error: Exception, attempt: int, deadline: float) -> float:
+    """
+    Record a failed attempt and return the delay before the next one. Raises the error if retrying
+    cannot help, and ModerationUnavailable if there are no attempts or time left.
+    """
+
+    if not retryable(error):
+        #Perspective answered, so it is up
+        succeeded(breaker)
+        raise error
+    record("failures")
+    if breaker.failure():
+        record("opened")
+        publish_breaker(breaker)
+    cap = min(settings.PERSPECTIVE_RETRY_MAX_DELAY, settings.PERSPECTIVE_RETRY_BASE_DELAY * 2 ** attempt)
+    delay = random.uniform(0, cap)
+    if attempt >= settings.PERSPECTIVE_RETRIES or time.monotonic() + delay >= deadline:
+        raise ModerationUnavailable(breaker.retry_after()) from error
+    return delay
+
+
+def analyze(text: str) -> dict:
+    """
+    Score the text with the shared client and return a dict of {attribute: score}. Raises
+    ModerationUnavailable if it cannot be scored within PERSPECTIVE_DEADLINE seconds, and right
+    away while the circuit breaker is open.
+    """
+
+    breaker = get_breaker()
+    deadline = time.monotonic() + settings.PERSPECTIVE_DEADLINE
+    record("calls")
+    for attempt in itertools.count():
+        if not breaker.allow():
+            record("short_circuited")
+            raise ModerationUnavailable(breaker.retry_after())
+        future = get_client().submit(text)
+        try:
+            scores = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except Exception as error:
+            #Drops the comment if it is still queued; a request already sent finishes in the background
+            future.cancel()
+            delay = attempt_failed(breaker, error, attempt, deadline)
+        else:
+            succeeded(breaker)
+            return scores
+        record("retries")
+        time.sleep(delay)
+
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """Return the httpx.AsyncClient of the running event loop, creating it on first use."""
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=settings.PERSPECTIVE_TIMEOUT,
+            limits=httpx.Limits(max_connections=settings.PERSPECTIVE_MAX_ASYNC_CONNECTIONS),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def aanalyze(text: str) -> dict:
+    """Asynchronous analyze: score the text without blocking the event loop."""
+
+    if httpx is None:
+        return await sync_to_async(analyze, thread_sensitive=False)(text)
+
+    body = {
+        "comment": {"text": text},
+        "requestedAttributes": {attribute: {} for attribute in ATTRIBUTES},
+    }
+    breaker = get_breaker()
+    deadline = time.monotonic() + settings.PERSPECTIVE_DEADLINE
+    record("calls")
+    for attempt in itertools.count():
+        if not breaker.allow():
+            record("short_circuited")
+            raise ModerationUnavailable(breaker.retry_after())
+        try:
+            response = await asyncio.wait_for(
+                get_async_client().post(
+                    settings.PERSPECTIVE_ANALYZE_URL, params={"key": settings.PERSPECTIVE_API_KEY}, json=body
+                ),
+                max(0.0, deadline - time.monotonic()),
+            )
+            response.raise_for_status()
+            scores = parse_scores(response.json())
+        except Exception as error:
+            delay = attempt_failed(breaker, error, attempt, deadline)
+        else:
+            succeeded(breaker)
+            return scores
+        record("retries")
+        await asyncio.sleep(delay)
+
+
+def stats() -> dict:
+    """
+    Return this process's moderation call counters (calls, retried and failed attempts, calls
+    failed fast by the open breaker, times it opened) and the state of the circuit breaker.
+    """
+
+    with _stats_lock:
+        counts = dict(_stats)
+    breaker = get_breaker()
+    return {
+        **{event: counts.get(event, 0) for event in ("calls", "retries", "failures", "short_circuited", "opened")},
+        "breaker": breaker.state,
+        "retry_after": breaker.retry_after(),
+    }
@@ -0,0 +1,229 @@
+"""
+Sender for the transactional email outbox.
+
+Accepted messages are written to the OutboxEmail table by Message.email_message. The sender
+drains pending emails in bulk over a single SMTP session from get_connection(), instead of
+opening a new TLS connection per message. With OUTBOX_DIGEST_INTERVAL set, each teacher
+receives at most one digest email per interval containing every message queued for them.
+
+A sender first claims a batch of due rows in a short transaction, by moving their next attempt
+OUTBOX_CLAIM_TIMEOUT seconds ahead, then sends them without holding row locks or a transaction
+open, so several senders can run at once and a sender that dies leaves its batch to the others.
+Emails which fail are retried after an exponential backoff, and given up on after
+OUTBOX_MAX_ATTEMPTS attempts, or right away if the server refuses them permanently; their
+messages are then marked Failed.
+
+adrain is the asyncio variant: it talks SMTP through aiosmtplib, when installed, so an event loop
+can deliver mail without blocking.
+"""
+import asyncio
+import logging
+import smtplib
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from . import metrics
+from .models import Message, OutboxEmail
+
+try:
+    import aiosmtplib
+except ImportError:
+    aiosmtplib = None
+
+SUBJECT = "Message from one of your students"
+DIGEST_SUBJECT = "{count} messages from your students"
+DIGEST_SEPARATOR = "\n\n----------\n\n"
+
+logger = logging.getLogger(__name__)
+
+
+def due_emails(now=None):
+    """
+    Return a queryset of the undelivered outbox rows due for an attempt, oldest due first, without
+    the ones given up on. In digest mode, teachers who received a digest within the interval are skipped.
+    """
+
+    now = now or timezone.now()
+    due = OutboxEmail.objects.filter(sent_at__isnull=True, next_attempt_at__lte=now,
+                                     attempts__lt=settings.OUTBOX_MAX_ATTEMPTS)
+    if settings.OUTBOX_DIGEST_INTERVAL:
+        cutoff = now - timedelta(seconds=settings.OUTBOX_DIGEST_INTERVAL)
+        recent = OutboxEmail.objects.filter(sent_at__gt=cutoff).values("recipient")
+        due = due.exclude(recipient__in=recent)
+    return due.order_by("next_attempt_at")
+
+
+def claim(batch_size: int) -> list:
+    """
+    Claim up to batch_size due outbox rows for this sender and return them. Claimed rows are not
+    due again for OUTBOX_CLAIM_TIMEOUT seconds, unless they fail sooner.
+    """
+
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(due_emails(now).select_for_update(skip_locked=True)[:batch_size])
+        OutboxEmail.objects.filter(pk__in=[row.pk for row in rows]).update(
+            next_attempt_at=now + timedelta(seconds=settings.OUTBOX_CLAIM_TIMEOUT)
+        )
+    return rows
+
+
+def build_emails(pending: list) -> list:
+    """
+    Return a list of (EmailMessage, [OutboxEmail]) pairs for the pending outbox rows,
+    folding each teacher's emails into one digest when digest mode is enabled.
+    """
+
+    if not settings.OUTBOX_DIGEST_INTERVAL:
+        return [
+            (EmailMessage(SUBJECT, email.body, to=[email.recipient]), [email])
+            for email in pending
+        ]
+
+    by_recipient = {}
+    for email in pending:
+        by_recipient.setdefault(email.recipient, []).append(email)
+
+    emails = []
+    for recipient, group in by_recipient.items():
+        if len(group) == 1:
+            emails.append((EmailMessage(SUBJECT, group[0].body, to=[recipient]), group))
+        else:
+            body = DIGEST_SEPARATOR.join(email.body for email in group)
+            emails.append((EmailMessage(DIGEST_SUBJECT.format(count=len(group)), body, to=[recipient]), group))
+    return emails
+
+
+def drain(batch_size: int = 100, connection=None) -> int:
+    """
+    Claim up to batch_size due outbox emails, send them over one SMTP session and mark them, and
+    their messages, as sent. Returns the number of outbox rows delivered.
+    Emails which fail to send are retried later; see mark_failed.
+    """
+
+    emails = build_emails(claim(batch_size))
+    if not emails:
+        return 0
+
+    delivered = []
+    failed = []
+    attempted = 0
+    connection = connection or get_connection()
+    try:
+        with connection:
+            for email, rows in emails:
+                email.connection = connection
+                attempted += 1
+                try:
+                    with metrics.span("send_mail"):
+                        email.send()
+                except (smtplib.SMTPException, OSError) as e:
+                    logger.exception("Failed to send outbox email to %s", email.to[0])
+                    failed.append((rows, e))
+                else:
+                    delivered.extend(rows)
+    except (smtplib.SMTPException, OSError) as e:
+        #Opening (or closing) the session failed: every email it did not get to failed with it
+        logger.exception("SMTP session failed with %d outbox emails not attempted", len(emails) - attempted)
+        failed.extend((rows, e) for _, rows in emails[attempted:])
+
+    mark_sent(delivered)
+    mark_failed(failed)
+    return len(delivered)
+
+
+def mark_sent(delivered: list):
+    """Mark the delivered outbox rows, and their messages, as sent."""
+
+    OutboxEmail.objects.filter(pk__in=[row.pk for row in delivered]).update(sent_at=timezone.now())
+    Message.objects.filter(pk__in=[row.message_id for row in delivered]).update(status=Message.Status.SENT)
+
+
+def permanent(error: Exception) -> bool:
+    """
+    Return whether the SMTP server refused the email for good: a 5xx reply, or every recipient
+    refused with one. Recipients refused with a 4xx reply (e.g. greylisting) may be accepted later.
+    """
+
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+    elif aiosmtplib is not None and isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        codes = [recipient.code for recipient in error.recipients]
+    else:
+        #smtplib's errors carry smtp_code, aiosmtplib's code
+        codes = [getattr(error, "smtp_code", None) or getattr(error, "code", None)]
+    return bool(codes) and all(isinstance(code, int) and 500 <= code < 600 for code in codes)
+
+
+def mark_failed(failed: list):
+    """
+    Count a failed attempt for each (rows, error) pair and retry the rows after an exponential
+    backoff, capped at OUTBOX_MAX_BACKOFF seconds. Rows refused permanently, or which reach
+    OUTBOX_MAX_ATTEMPTS, are given up on: they stay undelivered and are not attempted again, and
+    their messages are marked Failed.
+    """
+
+    now = timezone.now()
+    given_up = []
+    for rows, error in failed:
+        for row in rows:
+            attempts = settings.OUTBOX_MAX_ATTEMPTS if permanent(error) else row.attempts + 1
+            if attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                logger.error("Giving up on outbox email %s to %s after %d attempts: %s",
+                             row.pk, row.recipient, row.attempts + 1, error)
+                given_up.append(row.message_id)
+            delay = min(settings.OUTBOX_RETRY_DELAY * 2 ** row.attempts, settings.OUTBOX_MAX_BACKOFF)
+            OutboxEmail.objects.filter(pk=row.pk).update(attempts=attempts,
+                                                         next_attempt_at=now + timedelta(seconds=delay))
+    Message.objects.filter(pk__in=given_up, status=Message.Status.PENDING).update(status=Message.Status.FAILED)
+
+
+async def adrain(batch_size: int = 100) -> int:
+    """
+    Asynchronous drain over one aiosmtplib session. Falls back to drain in a worker thread when
+    aiosmtplib is not installed or EMAIL_BACKEND is not the SMTP backend.
+    """
+
+    if aiosmtplib is None or settings.EMAIL_BACKEND != "django.core.mail.backends.smtp.EmailBackend":
+        return await sync_to_async(drain)(batch_size)
+
+    emails = build_emails(await sync_to_async(claim)(batch_size))
+    if not emails:
+        return 0
+
+    delivered = []
+    failed = []
+    smtp = aiosmtplib.SMTP(
+        hostname=settings.EMAIL_HOST,
+        port=settings.EMAIL_PORT,
+        username=settings.EMAIL_HOST_USER or None,
+        password=settings.EMAIL_HOST_PASSWORD or None,
+        use_tls=settings.EMAIL_USE_SSL,
+        start_tls=settings.EMAIL_USE_TLS,
+        timeout=settings.EMAIL_TIMEOUT,
+    )
+    attempted = 0
+    try:
+        async with smtp:
+            for email, rows in emails:
+                attempted += 1
+                try:
+                    with metrics.span("send_mail"):
+                        await smtp.send_message(email.message())
+                except (aiosmtplib.SMTPException, OSError, asyncio.TimeoutError) as e:
+                    logger.exception("Failed to send outbox email to %s", email.to[0])
+                    failed.append((rows, e))
+                else:
+                    delivered.extend(rows)
+    except (aiosmtplib.SMTPException, OSError, asyncio.TimeoutError) as e:
+        logger.exception("SMTP session failed with %d outbox emails not attempted", len(emails) - attempted)
+        failed.extend((rows, e) for _, rows in emails[attempted:])
+
+    await sync_to_async(mark_sent)(delivered)
+    await sync_to_async(mark_failed)(failed)
+    return len(delivered)
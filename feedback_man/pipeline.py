@@ -0,0 +1,206 @@
+"""
+Database-backed job queue for moderating and delivering messages outside the request cycle.
+
+The /message endpoint stores the message and enqueues a MessageJob. Workers claim batches of
+jobs with a conditional UPDATE (so concurrent workers never claim the same job, on any
+database backend), run Message.email_message and delete the job. Failed jobs are retried
+with exponential backoff, up to PIPELINE_MAX_ATTEMPTS attempts, and their messages marked
+Failed once given up on; jobs held by a worker that died are reclaimed after a timeout.
+The async endpoint moderates the message itself, but stores it with a job it has claimed,
+which the workers take over if the request fails or never finishes.
+While Perspective is unavailable, messages are held (status Held) and their jobs wait for the
+moderation circuit breaker to let calls through again, without counting as failed attempts.
+Accepted messages land in the email outbox, which a sender thread drains in bulk. The sender
+thread also purges expired moderation verdicts every MODERATION_VERDICT_PURGE_INTERVAL seconds.
+"""
+import logging
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import moderation, outbox, verdicts
+from .models import Message, MessageJob
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_message(message: Message) -> MessageJob:
+    """Queue the message for moderation and delivery by the pipeline workers."""
+
+    return MessageJob.objects.create(message=message)
+
+
+def submit_message(**fields) -> tuple:
+    """
+    Create a message and its job in one transaction, for a request which moderates the message
+    itself. The job starts out claimed by the request, so the pipeline workers only take it over
+    if the request does not finish within PIPELINE_LOCK_TIMEOUT; release_job hands it over at once.
+    Returns (message, job).
+    """
+
+    with transaction.atomic():
+        message = Message.objects.create(**fields)
+        job = MessageJob.objects.create(message=message, locked_by="request", locked_at=timezone.now())
+    return message, job
+
+
+def release_job(job: MessageJob):
+    """Hand a job claimed by a request over to the pipeline workers."""
+
+    MessageJob.objects.filter(pk=job.pk).update(locked_by="", locked_at=None)
+
+
+def hold_message(message: Message, retry_after: float = 0.0):
+    """
+    Mark the message Held while Perspective is unavailable, and have the pipeline workers
+    moderate it in retry_after seconds, when the circuit breaker lets calls through again.
+    """
+
+    available_at = timezone.now() + timedelta(seconds=retry_after)
+    with transaction.atomic():
+        message.status = Message.Status.HELD
+        message.save(update_fields=["status"])
+        MessageJob.objects.update_or_create(
+            message=message, defaults={"available_at": available_at, "locked_by": "", "locked_at": None}
+        )
+
+
+def claim_jobs(limit: int) -> list:
+    """
+    Claim up to limit available jobs for the calling worker and return them with their
+    messages loaded.
+    """
+
+    now = timezone.now()
+    claimable = Q(available_at__lte=now) & (
+        Q(locked_at__isnull=True) | Q(locked_at__lt=now - timedelta(seconds=settings.PIPELINE_LOCK_TIMEOUT))
+    )
+    with transaction.atomic():
+        candidates = list(
+            MessageJob.objects.select_for_update(skip_locked=True)
+            .filter(claimable)
+            .order_by("available_at")
+            .values_list("pk", flat=True)[:limit]
+        )
+        if not candidates:
+            return []
+        token = uuid.uuid4().hex
+        MessageJob.objects.filter(claimable, pk__in=candidates).update(locked_by=token, locked_at=now)
+
+    return list(
+        MessageJob.objects.filter(locked_by=token)
+        .select_related("message__student", "message__teacher")
+    )
+
+
+def fail_message(job: MessageJob):
+    """Give up on the job: mark its message Failed, unless it was already decided, and remove the job."""
+
+    with transaction.atomic():
+        Message.objects.filter(
+            pk=job.message_id, status__in=[Message.Status.PENDING, Message.Status.HELD]
+        ).update(status=Message.Status.FAILED)
+        job.delete()
+
+
+def process_job(job: MessageJob):
+    """
+    Moderate and deliver the job's message, then remove the job. Reschedules on failure, and
+    gives up after PIPELINE_MAX_ATTEMPTS attempts or right away if retrying cannot help.
+    """
+
+    try:
+        job.message.email_message()
+    except moderation.ModerationUnavailable as e:
+        logger.warning("Holding message %s: %s", job.message_id, e)
+        hold_message(job.message, e.retry_after)
+    except Exception as e:
+        if not moderation.retryable(e) or job.attempts + 1 >= settings.PIPELINE_MAX_ATTEMPTS:
+            logger.exception("Giving up on message %s after %d attempts", job.message_id, job.attempts + 1)
+            fail_message(job)
+            return
+        logger.exception("Failed to process message %s", job.message_id)
+        delay = min(2 ** job.attempts, settings.PIPELINE_MAX_BACKOFF)
+        MessageJob.objects.filter(pk=job.pk).update(
+            attempts=F("attempts") + 1,
+            available_at=timezone.now() + timedelta(seconds=delay),
+            locked_by="",
+            locked_at=None,
+        )
+    else:
+        job.delete()
+
+
+def run_worker(stop: threading.Event, batch_size: int, poll_interval: float):
+    """Claim and process jobs until stop is set, sleeping for poll_interval when idle."""
+
+    try:
+        while not stop.is_set():
+            jobs = claim_jobs(batch_size)
+            for job in jobs:
+                process_job(job)
+            if not jobs:
+                stop.wait(poll_interval)
+    finally:
+        connection.close()
+
+
+def purge_verdicts():
+    """Delete the expired moderation verdicts, logging rather than raising on failure."""
+
+    try:
+        deleted = verdicts.purge_expired()
+    except Exception:
+        logger.exception("Failed to purge expired moderation verdicts")
+    else:
+        if deleted:
+            logger.info("Purged %d expired moderation verdicts", deleted)
+
+
+def run_sender(stop: threading.Event, poll_interval: float):
+    """
+    Drain the email outbox until stop is set, sleeping for poll_interval when it is empty, and
+    purge expired moderation verdicts every MODERATION_VERDICT_PURGE_INTERVAL seconds.
+    """
+
+    next_purge = time.monotonic()
+    try:
+        while not stop.is_set():
+            if time.monotonic() >= next_purge:
+                purge_verdicts()
+                next_purge = time.monotonic() + settings.MODERATION_VERDICT_PURGE_INTERVAL
+            try:
+                sent = outbox.drain(settings.OUTBOX_BATCH_SIZE)
+            except Exception:
+                logger.exception("Failed to drain the email outbox")
+                sent = 0
+            if not sent:
+                stop.wait(poll_interval)
+    finally:
+        connection.close()
+
+
+def run_pool(workers: int, batch_size: int, poll_interval: float, stop: threading.Event = None):
+    """Run a pool of worker threads and one outbox sender thread until stop is set (or forever)."""
+
+    stop = stop or threading.Event()
+    threads = [
+        threading.Thread(target=run_worker, args=(stop, batch_size, poll_interval), daemon=True)
+        for _ in range(workers)
+    ]
+    threads.append(threading.Thread(target=run_sender, args=(stop, poll_interval), daemon=True))
+    for thread in threads:
+        thread.start()
+    try:
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(poll_interval)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
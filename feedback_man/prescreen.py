@@ -0,0 +1,175 @@
+"""
+Local lexical pre-screen run before the remote toxicity scorer.
+
+Messages containing a blocklisted term are rejected locally, in microseconds, without a
+Perspective call. Text and terms are normalized the same way (case, unicode forms, leetspeak
+digits and symbols, punctuation inside words, stretched letters), then every term is found in
+one pass with an Aho-Corasick automaton. Terms only match whole words, so a blocklisted word
+inside an innocent one does not trigger a rejection.
+
+Only runs of three or more of a letter count as stretched, since doubled letters are ordinary
+spelling: collapsing them would make "butt" match "but the". A stretched run is normalized to
+the letter and STRETCHED, and each term is added once as is and once with each of its runs
+stretched, so "fuuuck" still matches "fuck" while "good" does not match "god". Terms stretched
+in more than one place are left to Perspective.
+"""
+import re
+import threading
+import unicodedata
+from collections import Counter, deque
+
+from django.conf import settings
+
+#"!" and "|" are left out: as sentence punctuation they are far more common than as letters
+LEET = str.maketrans({"0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t", "8": "b",
+                      "@": "a", "$": "s", "+": "t"})
+#Marks a run of three or more of the letter before it. Punctuation never survives normalize.
+STRETCHED = "*"
+STRETCH = re.compile(r"(\w)\1\1+")
+
+
+def runs(text: str) -> list:
+    """Return the runs of a repeated character in the text as [character, length] pairs."""
+
+    pairs = []
+    for char in text:
+        if pairs and pairs[-1][0] == char:
+            pairs[-1][1] += 1
+        else:
+            pairs.append([char, 1])
+    return pairs
+
+
+def normalize(text: str) -> str:
+    """
+    Normalize text for matching: casefold, undo leetspeak, drop punctuation (so "i.d.i.o.t"
+    becomes "idiot"), replace runs of three or more of a letter with the letter and STRETCHED
+    and collapse whitespace.
+    """
+
+    text = unicodedata.normalize("NFKC", text).casefold().translate(LEET)
+    text = "".join(char for char in text if char.isalnum() or char.isspace())
+    return STRETCH.sub(r"\1" + STRETCHED, " ".join(text.split()))
+
+
+def stretched(term: str) -> list:
+    """Return the normalized term with each of its runs in turn stretched, e.g. "fu*ck" for "fuck"."""
+
+    pairs = runs(term)
+    return [
+        "".join(char + STRETCHED if j == i else char * length for j, (char, length) in enumerate(pairs))
+        for i, (char, length) in enumerate(pairs)
+        if char not in (" ", STRETCHED) and (i + 1 == len(pairs) or pairs[i + 1][0] != STRETCHED)
+    ]
+
+
+class Prescreen:
+    """An Aho-Corasick automaton over the normalized blocklist terms and their stretched forms."""
+
+    def __init__(self, terms):
+        #goto[state] maps a character to the next state; out[state] holds (length, term) of the terms ending there
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+        self.terms = set()
+        for term in terms:
+            term = normalize(term)
+            if term:
+                self.terms.add(term)
+                for form in [term, *stretched(term)]:
+                    self._add(form, term)
+        self._link()
+
+    def _add(self, form: str, term: str):
+        state = 0
+        for char in form:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(())
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        if (len(form), term) not in self.out[state]:
+            self.out[state] += ((len(form), term),)
+
+    def _link(self):
+        """Compute failure links breadth first, merging the outputs of each state's fallback."""
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.out[child] += self.out[self.fail[child]]
+
+    def find(self, text: str) -> list:
+        """Return the blocklisted terms found as whole words in the text, in order of appearance."""
+
+        text = normalize(text)
+        found = []
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for length, term in self.out[state]:
+                start = end - length
+                if (start == 0 or text[start - 1] == " ") and (end == len(text) or text[end] == " "):
+                    found.append(term)
+        return found
+
+    def matches(self, text: str) -> bool:
+        return bool(self.terms) and bool(self.find(text))
+
+
+def load_terms() -> list:
+    """Return the blocklist from MODERATION_BLOCKLIST and the file at MODERATION_BLOCKLIST_FILE, if set."""
+
+    terms = list(settings.MODERATION_BLOCKLIST)
+    if settings.MODERATION_BLOCKLIST_FILE:
+        with open(settings.MODERATION_BLOCKLIST_FILE, encoding="utf-8") as fp:
+            terms.extend(line.strip() for line in fp if line.strip() and not line.startswith("#"))
+    return terms
+
+
+_prescreen = None
+_prescreen_lock = threading.Lock()
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def get_prescreen() -> Prescreen:
+    """Return the process-wide pre-screen built from the configured blocklist."""
+
+    global _prescreen
+    if _prescreen is None:
+        with _prescreen_lock:
+            if _prescreen is None:
+                _prescreen = Prescreen(load_terms())
+    return _prescreen
+
+
+def screen(text: str) -> bool:
+    """Return True if the text contains a blocklisted term and can be rejected without a remote call."""
+
+    rejected = get_prescreen().matches(text)
+    with _stats_lock:
+        _stats["screened"] += 1
+        _stats["rejected"] += rejected
+    return rejected
+
+
+def stats() -> dict:
+    """Return this process's pre-screen counters. Every rejection is a remote call avoided."""
+
+    with _stats_lock:
+        screened, rejected = _stats["screened"], _stats["rejected"]
+    return {
+        "screened": screened,
+        "remote_calls_avoided": rejected,
+        "rejection_rate": rejected / screened if screened else 0.0,
+    }
@@ -0,0 +1,118 @@
+"""
+Routing of catalog reads to read replicas.
+
+Reads of the catalog (teachers, courses and their search indexes) go to a random one of the
+DATABASE_REPLICAS; every other read, and every write, goes to the default (primary) database.
+Catalog reads are pinned to the primary:
+- inside transactions;
+- in requests which may write (not GET, HEAD or OPTIONS), which validate against the rows they write;
+- for REPLICA_PIN_SECONDS after the current request, command or worker thread wrote;
+- for REPLICA_PIN_SECONDS after a request by the same user wrote (see
+  nameless_api.middleware.ReplicaPinningMiddleware), so users read their own writes despite
+  replication lag.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+
+#Models read from the replicas, as app_label.model_name
+REPLICATED_MODELS = {
+    "feedback_man.teacher",
+    "feedback_man.teachertrigram",
+    "feedback_man.course",
+    "feedback_man.course_teachers",
+    "feedback_man.coursesearchtoken",
+}
+
+
+class RoutingState:
+    """What the router knows about the database work of the current request, command or thread."""
+
+    def __init__(self, request=None):
+        self.request = request
+        self.unsafe = request is not None and request.method not in ("GET", "HEAD", "OPTIONS")
+        #time.monotonic() until which reads stay on the primary after a write
+        self.pinned_until = 0.0
+        self.wrote = False
+        #Whether the request's user wrote recently, looked up on the first catalog read
+        self.user_pinned = None
+
+
+_state = ContextVar("routing_state", default=None)
+
+
+def current_state() -> RoutingState:
+    state = _state.get()
+    if state is None:
+        state = RoutingState()
+        _state.set(state)
+    return state
+
+
+@contextmanager
+def routing(request=None):
+    """Route the enclosed database work with a fresh state, as the work of the given request."""
+
+    token = _state.set(RoutingState(request))
+    try:
+        yield _state.get()
+    finally:
+        _state.reset(token)
+
+
+def pin_key(request):
+    """Return the cache key pinning the request's user to the primary, or None if the user is unknown."""
+
+    user = getattr(request, "user", None)
+    if user is None or not user.is_authenticated:
+        return None
+    return f"replica_pin:{user.pk}"
+
+
+def remember_writes(state: RoutingState):
+    """Pin the user of the state's request to the primary for REPLICA_PIN_SECONDS if the request wrote."""
+
+    key = pin_key(state.request)
+    if state.wrote and key:
+        caches[settings.REPLICA_PIN_CACHE_ALIAS].set(key, True, settings.REPLICA_PIN_SECONDS)
+
+
+def pinned(state: RoutingState) -> bool:
+    if state.unsafe or connections[DEFAULT_DB_ALIAS].in_atomic_block or time.monotonic() < state.pinned_until:
+        return True
+    if state.user_pinned is None:
+        key = pin_key(state.request)
+        if key is None:
+            #Not authenticated yet, or anonymous
+            return False
+        state.user_pinned = bool(caches[settings.REPLICA_PIN_CACHE_ALIAS].get(key))
+    return state.user_pinned
+
+
+class ReplicaRouter:
+    """Send catalog reads to the DATABASE_REPLICAS and everything else to the primary."""
+
+    def db_for_read(self, model, **hints):
+        if not settings.DATABASE_REPLICAS or model._meta.label_lower not in REPLICATED_MODELS:
+            return None
+        if pinned(current_state()):
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        state = current_state()
+        state.wrote = True
+        state.pinned_until = time.monotonic() + settings.REPLICA_PIN_SECONDS
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        #The replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
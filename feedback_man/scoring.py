@@ -0,0 +1,117 @@
+"""
+Per-attribute moderation scores of messages, and the thresholds they are judged against.
+
+The Perspective scores each message was moderated with are kept in the MessageScores side
+table, one small integer column per attribute in ten-thousandths. A message is malicious if any
+attribute scores above its threshold in MODERATION_THRESHOLDS, compared at that precision both
+when moderating and in the database, so rethreshold() can judge every stored message against
+new thresholds with set-based UPDATEs and without scoring anything again.
+
+is_malicious is recomputed in both directions, but a message's status records what happened to
+it and is left alone: a sent message judged malicious was still delivered, and stays Sent, while
+a rejected message judged clean was never delivered, and stays Rejected, since delivering it long
+after it was sent is not for a threshold change to decide.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Count, Q
+
+from . import models
+
+SCALE = 10000
+#MessageScores column of each Perspective attribute
+COLUMNS = {"TOXICITY": "toxicity", "IDENTITY_ATTACK": "identity_attack", "INSULT": "insult"}
+
+
+def quantize(score: float) -> int:
+    return round(score * SCALE)
+
+
+def get_thresholds(overrides: dict = None) -> dict:
+    """Return MODERATION_THRESHOLDS updated with the overrides, if any."""
+
+    thresholds = {**settings.MODERATION_THRESHOLDS, **(overrides or {})}
+    unknown = set(thresholds) - set(COLUMNS)
+    if unknown or not thresholds:
+        raise ImproperlyConfigured(
+            f"MODERATION_THRESHOLDS needs thresholds of attributes among {', '.join(COLUMNS)}"
+            + (f", not {', '.join(sorted(unknown))}" if unknown else "")
+        )
+    return thresholds
+
+
+def exceeds(scores: dict, thresholds: dict = None) -> bool:
+    """Return whether any of the {attribute: score} scores is above its threshold."""
+
+    thresholds = thresholds or get_thresholds()
+    return any(quantize(scores.get(attribute, 0.0)) > quantize(limit) for attribute, limit in thresholds.items())
+
+
+def row(message_id: int, scores: dict):
+    return models.MessageScores(message_id=message_id, **{
+        column: quantize(scores.get(attribute, 0.0)) for attribute, column in COLUMNS.items()
+    })
+
+
+def store(messages: list, scores: dict):
+    """Keep the scores the messages were moderated with. Does nothing if they were not scored."""
+
+    if scores is not None:
+        #A message moderated again after a retry keeps its first scores
+        models.MessageScores.objects.bulk_create([row(message.pk, scores) for message in messages],
+                                                 ignore_conflicts=True)
+
+
+def over(thresholds: dict) -> Q:
+    """Return the condition on MessageScores of any attribute scoring above its threshold."""
+
+    condition = Q()
+    for attribute, limit in thresholds.items():
+        condition |= Q(**{f"{COLUMNS[attribute]}__gt": quantize(limit)})
+    return condition
+
+
+def rethreshold(thresholds: dict = None, chunk_size: int = 10000, dry_run: bool = False) -> Counter:
+    """
+    Judge every sent or rejected message with stored scores against the thresholds, in chunks of
+    messages in id order, and set is_malicious to the new decision, leaving statuses as they are.
+    Each chunk takes one aggregate query and two UPDATEs (only of the messages whose decision
+    changed) in one transaction. With dry_run nothing is updated.
+
+    Returns the counts of messages by (old decision, new decision), True meaning malicious.
+    Messages still being moderated or delivered (Pending or Held) and messages without scores
+    (rejected by the pre-screen, or as near duplicates) are left as they are. Students'
+    infractions are not changed.
+    """
+
+    exceeding = over(get_thresholds(thresholds))
+    settled = [models.Message.Status.SENT, models.Message.Status.REJECTED]
+    confusion = Counter()
+    last = 0
+    while True:
+        chunk = models.MessageScores.objects.filter(pk__gt=last)
+        upper = list(chunk.order_by("pk").values_list("pk", flat=True)[chunk_size - 1:chunk_size])
+        if upper:
+            chunk = chunk.filter(pk__lte=upper[0])
+        with transaction.atomic():
+            counts = chunk.filter(message__status__in=settled).aggregate(**{
+                f"{old}_{new}": Count("pk", filter=Q(message__is_malicious=old) & (exceeding if new else ~exceeding))
+                for old in (False, True) for new in (False, True)
+            })
+            for key, count in counts.items():
+                old, new = key.split("_")
+                confusion[old == "True", new == "True"] += count
+            if not dry_run:
+                #The subqueries only read MessageScores, since MySQL cannot update a table it selects from
+                models.Message.objects.filter(
+                    pk__in=chunk.filter(exceeding).values("pk"), is_malicious=False, status__in=settled,
+                ).update(is_malicious=True)
+                models.Message.objects.filter(
+                    pk__in=chunk.exclude(exceeding).values("pk"), is_malicious=True, status__in=settled,
+                ).update(is_malicious=False)
+        if not upper:
+            return confusion
+        last = upper[0]
@@ -0,0 +1,101 @@
+"""
+Maintenance of the search index tables used by the search managers, and of the catalog
+version that search result caches are keyed on.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+from .managers import course_tokens, trigrams
+from .models import Course, CourseSearchToken, Teacher, TeacherTrigram
+
+
+def index_teachers(teachers):
+    """Rebuild the name trigrams of the given teachers in the TeacherTrigram index."""
+
+    teachers = list(teachers)
+    TeacherTrigram.objects.filter(teacher__in=teachers).delete()
+    TeacherTrigram.objects.bulk_create(
+        [
+            TeacherTrigram(teacher=teacher, gram=gram)
+            for teacher in teachers
+            for gram in trigrams(teacher.teacher_name)
+        ],
+        batch_size=1000,
+    )
+
+
+def rebuild_teacher_index(chunk_size: int = 1000):
+    """Rebuild the trigram index of every teacher, chunk_size teachers at a time."""
+
+    TeacherTrigram.objects.all().delete()
+    chunk = []
+    for teacher in Teacher.objects.only("pk", "teacher_name").iterator(chunk_size=chunk_size):
+        chunk.append(teacher)
+        if len(chunk) == chunk_size:
+            index_teachers(chunk)
+            chunk = []
+    index_teachers(chunk)
+
+
+def index_courses(courses):
+    """Rebuild the search tokens of the given courses in the CourseSearchToken index."""
+
+    courses = list(courses)
+    CourseSearchToken.objects.filter(course__in=courses).delete()
+    CourseSearchToken.objects.bulk_create(
+        [
+            CourseSearchToken(course=course, token=token)
+            for course in courses
+            for token in course_tokens(course.subject, course.course_num, course.class_name,
+                                       course.semester, course.year)
+        ],
+        batch_size=1000,
+    )
+
+
+def rebuild_course_index(chunk_size: int = 1000):
+    """Rebuild the search tokens of every course, chunk_size courses at a time."""
+
+    CourseSearchToken.objects.all().delete()
+    chunk = []
+    for course in Course.objects.iterator(chunk_size=chunk_size):
+        chunk.append(course)
+        if len(chunk) == chunk_size:
+            index_courses(chunk)
+            chunk = []
+    index_courses(chunk)
+
+
+CATALOG_VERSION_KEY = "catalog_version"
+
+
+def catalog_version() -> int:
+    """Return the current catalog version. It changes whenever a teacher or course changes."""
+
+    cache = caches[settings.SEARCH_CACHE_ALIAS]
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, 1, timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY, 1)
+    return version
+
+
+async def acatalog_version() -> int:
+    """Asynchronous catalog_version."""
+
+    cache = caches[settings.SEARCH_CACHE_ALIAS]
+    version = await cache.aget(CATALOG_VERSION_KEY)
+    if version is None:
+        await cache.aadd(CATALOG_VERSION_KEY, 1, timeout=None)
+        version = await cache.aget(CATALOG_VERSION_KEY, 1)
+    return version
+
+
+def bump_catalog_version():
+    """Move to a new catalog version, invalidating every cached search result."""
+
+    cache = caches[settings.SEARCH_CACHE_ALIAS]
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOG_VERSION_KEY, 2, timeout=None)
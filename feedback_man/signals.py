@@ -0,0 +1,48 @@
+"""
+Signal handlers keeping the search index tables and the catalog version in sync with the catalog,
+and the account cache in sync with student accounts.
+Deleting a teacher or course deletes its index rows through the cascading foreign key.
+"""
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import accounts
+from .models import Course, StudentAccount, Teacher
+from .search import bump_catalog_version, index_courses, index_teachers
+
+
+@receiver(post_save, sender=Teacher)
+def index_saved_teacher(sender, instance, raw=False, **kwargs):
+    """Re-index the teacher's name trigrams whenever the teacher is saved."""
+
+    if not raw:
+        index_teachers([instance])
+
+
+@receiver(post_save, sender=Course)
+def index_saved_course(sender, instance, raw=False, **kwargs):
+    """Re-index the course's search tokens whenever the course is saved."""
+
+    if not raw:
+        index_courses([instance])
+
+
+@receiver(post_save, sender=Teacher)
+@receiver(post_delete, sender=Teacher)
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+@receiver(m2m_changed, sender=Course.teachers.through)
+def invalidate_search_results(sender, raw=False, action=None, **kwargs):
+    """Bump the catalog version so cached search results are no longer served."""
+
+    if not raw and action in (None, "post_add", "post_remove", "post_clear"):
+        bump_catalog_version()
+
+
+@receiver(post_save, sender=StudentAccount)
+@receiver(post_delete, sender=StudentAccount)
+def invalidate_cached_account(sender, instance, raw=False, **kwargs):
+    """Drop the student's cached account so authentication sees the change."""
+
+    if not raw:
+        accounts.invalidate(instance.pk)
@@ -0,0 +1,146 @@
+"""
+Generator of synthetic catalogs for benchmarks.
+
+Teachers, courses, students and a backlog of messages are bulk inserted with realistic shapes:
+course teams of one to three teachers where a few teachers teach many courses, several offerings
+of each course across semesters, and messages concentrated on popular teachers, with the
+moderation scores of the moderated ones. Generation is seeded, so the same arguments always produce the same catalog.
+"""
+import itertools
+import random
+import string
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Course, Message, MessageScores, StudentAccount, Teacher
+from .search import bump_catalog_version, rebuild_course_index, rebuild_teacher_index
+
+FIRST_NAMES = ["Ben", "Amal", "Olin", "Jan", "Leena", "Karl", "Mira", "Felix", "Rosa", "Tariq",
+               "Nadia", "Hugo", "Ines", "Omar", "Priya", "Quinn", "Sven", "Tomas", "Uma", "Vera"]
+LAST_NAMES = ["Lerner", "Ahmed", "Shivers", "Vitek", "Razzaq", "Lieberherr", "Chen", "Nguyen",
+              "Garcia", "Okafor", "Kowalski", "Haddad", "Ivanova", "Jensen", "Moreau", "Rossi",
+              "Sato", "Tanaka", "Weber", "Zhang"]
+COLLEGES = ["Khoury", "COE", "COS", "CSSH", "DMSB", "Bouve", "CAMD"]
+SUBJECTS = ["CS", "DS", "CY", "MATH", "PHYS", "CHEM", "BIOL", "ECON", "PSYC", "ENGW", "EECE", "ARTG"]
+COURSE_WORDS = ["Fundamentals", "of", "Computer", "Science", "Data", "Algorithms", "Systems", "Theory",
+                "Programming", "Design", "Introduction", "to", "Advanced", "Networks", "Security",
+                "Statistics", "Calculus", "Probability", "Machine", "Learning", "Logic", "Writing"]
+SEMESTERS = [choice for choice, _ in Course.Semester.choices]
+MESSAGE_WORDS = ["the", "lectures", "were", "really", "helpful", "but", "homework", "felt", "too",
+                 "long", "please", "post", "slides", "earlier", "office", "hours", "great", "class"]
+
+
+def teacher_names(rng=random):
+    """Yield an endless sequence of distinct, realistic looking teacher names."""
+
+    for n in itertools.count():
+        for first, last in itertools.product(FIRST_NAMES, LAST_NAMES):
+            suffix = "".join(rng.choice(string.ascii_lowercase) for _ in range(4))
+            yield f"{first} {last}{suffix.capitalize()}{n}"
+
+
+def bulk_create_ids(model, objs: list, batch_size: int) -> list:
+    """Bulk insert the rows of an auto-increment model and return their primary keys."""
+
+    #MySQL does not return the primary keys of bulk inserted rows
+    last = model.objects.order_by("-pk").values_list("pk", flat=True).first() or 0
+    model.objects.bulk_create(objs, batch_size=batch_size)
+    return list(model.objects.filter(pk__gt=last).order_by("pk").values_list("pk", flat=True))
+
+
+@dataclass
+class SyntheticCatalog:
+    """The primary keys of the generated rows, for building requests against them."""
+
+    teachers: list = field(default_factory=list)
+    courses: list = field(default_factory=list)
+    students: list = field(default_factory=list)
+    messages: list = field(default_factory=list)
+
+
+def generate(teachers: int, courses: int, students: int = 0, messages: int = 0, seed: int = 0,
+             password: str = "synthetic", batch_size: int = 5000) -> SyntheticCatalog:
+    """
+    Insert the given numbers of teachers, courses, students and messages, rebuild the search indexes
+    and return the primary keys of the new rows. Every student has the given password.
+    """
+
+    rng = random.Random(seed)
+    catalog = SyntheticCatalog()
+    with transaction.atomic():
+        names = teacher_names(rng)
+        Teacher.objects.bulk_create([
+            Teacher(teacher_name=name, college=rng.choice(COLLEGES), email=f"teacher{i}@northeastern.edu")
+            for i, name in enumerate(itertools.islice(names, teachers))
+        ], batch_size=batch_size)
+        catalog.teachers = [f"teacher{i}@northeastern.edu" for i in range(teachers)]
+        #Zipf-like popularity: a few teachers teach (and receive messages about) many courses
+        cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(teachers)))
+
+        offerings = []
+        for number in itertools.count():
+            subject = SUBJECTS[number % len(SUBJECTS)]
+            course_num = 1000 + number // len(SUBJECTS)
+            class_name = " ".join(rng.sample(COURSE_WORDS, rng.randint(2, 5))).capitalize()
+            for year, semester in itertools.islice(
+                itertools.product(range(2023, 2015, -1), SEMESTERS), rng.randint(1, 6)
+            ):
+                offerings.append(Course(class_name=class_name, subject=subject, course_num=course_num,
+                                        semester=semester, year=year))
+            if len(offerings) >= courses:
+                break
+        catalog.courses = bulk_create_ids(Course, offerings[:courses], batch_size)
+
+        if teachers:
+            Link = Course.teachers.through
+            team_sizes = [1, 1, 1, 2, 2, 3]
+            Link.objects.bulk_create([
+                Link(course_id=course_id, teacher_id=teacher)
+                for course_id in catalog.courses
+                for teacher in set(rng.choices(catalog.teachers, cum_weights=cum_weights, k=rng.choice(team_sizes)))
+            ], batch_size=batch_size)
+
+        hashed = make_password(password)
+        catalog.students = [f"{rng.choice(FIRST_NAMES).lower()}.{rng.choice(LAST_NAMES).lower()}{i}@northeastern.edu"
+                            for i in range(students)]
+        StudentAccount.objects.bulk_create([
+            StudentAccount(student_email=email, password=hashed) for email in catalog.students
+        ], batch_size=batch_size)
+
+        if students and teachers:
+            #Sent over the past year
+            now = timezone.now()
+            rows = [
+                Message(
+                    student_id=rng.choice(catalog.students),
+                    teacher_id=rng.choices(catalog.teachers, cum_weights=cum_weights)[0],
+                    message_body=" ".join(rng.choices(MESSAGE_WORDS, k=rng.randint(5, 40))),
+                    status=rng.choices([Message.Status.SENT, Message.Status.PENDING, Message.Status.REJECTED],
+                                       [90, 5, 5])[0],
+                    created_at=now - timedelta(seconds=rng.randrange(365 * 24 * 3600)),
+                ) for _ in range(messages)
+            ]
+            for message in rows:
+                message.is_malicious = message.status == Message.Status.REJECTED
+            catalog.messages = bulk_create_ids(Message, rows, batch_size)
+
+            #Scores in ten-thousandths skewed towards 0, with one attribute above 0.7 if rejected
+            scores = []
+            for message_id, message in zip(catalog.messages, rows):
+                if message.status == Message.Status.PENDING:
+                    continue
+                values = [round(rng.random() ** 4 * 7000) for _ in range(3)]
+                if message.is_malicious:
+                    values[rng.randrange(3)] = rng.randint(7001, 10000)
+                scores.append(MessageScores(message_id=message_id, toxicity=values[0],
+                                            identity_attack=values[1], insult=values[2]))
+            MessageScores.objects.bulk_create(scores, batch_size=batch_size)
+
+    rebuild_teacher_index()
+    rebuild_course_index()
+    bump_catalog_version()
+    return catalog
@@ -1,3 +1,1638 @@
-from django.test import TestCase
+import importlib
+import json
+import pstats
+import smtplib
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import httplib2
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.conf import settings
+from django.core import mail
+from django.core.cache import caches
+from django.core.mail.backends import locmem
+from django.db import connection, connections, transaction
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from googleapiclient.errors import HttpError
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from nameless_api import cache as search_cache, pagination, profiling, throttling
+from nameless_api.fast_serializers import render_json
+from nameless_api.serializers import CourseSerializer, TeacherSerializer
+from nameless_api.views import COURSE_TEACHERS, FAST_COURSE, FAST_TEACHER
+
+from . import (accounts, archive, catalog, dedup, metrics, moderation, outbox, pipeline, prescreen, routers, scoring,
+               search, synthetic, verdicts)
+from .fake_perspective import FakePerspectiveServer
+from .managers import trigrams
+from .models import (REPEATED_RESULT, Course, CourseSearchToken, Message, MessageJob, ModerationVerdict, OutboxEmail,
+                     StudentAccount, Teacher, TeacherTrigram)
+
+
+@override_settings(MAX_INFRACTIONS=3)
+class IncrementInfractionsTests(TestCase):
+    def setUp(self):
+        self.student = StudentAccount.objects.create_user("jane.doe@northeastern.edu", "correct horse")
+
+    def test_returns_new_total(self):
+        self.assertEqual(self.student.increment_infractions(), 1)
+        self.assertEqual(self.student.increment_infractions(), 2)
+        self.student.refresh_from_db()
+        self.assertEqual(self.student.num_infractions, 2)
+        self.assertTrue(self.student.is_active)
+
+    def test_deactivates_at_threshold(self):
+        for _ in range(3):
+            self.student.increment_infractions()
+        self.assertFalse(self.student.is_active)
+        self.student.refresh_from_db()
+        self.assertFalse(self.student.is_active)
+
+    def test_stale_instance_does_not_lose_increments(self):
+        stale = StudentAccount.objects.get(pk=self.student.pk)
+        self.student.increment_infractions()
+        self.assertEqual(stale.increment_infractions(), 2)
+
+
+@override_settings(MAX_INFRACTIONS=1000)
+class ConcurrentInfractionsTests(TransactionTestCase):
+    THREADS = 8
+    INCREMENTS = 25
+
+    def test_no_lost_increments(self):
+        student = StudentAccount.objects.create_user("jane.doe@northeastern.edu", "correct horse")
+        waits = []
+        errors = []
+        start = threading.Barrier(self.THREADS)
+
+        def increment():
+            try:
+                account = StudentAccount.objects.get(pk=student.pk)
+                start.wait()
+                for _ in range(self.INCREMENTS):
+                    began = time.perf_counter()
+                    account.increment_infractions()
+                    waits.append(time.perf_counter() - began)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=increment) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        student.refresh_from_db()
+        self.assertEqual(student.num_infractions, self.THREADS * self.INCREMENTS)
+        #Each increment holds the row lock for one UPDATE and one primary key read
+        self.assertLess(max(waits), 2.0)
+
+
+@override_settings(DATABASE_REPLICAS=["replica"], REPLICA_PIN_SECONDS=60, REPLICA_PIN_CACHE_ALIAS="default")
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        caches["default"].clear()
+
+    def request_by(self, email):
+        request = RequestFactory().get("/")
+        request.user = StudentAccount(student_email=email)
+        return request
+
+    def test_catalog_reads_go_to_replica(self):
+        with routers.routing():
+            self.assertEqual(self.router.db_for_read(Teacher), "replica")
+            self.assertEqual(self.router.db_for_read(Course.teachers.through), "replica")
+
+    def test_other_reads_and_writes_go_to_primary(self):
+        with routers.routing():
+            self.assertIsNone(self.router.db_for_read(Message))
+            self.assertIsNone(self.router.db_for_read(StudentAccount))
+            self.assertEqual(self.router.db_for_write(Teacher), "default")
+
+    def test_reads_pinned_after_write(self):
+        with routers.routing():
+            self.router.db_for_write(Message)
+            self.assertEqual(self.router.db_for_read(Teacher), "default")
+        with routers.routing():
+            self.assertEqual(self.router.db_for_read(Teacher), "replica")
+
+    def test_writing_requests_read_primary(self):
+        with routers.routing(RequestFactory().post("/message")):
+            self.assertEqual(self.router.db_for_read(Teacher), "default")
+
+    @override_settings(REPLICA_PIN_SECONDS=0)
+    def test_pin_expires(self):
+        with routers.routing():
+            self.router.db_for_write(Message)
+            self.assertEqual(self.router.db_for_read(Teacher), "replica")
+
+    def test_user_pinned_after_writing_request(self):
+        with routers.routing(self.request_by("jane.doe@northeastern.edu")) as state:
+            self.router.db_for_write(Message)
+        routers.remember_writes(state)
+
+        with routers.routing(self.request_by("jane.doe@northeastern.edu")):
+            self.assertEqual(self.router.db_for_read(Course), "default")
+        with routers.routing(self.request_by("john.roe@northeastern.edu")):
+            self.assertEqual(self.router.db_for_read(Course), "replica")
+
+
+
+@override_settings(DATABASE_REPLICAS=["mirror"], REPLICA_PIN_SECONDS=60, REPLICA_PIN_CACHE_ALIAS="default")
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    Routing of real queries to a "mirror" alias connected to the test database, like a replica
+    with no lag, so it runs without a replica configured. Queries are told apart by connection.
+    """
+
+    def setUp(self):
+        caches["default"].clear()
+        #A second connection to the test database, made directly since it is not in DATABASES
+        primary = connections["default"]
+        connections["mirror"] = type(primary)(dict(primary.settings_dict), "mirror")
+        self.addCleanup(connections.__delitem__, "mirror")
+        self.addCleanup(connections["mirror"].close)
+        self.teacher = Teacher.objects.create(email="jan.vitek@northeastern.edu", teacher_name="Jan Vitek",
+                                              college="Khoury")
+        self.jane = StudentAccount.objects.create_user("jane.doe@northeastern.edu", "correct horse")
+        self.john = StudentAccount.objects.create_user("john.roe@northeastern.edu", "correct horse")
+
+    def queries(self, function):
+        """Call function and return how many queries each of the primary and the mirror ran."""
+
+        with CaptureQueriesContext(connections["default"]) as primary, \
+                CaptureQueriesContext(connections["mirror"]) as mirror:
+            function()
+        return len(primary), len(mirror)
+
+    def test_catalog_reads_go_to_the_mirror(self):
+        with routers.routing():
+            self.assertEqual(self.queries(lambda: list(Teacher.objects.all())), (0, 1))
+            self.assertEqual(self.queries(lambda: StudentAccount.objects.exists()), (1, 0))
+            with transaction.atomic():
+                self.assertEqual(self.queries(lambda: list(Teacher.objects.all())), (1, 0))
+
+    def test_requests_read_their_writes(self):
+        jane, john = APIClient(), APIClient()
+        jane.force_authenticate(self.jane)
+        john.force_authenticate(self.john)
+        _, mirror = self.queries(lambda: self.assertEqual(jane.get(f"/teacher/{self.teacher.pk}").status_code, 200))
+        self.assertGreater(mirror, 0)
+
+        response = jane.post("/message", {"teacher": self.teacher.pk, "message_body": "hello"}, format="json")
+        self.assertEqual(response.status_code, 202)
+        #The student who wrote reads the primary, other students the mirror
+        _, mirror = self.queries(lambda: self.assertEqual(jane.get(f"/teacher/{self.teacher.pk}").status_code, 200))
+        self.assertEqual(mirror, 0)
+        _, mirror = self.queries(lambda: self.assertEqual(john.get(f"/teacher/{self.teacher.pk}").status_code, 200))
+        self.assertGreater(mirror, 0)
+
+
+#A replica with a test database of its own, e.g. a second SQLite file
+REPLICA_CONFIGURED = "replica" in settings.DATABASES and not settings.DATABASES["replica"].get("TEST", {}).get("MIRROR")
+
+
+@skipUnless(REPLICA_CONFIGURED, 'needs a "replica" alias in DATABASES with its own test database')
+@override_settings(DATABASE_REPLICAS=["replica"], REPLICA_PIN_SECONDS=60, REPLICA_PIN_CACHE_ALIAS="default")
+class ReplicaDatabaseTests(TransactionTestCase):
+    """
+    Routing against two real databases holding different rows, so each result shows which one served it.
+    A TransactionTestCase, since the router pins reads to the primary inside transactions.
+    """
+
+    #Only named when configured, since the test runner checks every database its tests name
+    databases = {"default", "replica"} if REPLICA_CONFIGURED else {"default"}
+
+    def setUp(self):
+        caches["default"].clear()
+        Teacher.objects.create(email="jan.vitek@northeastern.edu", teacher_name="Jan Vitek", college="Khoury")
+        #bulk_create sends no signals, which would index the teacher on the primary
+        Teacher.objects.using("replica").bulk_create([
+            Teacher(email="ben.lerner@northeastern.edu", teacher_name="Ben Lerner", college="Khoury"),
+        ])
+
+    def test_catalog_reads_served_by_replica(self):
+        with routers.routing(), CaptureQueriesContext(connections["replica"]) as replica:
+            self.assertEqual(list(Teacher.objects.values_list("pk", flat=True)), ["ben.lerner@northeastern.edu"])
+            self.assertFalse(StudentAccount.objects.exists())
+        self.assertEqual(len(replica), 1)
+
+    def test_reads_after_write_served_by_primary(self):
+        with routers.routing(), CaptureQueriesContext(connections["replica"]) as replica:
+            StudentAccount.objects.create_user("jane.doe@northeastern.edu", "correct horse")
+            self.assertEqual(list(Teacher.objects.values_list("pk", flat=True)), ["jan.vitek@northeastern.edu"])
+        self.assertEqual(len(replica), 0)
+
+    def test_requests_routed(self):
+        client = APIClient()
+        self.assertEqual(client.get("/teacher/ben.lerner@northeastern.edu").status_code, 200)
+        self.assertEqual(client.get("/teacher/jan.vitek@northeastern.edu").status_code, 404)
+
+        #After a write by the same student, their requests read the primary
+        jane = StudentAccount.objects.create_user("jane.doe@northeastern.edu", "correct horse")
+        client.force_authenticate(jane)
+        client.post("/message", {"teacher": "jan.vitek@northeastern.edu", "message_body": "hello"}, format="json")
+        self.assertEqual(client.get("/teacher/jan.vitek@northeastern.edu").status_code, 200)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.breaker = moderation.CircuitBreaker(3, 10, clock=lambda: self.now)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.failure()
+        self.breaker.failure()
+        self.breaker.success()
+        self.breaker.failure()
+        self.breaker.failure()
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.failure())
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.retry_after(), 10)
+
+    def test_one_trial_call_after_reset_timeout(self):
+        for _ in range(3):
+            self.breaker.failure()
+        self.now = 10
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.breaker.success()
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_trial_reopens(self):
+        for _ in range(3):
+            self.breaker.failure()
+        self.now = 10
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.failure())
+        self.now = 15
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.retry_after(), 5)
+
+
+class FakeBatch:
+    """A googleapiclient batch request which refuses the comment "bonjour" and scores the others 0.1."""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self, http=None):
+        for request_id, text in self.requests:
+            if text == "bonjour":
+                self.callback(request_id, None, HttpError(httplib2.Response({"status": 400}), b"unsupported language"))
+            else:
+                self.callback(request_id, {"attributeScores": {"TOXICITY": {"summaryScore": {"value": 0.1}}}}, None)
+
+
+class PerspectiveBatchTests(SimpleTestCase):
+    def setUp(self):
+        self.client = moderation.PerspectiveClient("key", "http://perspective.invalid", max_batch=3, workers=1)
+        self.client._service = mock.Mock(new_batch_http_request=FakeBatch)
+        patcher = mock.patch.object(self.client, "_analyze_request", lambda text: text)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_errors_stay_in_their_slot(self):
+        results = self.client.analyze_many(["hello", "bonjour", "great class"])
+        self.assertEqual(results[0], {"TOXICITY": 0.1})
+        self.assertIsInstance(results[1], HttpError)
+        self.assertEqual(results[2], {"TOXICITY": 0.1})
+
+    def test_one_refused_comment_fails_only_its_future(self):
+        futures = [Future() for _ in range(3)]
+        #Queued before the dispatcher starts, so they go in one batch
+        for text, future in zip(["hello", "bonjour", "great class"], futures):
+            self.client._queue.put((text, future))
+        self.client._start_dispatchers()
+        self.assertEqual(futures[0].result(timeout=5), {"TOXICITY": 0.1})
+        with self.assertRaises(HttpError):
+            futures[1].result(timeout=5)
+        self.assertEqual(futures[2].result(timeout=5), {"TOXICITY": 0.1})
+
+
+class ModerationGatewayTests(SimpleTestCase):
+    def setUp(self):
+        self.server = FakePerspectiveServer().__enter__()
+        self.addCleanup(self.server.__exit__)
+        settings = override_settings(
+            PERSPECTIVE_DISCOVERY_URL=self.server.discovery_url,
+            PERSPECTIVE_DEADLINE=2,
+            PERSPECTIVE_RETRIES=2,
+            PERSPECTIVE_RETRY_BASE_DELAY=0.01,
+            PERSPECTIVE_BREAKER_FAILURES=5,
+            PERSPECTIVE_BREAKER_RESET=60,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.reset()
+        self.addCleanup(self.reset)
+
+    def reset(self):
+        moderation._client = None
+        moderation._breaker = None
+        caches[settings.MODERATION_BREAKER_CACHE_ALIAS].delete(moderation.SHARED_BREAKER_KEY)
+
+    def test_scores(self):
+        self.assertEqual(moderation.analyze("you idiot")["TOXICITY"], 0.9)
+
+    def test_retries_then_opens_breaker(self):
+        self.server.error_rate = 1.0
+        with self.assertRaises(moderation.ModerationUnavailable):
+            moderation.analyze("hello")
+        self.assertEqual(self.server.counts["errors"], 3)
+        with self.assertRaises(moderation.ModerationUnavailable):
+            moderation.analyze("hello")
+        self.assertEqual(moderation.get_breaker().state, moderation.CircuitBreaker.OPEN)
+
+        #Fails fast without calling Perspective
+        with self.assertRaises(moderation.ModerationUnavailable) as raised:
+            moderation.analyze("hello")
+        self.assertEqual(self.server.counts["errors"], 5)
+        self.assertGreater(raised.exception.retry_after, 0)
+
+    @override_settings(MODERATION_DEGRADED_MODE="reject", PERSPECTIVE_BREAKER_FAILURES=1, PERSPECTIVE_BREAKER_RESET=0.5)
+    def test_open_breaker_is_shared_between_processes(self):
+        self.server.error_rate = 1.0
+        with self.assertRaises(moderation.ModerationUnavailable):
+            moderation.analyze("hello")
+
+        #A process which never called Perspective, with a breaker of its own, rejects messages too
+        opened, moderation._breaker = moderation._breaker, None
+        with self.assertRaises(throttling.ServiceUnavailable):
+            throttling.check_moderation()
+
+        #The successful trial call of the process whose breaker opened closes it for everyone
+        moderation._breaker = opened
+        time.sleep(0.5)
+        self.server.error_rate = 0.0
+        moderation.analyze("hello")
+        moderation._breaker = None
+        self.assertEqual(moderation.shared_retry_after(), 0)
+        throttling.check_moderation()
+
+    def test_deadline_bounds_slow_calls(self):
+        self.server.latency = 5
+        began = time.perf_counter()
+        with override_settings(PERSPECTIVE_DEADLINE=0.3), self.assertRaises(moderation.ModerationUnavailable):
+            moderation.analyze("hello")
+        self.assertLess(time.perf_counter() - began, 1)
+
+    def test_refused_requests_are_not_retried(self):
+        self.server.error_rate = 1.0
+        self.server.error_status = 400
+        with self.assertRaises(HttpError):
+            moderation.analyze("hello")
+        self.assertEqual(self.server.counts["errors"], 1)
+        self.assertEqual(moderation.get_breaker().state, moderation.CircuitBreaker.CLOSED)
+
+
+class HeldMessageTests(TestCase):
+    def test_unavailable_moderation_holds_message(self):
+        teacher = Teacher.objects.create(email="jan.vitek@northeastern.edu", teacher_name="Jan Vitek",
+                                         college="Khoury")
+        student = StudentAccount.objects.create_user("jane.doe@northeastern.edu", "correct horse")
+        message = Message.objects.create(student=student, teacher=teacher, message_body="hello")
+        job = pipeline.enqueue_message(message)
+
+        with mock.patch.object(moderation, "analyze", side_effect=moderation.ModerationUnavailable(30)):
+            pipeline.process_job(job)
+
+        message.refresh_from_db()
+        job.refresh_from_db()
+        self.assertEqual(message.status, Message.Status.HELD)
+        self.assertEqual(job.attempts, 0)
+        self.assertGreater(job.available_at, timezone.now())
+
+        with mock.patch.object(moderation, "analyze", return_value={"TOXICITY": 0.1}):
+            pipeline.process_job(job)
+        message.refresh_from_db()
+        self.assertEqual(message.status, Message.Status.PENDING)
+        self.assertTrue(message.outbox_email)
+        self.assertFalse(MessageJob.objects.filter(pk=job.pk).exists())
+
+
+class FailedJobTests(TestCase):
+    def setUp(self):
+        teacher = Teacher.objects.create(email="jan.vitek@northeastern.edu", teacher_name="Jan Vitek",
+                                         college="Khoury")
+        student = StudentAccount.objects.create_user("jane.doe@northeastern.edu", "correct horse")
+        self.message = Message.objects.create(student=student, teacher=teacher, message_body="bonjour la classe")
+        self.job = pipeline.enqueue_message(self.message)
+        self.addCleanup(setattr, dedup, "_index", None)
+
+    def test_refused_text_fails_at_once(self):
+        refused = HttpError(httplib2.Response({"status": 400}), b"unsupported language")
+        with mock.patch.object(moderation, "analyze", side_effect=refused) as analyze:
+            pipeline.process_job(self.job)
+        self.assertEqual(analyze.call_count, 1)
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, Message.Status.FAILED)
+        self.assertFalse(MessageJob.objects.filter(pk=self.job.pk).exists())
+
+    @override_settings(PIPELINE_MAX_ATTEMPTS=3)
+    def test_gives_up_after_max_attempts(self):
+        with mock.patch.object(moderation, "analyze", side_effect=ConnectionResetError):
+            for attempts in range(1, 3):
+                pipeline.process_job(self.job)
+                self.job.refresh_from_db()
+                self.assertEqual(self.job.attempts, attempts)
+            pipeline.process_job(self.job)
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, Message.Status.FAILED)
+        self.assertFalse(MessageJob.objects.filter(pk=self.job.pk).exists())
+
+
+class MessageStatusTests(TestCase):
+    def setUp(self):
+        teacher = Teacher.objects.create(email="jan.vitek@northeastern.edu", teacher_name="Jan Vitek",
+                                         college="Khoury")
+        self.jane = StudentAccount.objects.create_user("jane.doe@northeastern.edu", "correct horse")
+        self.john = StudentAccount.objects.create_user("john.roe@northeastern.edu", "correct horse")
+        self.message = Message.objects.create(student=self.jane, teacher=teacher, message_body="hello",
+                                              status=Message.Status.REJECTED)
+        self.client = APIClient()
+
+    def test_requires_authentication(self):
+        self.assertEqual(self.client.get(f"/message/{self.message.pk}").status_code, 401)
+
+    def test_only_senders_see_their_messages(self):
+        self.client.force_authenticate(self.john)
+        self.assertEqual(self.client.get(f"/message/{self.message.pk}").status_code, 404)
+
+        self.client.force_authenticate(self.jane)
+        response = self.client.get(f"/message/{self.message.pk}")
+        self.assertEqual(response.json(), {"id": self.message.pk, "status": "Rejected"})
+
+
+class TeacherEndpointTests(TestCase):
+    def setUp(self):
+        self.teacher = Teacher.objects.create(email="jan.vitek@northeastern.edu", teacher_name="Jan Vitek",
+                                              college="Khoury")
+        self.client = APIClient()
+
+    def test_teacher_by_email(self):
+        for prefix in ("", "/async"):
+            response = self.client.get(f"{prefix}/teacher/jan.vitek@northeastern.edu")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["teacher_name"], "Jan Vitek")
+            self.assertEqual(self.client.get(f"{prefix}/teacher/jan.vitek").status_code, 404)
+            self.assertEqual(self.client.get(f"{prefix}/teacher/ben.lerner@northeastern.edu").status_code, 404)
+
+    def test_inbox_by_email(self):
+        admin = StudentAccount.objects.create_user("admin@northeastern.edu", "correct horse")
+        admin.is_staff = True
+        admin.save()
+        Message.objects.create(student=admin, teacher=self.teacher, message_body="great class",
+                               status=Message.Status.SENT)
+        self.client.force_authenticate(admin)
+        response = self.client.get("/teacher/jan.vitek@northeastern.edu/inbox")
+        self.assertEqual([message["message_body"] for message in response.json()["results"]], ["great class"])
+
+
+class FlakyBackend(locmem.EmailBackend):
+    """locmem backend refusing some recipients for good and dropping the connection for others."""
+
+    refused = {"refused@northeastern.edu"}
+    greylisted = set()
+    disconnected = set()
+
+    def send_messages(self, messages):
+        for message in messages:
+            if self.refused & set(message.to):
+                raise smtplib.SMTPRecipientsRefused({message.to[0]: (550, b"No such user")})
+            if self.greylisted & set(message.to):
+                raise smtplib.SMTPRecipientsRefused({message.to[0]: (450, b"Greylisted, try again later")})
+            if self.disconnected & set(message.to):
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        return super().send_messages(messages)
+
+
+@override_settings(OUTBOX_DIGEST_INTERVAL=None, OUTBOX_MAX_ATTEMPTS=3)
+class OutboxTests(TestCase):
+    def setUp(self):
+        student = StudentAccount.objects.create_user("jane.doe@northeastern.edu", "correct horse")
+        self.rows = []
+        for i, email in enumerate(["refused@northeastern.edu", "down@northeastern.edu",
+                                   "jan.vitek@northeastern.edu", "ben.lerner@northeastern.edu"]):
+            teacher = Teacher.objects.create(email=email, teacher_name=f"Teacher {i}", college="Khoury")
+            message = Message.objects.create(student=student, teacher=teacher, message_body=f"hello {i}")
+            #Oldest first
+            self.rows.append(OutboxEmail.objects.create(message=message, recipient=email, body=message.message_body,
+                                                        next_attempt_at=timezone.now() - timedelta(minutes=4 - i)))
+        FlakyBackend.disconnected = {"down@northeastern.edu"}
+        FlakyBackend.greylisted = set()
+
+    def test_delivers_over_locmem(self):
+        OutboxEmail.objects.filter(pk__in=[row.pk for row in self.rows[:2]]).delete()
+        self.assertEqual(outbox.drain(10), 2)
+        self.assertEqual(sorted(email.to[0] for email in mail.outbox),
+                         ["ben.lerner@northeastern.edu", "jan.vitek@northeastern.edu"])
+        self.assertEqual(Message.objects.filter(status=Message.Status.SENT).count(), 2)
+        self.assertEqual(outbox.drain(10), 0)
+
+    def test_failures_do_not_block_later_mail(self):
+        #The two oldest fail; the next drain moves on to the others
+        with self.assertLogs("feedback_man.outbox", "ERROR"):
+            self.assertEqual(outbox.drain(2, connection=FlakyBackend()), 0)
+        self.assertEqual(outbox.drain(2, connection=FlakyBackend()), 2)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_refused_recipients_are_given_up_on(self):
+        with self.assertLogs("feedback_man.outbox", "ERROR") as logs:
+            outbox.drain(1, connection=FlakyBackend())
+        self.assertIn("Giving up", logs.output[-1])
+        refused = OutboxEmail.objects.get(pk=self.rows[0].pk)
+        self.assertEqual(refused.attempts, 3)
+        self.assertIsNone(refused.sent_at)
+        self.assertNotIn(refused, outbox.due_emails(timezone.now() + timedelta(days=1)))
+        self.assertEqual(refused.message.status, Message.Status.FAILED)
+
+    def test_greylisted_recipients_are_retried(self):
+        FlakyBackend.greylisted = {"jan.vitek@northeastern.edu"}
+        OutboxEmail.objects.exclude(pk=self.rows[2].pk).delete()
+        with self.assertLogs("feedback_man.outbox", "ERROR") as logs:
+            outbox.drain(1, connection=FlakyBackend())
+        self.assertNotIn("Giving up", "".join(logs.output))
+        row = OutboxEmail.objects.get(pk=self.rows[2].pk)
+        self.assertEqual(row.attempts, 1)
+        self.assertEqual(row.message.status, Message.Status.PENDING)
+
+    def test_permanent_only_if_every_recipient_is_refused_for_good(self):
+        refused = smtplib.SMTPRecipientsRefused
+        self.assertTrue(outbox.permanent(refused({"a@b.edu": (550, b"No such user"), "c@d.edu": (553, b"")})))
+        self.assertFalse(outbox.permanent(refused({"a@b.edu": (550, b"No such user"), "c@d.edu": (451, b"")})))
+        self.assertTrue(outbox.permanent(smtplib.SMTPDataError(554, b"Rejected")))
+        self.assertFalse(outbox.permanent(smtplib.SMTPServerDisconnected("Connection unexpectedly closed")))
+
+    def test_failing_to_connect_counts_an_attempt(self):
+        unreachable = FlakyBackend()
+        unreachable.open = mock.Mock(side_effect=ConnectionRefusedError)
+        with self.assertLogs("feedback_man.outbox", "ERROR"):
+            self.assertEqual(outbox.drain(2, connection=unreachable), 0)
+        self.assertEqual([row.attempts for row in OutboxEmail.objects.filter(pk__in=[self.rows[0].pk, self.rows[1].pk])],
+                         [1, 1])
+
+    def test_transient_failures_back_off_then_give_up(self):
+        OutboxEmail.objects.exclude(pk=self.rows[1].pk).delete()
+        for attempt in range(1, 4):
+            later = timezone.now() + timedelta(days=attempt)
+            with mock.patch.object(timezone, "now", return_value=later), self.assertLogs("feedback_man.outbox", "ERROR"):
+                outbox.drain(1, connection=FlakyBackend())
+            row = OutboxEmail.objects.get(pk=self.rows[1].pk)
+            self.assertEqual(row.attempts, attempt)
+            if attempt < 3:
+                self.assertGreater(row.next_attempt_at, later)
+        self.assertNotIn(row, outbox.due_emails(timezone.now() + timedelta(days=30)))
+
+    def test_claimed_rows_are_not_claimed_again(self):
+        claimed = outbox.claim(2)
+        self.assertEqual([row.pk for row in claimed], [row.pk for row in self.rows[:2]])
+        self.assertEqual([row.pk for row in outbox.claim(10)], [row.pk for row in self.rows[2:]])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        student = StudentAccount.objects.create_user("jane.doe@northeastern.edu", "correct horse")
+        teacher = Teacher.objects.create(email="jan.vitek@northeastern.edu", teacher_name="Jan Vitek",
+                                         college="Khoury")
+        start = timezone.now()
+        #Runs of equal timestamps, a microsecond apart, so pages must break ties by id
+        self.messages = [
+            Message.objects.create(student=student, teacher=teacher, message_body=f"message {i}",
+                                   created_at=start + timedelta(microseconds=i // 3))
+            for i in range(20)
+        ]
+        for i, message in enumerate(self.messages[:12]):
+            OutboxEmail.objects.create(message=message, recipient=teacher.email, body=message.message_body,
+                                       sent_at=None if i % 4 == 0 else start + timedelta(seconds=i // 2))
+
+    def walk(self, queryset, ordering: list, limit: int) -> list:
+        rows = []
+        cursor = None
+        while True:
+            page, cursor = pagination.paginate(queryset, ordering, cursor, limit)
+            rows += page
+            if cursor is None:
+                return rows
+
+    def test_pages_cover_every_row_once_in_order(self):
+        ordering = ["-created_at", "-id"]
+        for limit in (1, 3, 7, 20, 50):
+            rows = self.walk(Message.objects.all(), ordering, limit)
+            self.assertEqual(rows, list(pagination.order(Message.objects.all(), ordering)))
+            self.assertEqual(len(rows), 20)
+
+    def test_nullable_ordering_fields(self):
+        for ordering in (["-sent_at", "id"], ["sent_at", "-id"]):
+            expected = list(pagination.order(OutboxEmail.objects.all(), ordering))
+            self.assertEqual(self.walk(OutboxEmail.objects.all(), ordering, 2), expected)
+            #NULLs first ascending, last descending
+            self.assertEqual(expected[0 if ordering[0] == "sent_at" else -1].sent_at, None)
+
+    def test_cursor_keeps_microseconds(self):
+        page, cursor = pagination.paginate(Message.objects.all(), ["-created_at", "-id"], None, 1)
+        created_at, _ = pagination.decode_cursor(cursor, 2)
+        self.assertEqual(created_at, page[0].created_at.isoformat())
+
+    def test_search_pages_match_stream(self):
+        synthetic.generate(10, 60)
+        client = APIClient()
+        streamed = [json.loads(line) for line in b"".join(client.get("/search/course/CS?stream=1").streaming_content).splitlines()]
+        paged = []
+        cursor = ""
+        while cursor is not None:
+            body = client.get(f"/search/course/CS?limit=4&cursor={cursor}").json()
+            paged += body["results"]
+            cursor = body["next"]
+        self.assertGreater(len(streamed), 4)
+        self.assertEqual(paged, streamed)
+
+    def test_invalid_cursor(self):
+        for cursor in ("not a cursor!", pagination.encode_cursor([1]), pagination.encode_cursor({"a": 1}),
+                       pagination.encode_cursor(["garbage", 1]), pagination.encode_cursor([None, 1]),
+                       pagination.encode_cursor([timezone.now(), "notanint"]),
+                       pagination.encode_cursor([timezone.now(), [1]])):
+            with self.assertRaises(ValidationError):
+                pagination.paginate(Message.objects.all(), ["-created_at", "-id"], cursor, 5)
+
+    def test_invalid_cursor_is_a_bad_request(self):
+        Teacher.objects.create(email="ben.lerner@northeastern.edu", teacher_name="Ben Lerner", college="Khoury")
+        admin = StudentAccount.objects.create_superuser("admin@northeastern.edu", "correct horse")
+        client = APIClient()
+        client.force_authenticate(admin)
+        for values in ([{"a": 1}, "x"], ["notanint", "x"]):
+            cursor = pagination.encode_cursor(values)
+            self.assertEqual(client.get("/search/teacher/jan", {"cursor": cursor}).status_code, 400)
+            self.assertEqual(client.get("/async/search/teacher/jan", {"cursor": cursor}).status_code, 400)
+        cursor = pagination.encode_cursor(["garbage", 1])
+        self.assertEqual(client.get("/teacher/jan.vitek@northeastern.edu/inbox", {"cursor": cursor}).status_code, 400)
+        self.assertEqual(client.get("/message/history", {"cursor": cursor}).status_code, 400)
+
+
+class FastSerializerTests(TestCase):
+    def setUp(self):
+        teachers = [
+            Teacher.objects.create(email="jan.vitek@northeastern.edu", teacher_name="Jan Vitek", college="Khoury"),
+            Teacher.objects.create(email="zoe.o'brien@northeastern.edu", teacher_name='Zoë "Z" O\'Brien \\ 教授 🎓',
+                                   college="Line\u2028and\u2029paragraph\nseparators"),
+            Teacher.objects.create(email="a.ahmed@northeastern.edu", teacher_name="Amal Ahmed", college=""),
+        ]
+        courses = [
+            Course.objects.create(subject="CS", course_num=2500, class_name="Fundies 1", semester="FA", year=2023),
+            Course.objects.create(subject="CS", course_num=None, class_name="Séminaire </script>", semester="S1",
+                                  year=None),
+            Course.objects.create(subject="MATH", course_num=0, class_name="", semester="SP", year=-1),
+        ]
+        courses[0].teachers.set(teachers)
+        courses[1].teachers.set(teachers[1:2])
+
+    def assertSameBytes(self, queryset, serializer_class, fast):
+        expected = JSONRenderer().render(serializer_class(queryset, many=True).data)
+        rows = fast.serialize(list(fast.values(queryset)))
+        self.assertEqual(render_json(rows), expected)
+        self.assertEqual(JSONRenderer().render(rows), expected)
+
+    def test_teachers(self):
+        self.assertSameBytes(Teacher.objects.order_by("pk"), TeacherSerializer, FAST_TEACHER)
+
+    def test_courses(self):
+        self.assertSameBytes(Course.objects.order_by("pk").prefetch_related(COURSE_TEACHERS), CourseSerializer,
+                             FAST_COURSE)
+
+    def test_render_json_without_orjson(self):
+        with mock.patch("nameless_api.fast_serializers.orjson", None):
+            self.assertSameBytes(Teacher.objects.order_by("pk"), TeacherSerializer, FAST_TEACHER)
+
+
+class TeacherSearchTests(TestCase):
+    def setUp(self):
+        for email, name in [("jan.vitek@northeastern.edu", "Jan Vitek"), ("jan.vesely@northeastern.edu", "Jan Vesely"),
+                            ("amal.ahmed@northeastern.edu", "Amal Ahmed")]:
+            Teacher.objects.create(email=email, teacher_name=name, college="Khoury")
+
+    def names(self, query):
+        return [teacher.teacher_name for teacher in Teacher.objects.search_teacher_name(query)]
+
+    def grams(self):
+        return set(TeacherTrigram.objects.values_list("teacher_id", "gram"))
+
+    def test_ranks_by_shared_trigrams(self):
+        self.assertEqual(self.names("jan vitek"), ["Jan Vitek", "Jan Vesely"])
+        #Typos and partially typed words still match
+        self.assertEqual(self.names("jan vitec"), ["Jan Vitek", "Jan Vesely"])
+        self.assertEqual(self.names("vit"), ["Jan Vitek"])
+        self.assertEqual(self.names("AHMED"), ["Amal Ahmed"])
+        self.assertEqual(self.names("zzz"), [])
+        self.assertEqual(self.names("  "), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        teacher = Teacher.objects.get(pk="amal.ahmed@northeastern.edu")
+        teacher.teacher_name = "Amal Vitek"
+        teacher.save()
+        self.assertEqual(self.names("ahmed"), [])
+        self.assertEqual(self.names("vitek"), ["Amal Vitek", "Jan Vitek"])
+        self.assertEqual(set(TeacherTrigram.objects.filter(teacher=teacher).values_list("gram", flat=True)),
+                         trigrams("Amal Vitek"))
+
+        teacher.delete()
+        self.assertFalse(TeacherTrigram.objects.filter(teacher_id="amal.ahmed@northeastern.edu").exists())
+        self.assertEqual(self.names("vitek"), ["Jan Vitek"])
+
+    def test_rebuilds_match_the_index_kept_on_save(self):
+        grams = self.grams()
+        search.rebuild_teacher_index(chunk_size=2)
+        self.assertEqual(self.grams(), grams)
+
+        #The migration backfilling the index of existing teachers
+        TeacherTrigram.objects.all().delete()
+        migration = importlib.import_module("feedback_man.migrations.0008_teachertrigram")
+        migration.index_teacher_names(apps, None, chunk_size=5)
+        self.assertEqual(self.grams(), grams)
+
+
+class CourseSearchTests(TestCase):
+    def setUp(self):
+        caches[settings.SEARCH_CACHE_ALIAS].clear()
+        search_cache.local_cache().clear()
+        self.fundies = Course.objects.create(subject="CS", course_num=2500,
+                                             class_name="Fundamentals of Computer Science 1", semester="FA", year=2023)
+        self.fundies_spring = Course.objects.create(subject="CS", course_num=2500,
+                                                    class_name="Fundamentals of Computer Science 1", semester="SP",
+                                                    year=2024)
+        self.fundies2 = Course.objects.create(subject="CS", course_num=2510,
+                                              class_name="Fundamentals of Computer Science 2", semester="SP", year=2024)
+        self.algorithms = Course.objects.create(subject="CS", course_num=3000, class_name="Algorithms and Data",
+                                                semester="FA", year=2023)
+        self.client = APIClient()
+
+    def ids(self, query):
+        return [course.id for course in Course.objects.search_course_name(query)]
+
+    def test_every_word_is_a_token_prefix(self):
+        self.assertEqual(self.ids("cs 25"), [self.fundies_spring.id, self.fundies.id, self.fundies2.id])
+        self.assertEqual(self.ids("CS2500"), [self.fundies_spring.id, self.fundies.id])
+        self.assertEqual(self.ids("fundam"), [self.fundies_spring.id, self.fundies.id, self.fundies2.id])
+        self.assertEqual(self.ids("Fundies fall 2023"), [self.fundies.id])
+        self.assertEqual(self.ids("fundies2"), [self.fundies2.id])
+        self.assertEqual(self.ids("algorithms spring"), [])
+        self.assertEqual(self.ids("--"), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.algorithms.class_name = "Algorithms and Complexity"
+        self.algorithms.save()
+        self.assertEqual(self.ids("data"), [])
+        self.assertEqual(self.ids("complex"), [self.algorithms.id])
+        self.algorithms.delete()
+        self.assertEqual(self.ids("algo"), [])
+
+        tokens = set(CourseSearchToken.objects.values_list("course_id", "token"))
+        search.rebuild_course_index(chunk_size=2)
+        self.assertEqual(set(CourseSearchToken.objects.values_list("course_id", "token")), tokens)
+        #The migration backfilling the index of existing courses
+        CourseSearchToken.objects.all().delete()
+        migration = importlib.import_module("feedback_man.migrations.0009_coursesearchtoken")
+        migration.index_courses(apps, None, chunk_size=5)
+        self.assertEqual(set(CourseSearchToken.objects.values_list("course_id", "token")), tokens)
+
+    def test_autocomplete_returns_top_k(self):
+        response = self.client.get("/search/course/autocomplete/fund", {"k": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([course["id"] for course in response.json()], [self.fundies_spring.id, self.fundies.id])
+        self.assertEqual(set(response.json()[0]), {"id", "subject", "course_num", "class_name", "semester", "year"})
+
+        #k is capped, and defaults to COURSE_AUTOCOMPLETE_LIMIT
+        with override_settings(COURSE_AUTOCOMPLETE_MAX_LIMIT=1):
+            self.assertEqual(len(self.client.get("/search/course/autocomplete/fund", {"k": 100}).json()), 1)
+        with override_settings(COURSE_AUTOCOMPLETE_LIMIT=3):
+            self.assertEqual(len(self.client.get("/search/course/autocomplete/cs").json()), 3)
+        self.assertEqual(self.client.get("/search/course/autocomplete/fund", {"k": "all"}).status_code, 400)
+
+    def test_async_autocomplete(self):
+        response = Client().get("/async/search/course/autocomplete/fundies2", {"k": 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([course["id"] for course in response.json()], [self.fundies2.id])
+
+
+class SearchCacheTests(TestCase):
+    def setUp(self):
+        caches[settings.SEARCH_CACHE_ALIAS].clear()
+        search_cache.local_cache().clear()
+        self.teacher = Teacher.objects.create(email="jan.vitek@northeastern.edu", teacher_name="Jan Vitek",
+                                              college="Khoury")
+        self.course = Course.objects.create(subject="CS", course_num=4500, class_name="Software Development",
+                                            semester="FA", year=2023)
+        self.client = APIClient()
+
+    def test_catalog_changes_bump_the_version(self):
+        for change in (lambda: Teacher.objects.create(email="ben.lerner@northeastern.edu", teacher_name="Ben Lerner",
+                                                      college="Khoury"),
+                       lambda: self.course.save(),
+                       lambda: self.course.teachers.add(self.teacher),
+                       lambda: self.course.teachers.remove(self.teacher),
+                       lambda: Teacher.objects.get(pk="ben.lerner@northeastern.edu").delete(),
+                       lambda: self.course.delete()):
+            version = search.catalog_version()
+            change()
+            self.assertGreater(search.catalog_version(), version)
+
+    def test_changes_invalidate_cached_results(self):
+        def names():
+            return [teacher["teacher_name"] for teacher in self.client.get("/search/teacher/vitek").json()["results"]]
+
+        def courses(path):
+            response = self.client.get(path).json()
+            if isinstance(response, dict):
+                response = response["results"]
+            return [course["class_name"] for course in response]
+
+        self.assertEqual(names(), ["Jan Vitek"])
+        self.assertEqual(courses("/search/course/cs 4500"), ["Software Development"])
+        self.assertEqual(courses("/search/course/autocomplete/cs 45"), ["Software Development"])
+
+        self.teacher.teacher_name = "Jan Vitek Jr"
+        self.teacher.save()
+        self.course.class_name = "Software Development Lab"
+        self.course.save()
+        self.assertEqual(names(), ["Jan Vitek Jr"])
+        self.assertEqual(courses("/search/course/cs 4500"), ["Software Development Lab"])
+        self.assertEqual(courses("/search/course/autocomplete/cs 45"), ["Software Development Lab"])
+
+        self.teacher.delete()
+        self.assertEqual(names(), [])
+
+    def test_hit_and_miss_counters(self):
+        before = search_cache.stats()
+        for _ in range(2):
+            self.client.get("/search/teacher/vitek")
+        #Another process, with an empty local cache, finds it in the shared one
+        search_cache.local_cache().clear()
+        self.client.get("/search/teacher/vitek")
+        after = search_cache.stats()
+        self.assertEqual({event: after[event] - before[event] for event in ("misses", "local_hits", "shared_hits")},
+                         {"misses": 1, "local_hits": 1, "shared_hits": 1})
+
+
+class CatalogIngestTests(TestCase):
+    records = [
+        {"subject": "cs", "course_num": 2500, "class_name": "Fundamentals of Computer Science 1",
+         "semester": "FA", "year": 2023,
+         "teachers": [{"name": "Ben Lerner", "email": "b.lerner@northeastern.edu", "college": "Khoury"},
+                      {"name": "Amal Ahmed", "email": "a.ahmed@northeastern.edu", "college": "Khoury"}]},
+        {"subject": "CS", "course_num": 3500, "class_name": "Object-Oriented Design",
+         "semester": "SP", "year": 2024,
+         "teachers": [{"name": "Ben Lerner", "email": "b.lerner@northeastern.edu", "college": "Khoury"}]},
+    ]
+
+    def catalog(self):
+        return (
+            list(Teacher.objects.order_by("email").values_list("email", "teacher_name", "college")),
+            list(Course.objects.order_by("pk").values_list("pk", "subject", "course_num", "class_name")),
+            sorted(Course.teachers.through.objects.values_list("course_id", "teacher_id")),
+        )
+
+    def test_ingest_is_idempotent(self):
+        stats = catalog.ingest(self.records)
+        self.assertEqual((stats.teachers_created, stats.courses_created, stats.links_created), (2, 2, 3))
+        before = self.catalog()
+        stats = catalog.ingest(self.records, chunk_size=1)
+        self.assertFalse(stats.changed)
+        self.assertEqual(self.catalog(), before)
+
+    def test_ingest_updates_changed_rows(self):
+        catalog.ingest(self.records)
+        renamed = [{**self.records[1], "class_name": "OOD",
+                    "teachers": [{"name": "Ben Lerner", "email": "b.lerner@northeastern.edu", "college": "CCIS"}]}]
+        stats = catalog.ingest(renamed)
+        self.assertEqual((stats.teachers_updated, stats.courses_updated, stats.courses_created), (1, 1, 0))
+        self.assertEqual(Teacher.objects.get(pk="b.lerner@northeastern.edu").college, "CCIS")
+        self.assertEqual(Course.objects.get(course_num=3500).class_name, "OOD")
+        self.assertEqual(Teacher.objects.count(), 2)
+
+    def test_taken_teacher_name_is_skipped(self):
+        catalog.ingest(self.records)
+        before = self.catalog()
+        namesake = {"name": "Ben Lerner", "email": "ben.lerner@northeastern.edu", "college": "Khoury"}
+        stats = catalog.ingest([{**self.records[0], "teachers": [namesake]},
+                                {**self.records[1], "course_num": 4500, "teachers": [namesake, namesake]}])
+        self.assertEqual(stats.teachers_skipped, 1)
+        self.assertIn("ben.lerner@northeastern.edu", stats.errors[0])
+        self.assertEqual(stats.courses_created, 1)
+        #The existing teacher is untouched and the course is created without the skipped teacher
+        self.assertEqual(self.catalog()[0], before[0])
+        self.assertFalse(Course.objects.get(course_num=4500).teachers.exists())
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.admin = StudentAccount.objects.create_superuser("ada.admin@northeastern.edu", "correct horse")
+        self.jane = StudentAccount.objects.create_user("jane.doe@northeastern.edu", "correct horse")
+
+    def histogram(self, *args, **kwargs):
+        histogram = metrics.Histogram(*args, **kwargs)
+        self.addCleanup(metrics.REGISTRY.remove, histogram)
+        return histogram
+
+    def test_endpoint_is_admin_only(self):
+        client = APIClient()
+        self.assertIn(client.get("/metrics").status_code, (401, 403))
+        client.force_authenticate(self.jane)
+        self.assertEqual(client.get("/metrics").status_code, 403)
+        client.force_authenticate(self.admin)
+        response = client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        self.assertIn("# TYPE nameless_requests_total counter", response.content.decode())
+
+    def test_requests_are_recorded_by_route(self):
+        labels = ("search/teacher/<str:name>", "GET")
+        requests = metrics.REQUESTS._values.get(labels + ("200",), 0)
+        queries = metrics.REQUEST_QUERIES._values.get(labels, [[0], 0])[1]
+        caches[settings.SEARCH_CACHE_ALIAS].clear()
+        search_cache.local_cache().clear()
+        self.assertEqual(APIClient().get("/search/teacher/vitek").status_code, 200)
+        self.assertEqual(metrics.REQUESTS._values[labels + ("200",)], requests + 1)
+        self.assertGreater(metrics.REQUEST_QUERIES._values[labels][1], queries)
+        self.assertEqual(APIClient().get("/no/such/page").status_code, 404)
+        self.assertIn('nameless_requests_total{route="unmatched",method="GET",status="404"}', metrics.render())
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.histogram("test_seconds", "Test.", ("span",), buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value, 'say "hi"')
+        labels = '{span="say \\"hi\\"",le='
+        self.assertEqual(histogram.render(), [
+            "# HELP test_seconds Test.", "# TYPE test_seconds histogram",
+            f'test_seconds_bucket{labels}"0.1"}} 2', f'test_seconds_bucket{labels}"1"}} 3',
+            f'test_seconds_bucket{labels}"+Inf"}} 4',
+            'test_seconds_sum{span="say \\"hi\\""} 2.65', 'test_seconds_count{span="say \\"hi\\""} 4',
+        ])
+
+    def test_spans_time_functions_and_coroutines(self):
+        @metrics.timed("test_sync")
+        def work():
+            return 1
+
+        @metrics.timed("test_async")
+        async def awork():
+            return 2
+
+        self.assertEqual((work(), async_to_sync(awork)()), (1, 2))
+        with self.assertRaises(ValueError), metrics.span("test_failure"):
+            raise ValueError
+        for name in ("test_sync", "test_async", "test_failure"):
+            counts, _ = metrics.SPAN_SECONDS._values[(name,)]
+            self.assertEqual(sum(counts), 1)
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dir = Path(directory.name)
+        settings_override = override_settings(PROFILING_ENABLED=True, PROFILING_TOKEN="secret",
+                                              PROFILING_SAMPLE_RATE=0.0, PROFILING_DIR=self.dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_profiles_requests_carrying_the_token(self):
+        self.assertNotIn("X-Profile", Client().get("/search/teacher/vitek"))
+        self.assertNotIn("X-Profile", Client().get("/search/teacher/vitek", HTTP_X_PROFILE="wrong"))
+        self.assertEqual(list(self.dir.iterdir()), [])
+
+        response = Client().get("/search/teacher/vitek", {"profile": "secret", "profile_mode": "cprofile"})
+        path = self.dir / response["X-Profile"]
+        self.assertEqual(path.parent.name, "search_teacher_str_name")
+        self.assertEqual(path.suffix, ".prof")
+        self.assertTrue(any(function[2] == "searchTeacher" for function in pstats.Stats(str(path)).stats))
+
+        response = Client().get("/search/teacher/vitek", HTTP_X_PROFILE="secret", HTTP_X_PROFILE_MODE="sampler")
+        self.assertEqual((self.dir / response["X-Profile"]).suffix, ".collapsed")
+
+    def test_sample_rate_profiles_without_the_token(self):
+        with override_settings(PROFILING_SAMPLE_RATE=1.0, PROFILING_MODE="cprofile"):
+            self.assertTrue(Client().get("/search/teacher/vitek")["X-Profile"].endswith(".prof"))
+
+    def test_one_request_at_a_time(self):
+        request = RequestFactory().get("/", {"profile": "secret"})
+        request.resolver_match = None
+        profile = profiling.begin(request)
+        self.assertIsNone(profiling.begin(request))
+        #A request which raised has no response, but still frees the profiler
+        profiling.finish(profile, request, None)
+        self.assertEqual([path.parent.name for path in self.dir.glob("*/*")], ["unmatched"])
+        profile = profiling.begin(request)
+        self.assertIsNotNone(profile)
+        profiling.finish(profile, request, None)
+
+    def test_sampler_counts_stacks(self):
+        def busy_wait(stop):
+            while not stop.is_set():
+                pass
+
+        stop = threading.Event()
+        thread = threading.Thread(target=busy_wait, args=(stop,))
+        thread.start()
+        sampler = profiling.Sampler(thread.ident, 0.001)
+        sampler.start()
+        time.sleep(0.05)
+        sampler.stop()
+        stop.set()
+        thread.join()
+        self.assertTrue(sampler.stacks)
+        #Stacks run from the thread's entry point to the innermost frame
+        self.assertTrue(all(stack.startswith("_bootstrap (threading.py:") and ";busy_wait (tests.py:" in stack
+                            for stack in sampler.stacks))
+        sampler.dump(self.dir / "profile.collapsed")
+        lines = (self.dir / "profile.collapsed").read_text().splitlines()
+        self.assertEqual(sum(int(line.rsplit(" ", 1)[1]) for line in lines), sum(sampler.stacks.values()))
+
+
+class VerdictCacheTests(TestCase):
+    def setUp(self):
+        verdicts.local_cache().clear()
+
+    def moderate(self, text, scores=None, asynchronous=False):
+        """Moderate the text and return whether it is malicious and how many times Perspective was called."""
+
+        message = Message(message_body=text)
+        scores = scores or {"TOXICITY": 0.1}
+        with mock.patch.object(moderation, "analyze", return_value=scores) as analyze, \
+                mock.patch.object(moderation, "aanalyze", return_value=scores) as aanalyze:
+            if asynchronous:
+                malicious = async_to_sync(message.ais_malicious_msg)()
+            else:
+                malicious = message.is_malicious_msg()
+        return malicious, analyze.call_count + aanalyze.call_count
+
+    def test_digest_normalizes_text(self):
+        self.assertEqual(verdicts.text_digest("Great  lecture\ntoday"), verdicts.text_digest("great lecture TODAY "))
+        self.assertEqual(verdicts.text_digest("\uff27reat lecture"), verdicts.text_digest("great lecture"))
+        self.assertNotEqual(verdicts.text_digest("great lecture"), verdicts.text_digest("great lectures"))
+
+    def test_repeated_texts_are_scored_once(self):
+        before = verdicts.stats()
+        self.assertEqual(self.moderate("You are the worst", {"TOXICITY": 0.99}), (True, 1))
+        #The verdict, not just the text, is reused
+        self.assertEqual(self.moderate("you are  the WORST"), (True, 0))
+        #Another process, with an empty local cache, finds it in the verdict table
+        verdicts.local_cache().clear()
+        self.assertEqual(self.moderate("You are the worst"), (True, 0))
+        self.assertEqual(self.moderate("You are the worst", asynchronous=True), (True, 0))
+        after = verdicts.stats()
+        self.assertEqual({event: after[event] - before[event] for event in ("misses", "local_hits", "db_hits",
+                                                                              "api_calls_saved")},
+                         {"misses": 1, "local_hits": 2, "db_hits": 1, "api_calls_saved": 3})
+        self.assertEqual(ModerationVerdict.objects.get().scores, {"TOXICITY": 0.99})
+
+    def test_async_lookup_reads_the_verdict_table(self):
+        self.assertEqual(self.moderate("Thanks for the extension", asynchronous=True), (False, 1))
+        verdicts.local_cache().clear()
+        self.assertEqual(self.moderate("thanks for the extension", asynchronous=True), (False, 0))
+
+    def test_expired_verdicts_are_rescored(self):
+        self.assertEqual(self.moderate("Thanks for the extension"), (False, 1))
+        verdicts.local_cache().clear()
+        ModerationVerdict.objects.update(
+            created_at=timezone.now() - timedelta(seconds=settings.MODERATION_VERDICT_TTL + 1))
+        self.assertEqual(self.moderate("Thanks for the extension", {"TOXICITY": 0.95}), (True, 1))
+        self.assertEqual(ModerationVerdict.objects.get().scores, {"TOXICITY": 0.95})
+
+
+class VerdictPurgeTests(TestCase):
+    def test_sender_purges_expired_verdicts(self):
+        expired = timezone.now() - timedelta(seconds=settings.MODERATION_VERDICT_TTL + 1)
+        ModerationVerdict.objects.create(digest="old", scores={"TOXICITY": 0.1}, created_at=expired)
+        verdicts.store("a recent message", {"TOXICITY": 0.1})
+        stop = threading.Event()
+        #One iteration of the sender loop, without closing the test's connection
+        with mock.patch.object(pipeline.outbox, "drain", side_effect=lambda batch_size: stop.set() or 0), \
+                mock.patch.object(pipeline, "connection"):
+            pipeline.run_sender(stop, 0)
+        self.assertEqual(list(ModerationVerdict.objects.values_list("digest", flat=True)),
+                         [verdicts.text_digest("a recent message")])
+
+
+class PrescreenTests(SimpleTestCase):
+    screen = prescreen.Prescreen(["butt", "ass", "fuck", "idiot", "god", "shut up"])
+
+    def test_obfuscated_terms_match(self):
+        for text, term in (("F.U.C.K this class", "fuck"), ("what a 1d10t", "idiot"), ("fuuuuuck", "fuck"),
+                           ("BUTTTTT", "butt"), ("you a$$", "ass"), ("shuuuut  up!", "shut up"),
+                           ("kick ass", "ass")):
+            self.assertEqual(self.screen.find(text), [term], text)
+
+    def test_ordinary_words_do_not_match(self):
+        for text in ("but the lecture was long", "as soon as possible", "a good class", "the assessment",
+                     "passing grades", "the buttons"):
+            self.assertEqual(self.screen.find(text), [], text)
+
+    def test_doubled_letters_are_kept(self):
+        self.assertEqual(prescreen.normalize("Sooo gooood, thanks!!"), "so* go*d thanks")
+        self.assertEqual(prescreen.normalize("Butt"), "butt")
+
+
+class SendMessageTests(TestCase):
+    def setUp(self):
+        caches[settings.THROTTLE_CACHE_ALIAS].clear()
+        self.teacher = Teacher.objects.create(email="jan.vitek@northeastern.edu", teacher_name="Jan Vitek",
+                                              college="Khoury")
+        self.jane = StudentAccount.objects.create_user("jane.doe@northeastern.edu", "correct horse")
+        self.john = StudentAccount.objects.create_user("john.roe@northeastern.edu", "correct horse")
+        #Posing as another student has no effect: the sender is the requesting student
+        self.data = {"student": self.john.pk, "teacher": self.teacher.pk, "message_body": "hello"}
+
+    def test_requires_authentication(self):
+        self.assertEqual(APIClient().post("/message", self.data, format="json").status_code, 401)
+        self.assertEqual(Client().post("/async/message", self.data, content_type="application/json").status_code,
+                         401)
+        self.assertFalse(Message.objects.exists())
+
+    def test_sender_is_requesting_student(self):
+        client = APIClient()
+        client.force_authenticate(self.jane)
+        response = client.post("/message", self.data, format="json")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(Message.objects.get(pk=response.json()["id"]).student, self.jane)
+
+    def test_async_sender_is_requesting_student(self):
+        #Moderation fails, so the message is left to the pipeline workers
+        with mock.patch.object(Message, "aemail_message", side_effect=RuntimeError):
+            response = Client().post("/async/message", self.data, content_type="application/json",
+                                     HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.jane)}")
+        self.assertEqual(response.status_code, 202)
+        message = Message.objects.get(pk=response.json()["id"])
+        self.assertEqual(message.student, self.jane)
+        job = MessageJob.objects.get(message=message)
+        self.assertEqual((job.locked_by, job.locked_at), ("", None))
+
+    def test_async_moderates_inline(self):
+        with mock.patch.object(moderation, "aanalyze", return_value={"TOXICITY": 0.1}):
+            response = Client().post("/async/message", self.data, content_type="application/json",
+                                     HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.jane)}")
+        self.assertEqual(response.status_code, 201)
+        message = Message.objects.get(pk=response.json()["id"])
+        self.assertEqual(message.outbox_email.recipient, self.teacher.pk)
+        self.assertFalse(MessageJob.objects.exists())
+
+
+class AccountCacheTests(TestCase):
+    def setUp(self):
+        caches[settings.AUTH_USER_CACHE_ALIAS].clear()
+        accounts.local_cache().clear()
+        self.jane = StudentAccount.objects.create_user("jane.doe@northeastern.edu", "correct horse")
+        self.client = Client(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.jane)}")
+
+    def history(self):
+        return self.client.get("/message/history").status_code
+
+    def test_hit_and_miss_counters(self):
+        before = accounts.stats()
+        self.assertEqual(self.history(), 200)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.history(), 200)
+        #Only the history query: the student came from the cache
+        self.assertEqual(len(queries), 1)
+        #Another process, with an empty local cache, finds it in the shared one
+        accounts.local_cache().clear()
+        self.assertEqual(self.history(), 200)
+        after = accounts.stats()
+        self.assertEqual({event: after[event] - before[event] for event in ("misses", "local_hits", "shared_hits")},
+                         {"misses": 1, "local_hits": 1, "shared_hits": 1})
+
+    def test_cached_account_defers_other_fields(self):
+        self.assertEqual(self.history(), 200)
+        account = accounts.lookup(StudentAccount, self.jane.pk)
+        self.assertEqual((account.pk, account.num_infractions, account.is_active), (self.jane.pk, 0, True))
+        self.assertEqual(account.get_deferred_fields(), {"password", "last_login"})
+
+    def test_deactivation_invalidates_once_committed(self):
+        self.assertEqual(self.history(), 200)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.jane.is_active = False
+            self.jane.save()
+            #Not yet committed: the cached account still authenticates
+            self.assertIsNotNone(accounts.lookup(StudentAccount, self.jane.pk))
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(accounts.lookup(StudentAccount, self.jane.pk))
+        self.assertEqual(self.history(), 401)
+
+    def test_infractions_invalidate(self):
+        self.assertEqual(self.history(), 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.jane.increment_infractions()
+        self.assertEqual(self.history(), 200)
+        self.assertEqual(accounts.lookup(StudentAccount, self.jane.pk).num_infractions, 1)
+
+        for _ in range(settings.MAX_INFRACTIONS - 1):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.jane.increment_infractions()
+        self.assertEqual(self.history(), 401)
+
+    def test_deletion_invalidates(self):
+        self.assertEqual(self.history(), 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.jane.delete()
+        self.assertEqual(self.history(), 401)
+
+
+@override_settings(MESSAGE_THROTTLE_RATE=20, MESSAGE_THROTTLE_PERIOD=3600, MESSAGE_THROTTLE_BURST=5,
+                   MESSAGE_THROTTLE_INFRACTION_PENALTY=1.0)
+class MessageThrottleTests(TestCase):
+    def setUp(self):
+        caches[settings.THROTTLE_CACHE_ALIAS].clear()
+        self.teacher = Teacher.objects.create(email="jan.vitek@northeastern.edu", teacher_name="Jan Vitek",
+                                              college="Khoury")
+        self.jane = StudentAccount.objects.create_user("jane.doe@northeastern.edu", "correct horse")
+        self.request = RequestFactory().post("/message")
+        self.request.user = self.jane
+
+    def send(self, student):
+        client = APIClient()
+        client.force_authenticate(student)
+        return client.post("/message", {"teacher": self.teacher.pk, "message_body": "hello"}, format="json")
+
+    def test_burst_then_429_with_retry_after(self):
+        for _ in range(5):
+            self.assertEqual(self.send(self.jane).status_code, 202)
+        response = self.send(self.jane)
+        self.assertEqual(response.status_code, 429)
+        #A token comes back every 180 seconds
+        self.assertTrue(0 < int(response["Retry-After"]) <= 180)
+        self.assertEqual(Message.objects.count(), 5)
+
+    def test_infractions_tighten_limits(self):
+        self.assertEqual(throttling.MessageThrottle().get_limits(self.request), (180000, 5))
+        self.jane.num_infractions = 2
+        self.assertEqual(throttling.MessageThrottle().get_limits(self.request), (540000, 3))
+
+        for _ in range(3):
+            self.assertEqual(self.send(self.jane).status_code, 202)
+        response = self.send(self.jane)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response["Retry-After"]), 180)
+
+    def test_refills_over_time(self):
+        throttle = throttling.MessageThrottle()
+        start = time.time()
+        with mock.patch.object(time, "time", return_value=start):
+            self.assertEqual(sum(throttle.allow_request(self.request, None) for _ in range(8)), 5)
+        with mock.patch.object(time, "time", return_value=start + 360):
+            self.assertEqual(sum(throttle.allow_request(self.request, None) for _ in range(8)), 2)
+
+    def test_idle_time_is_not_banked(self):
+        throttle = throttling.MessageThrottle()
+        #Full again ten intervals ago
+        caches[settings.THROTTLE_CACHE_ALIAS].set(throttle.get_cache_key(self.request),
+                                                  int(time.time() * 1000) - 1800000, 60)
+        self.assertEqual(sum(throttle.allow_request(self.request, None) for _ in range(8)), 5)
+
+    def test_concurrent_requests_on_a_full_bucket_admit_at_most_one_burst(self):
+        throttle = throttling.MessageThrottle()
+        caches[settings.THROTTLE_CACHE_ALIAS].set(throttle.get_cache_key(self.request),
+                                                  int(time.time() * 1000) - 1800000, 60)
+        admitted = []
+        barrier = threading.Barrier(20)
+
+        def request():
+            barrier.wait()
+            admitted.append(throttling.MessageThrottle().allow_request(self.request, None))
+
+        backend = type(caches[settings.THROTTLE_CACHE_ALIAS])
+        incr = backend.incr
+
+        def slow_incr(*args, **kwargs):
+            #Let the other requests run between a request's cache operations
+            value = incr(*args, **kwargs)
+            time.sleep(0.01)
+            return value
+
+        threads = [threading.Thread(target=request) for _ in range(20)]
+        #Each thread has a cache connection of its own
+        with mock.patch.object(backend, "incr", slow_incr):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertIn(admitted.count(True), range(1, 6))
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        teacher = Teacher.objects.create(email="jan.vitek@northeastern.edu", teacher_name="Jan Vitek",
+                                         college="Khoury")
+        student = StudentAccount.objects.create_user("jane.doe@northeastern.edu", "correct horse")
+
+        def message(month, status, **fields):
+            created_at = timezone.make_aware(datetime(2023, month, 1, 12, 0, 0, 123456))
+            return Message.objects.create(student=student, teacher=teacher, message_body=f"message of {month}",
+                                          status=status, created_at=created_at, **fields)
+
+        self.sent = message(2, Message.Status.SENT)
+        OutboxEmail.objects.create(message=self.sent, recipient=teacher.pk, body=self.sent.message_body,
+                                   sent_at=self.sent.created_at + timedelta(minutes=1))
+        self.rejected = message(10, Message.Status.REJECTED, is_malicious=True)
+        scoring.store([self.rejected], {"TOXICITY": 0.91, "INSULT": 0.75})
+        self.suppressed = message(11, Message.Status.SUPPRESSED)
+        #Not done with yet: pending, or waiting in the outbox
+        self.pending = message(3, Message.Status.PENDING)
+        self.unsent = message(4, Message.Status.SENT)
+        OutboxEmail.objects.create(message=self.unsent, recipient=teacher.pk, body=self.unsent.message_body)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.before = timezone.make_aware(datetime(2024, 1, 1))
+
+    def test_round_trip(self):
+        segments = archive.archive(self.before, self.directory, segment_rows=1)
+        self.assertEqual([segment.parent.name for segment in segments], ["2023-SP", "2023-FA", "2023-FA"])
+        self.assertEqual(archive.pending_segments(self.directory), sorted(segments))
+
+        records = [record for segment in archive.segments(directory=self.directory)
+                   for record in archive.read(segment)]
+        self.assertEqual([record["id"] for record in records], [self.sent.pk, self.rejected.pk, self.suppressed.pk])
+        self.assertEqual(datetime.fromisoformat(records[0]["created_at"]), self.sent.created_at)
+        self.assertEqual(datetime.fromisoformat(records[0]["sent_at"]), self.sent.outbox_email.sent_at)
+        self.assertEqual(records[0]["message_body"], "message of 2")
+        self.assertEqual([(record["toxicity"], record["identity_attack"], record["insult"]) for record in records],
+                         [(None, None, None), (9100, 0, 7500), (None, None, None)])
+        self.assertEqual([record["id"] for record in archive.scan(directory=self.directory, is_malicious=True)],
+                         [self.rejected.pk])
+        self.assertEqual(len(list(archive.scan(["2023-FA"], self.directory))), 2)
+
+        self.assertEqual(sum(archive.delete_archived(segment, batch_size=1) for segment in segments), 3)
+        self.assertEqual(set(Message.objects.values_list("pk", flat=True)), {self.pending.pk, self.unsent.pk})
+        self.assertEqual(archive.pending_segments(self.directory), [])
+        #Archiving again finds nothing new
+        self.assertEqual(archive.archive(self.before, self.directory), [])
+
+    def test_tampered_segment(self):
+        segment, = archive.archive(timezone.make_aware(datetime(2023, 3, 1)), self.directory)
+        data = bytearray(segment.read_bytes())
+        data[len(data) // 2] ^= 1
+        segment.write_bytes(data)
+        with self.assertRaises(archive.ArchiveError):
+            list(archive.read(segment))
+        with self.assertRaises(archive.ArchiveError):
+            archive.delete_archived(segment)
+        self.assertTrue(Message.objects.filter(pk=self.sent.pk).exists())
+
+        archive.checksum_path(segment).unlink()
+        with self.assertRaisesMessage(archive.ArchiveError, "has no checksum"):
+            archive.verify(segment)
+
+
+class NearDuplicateIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = dedup.NearDuplicateIndex(window=60, max_distance=6, max_entries=3)
+        self.text = "The midterm was graded unfairly and the regrade requests were ignored for weeks"
+
+    def test_edited_copies_are_near(self):
+        fingerprint = dedup.simhash(self.text)
+        for copy in ("the midterm was graded UNFAIRLY, and the regrade requests were ignored for weeks!!",
+                     "The m1dterm was graded unfairly and the regrade requests were ignored for weeks"):
+            self.assertLessEqual(dedup.distance(fingerprint, dedup.simhash(copy)), 6, copy)
+        self.assertGreater(dedup.distance(fingerprint, dedup.simhash("Office hours were really helpful this week")), 6)
+
+    def test_floods_per_teacher(self):
+        self.assertIsNone(self.index.leader_of("jan.vitek", "jane", dedup.simhash(self.text), 1, now=0))
+        self.index.decide(1, False)
+        leader = self.index.leader_of("jan.vitek", "jane", dedup.simhash(self.text + "!"), 2, now=1)
+        self.assertEqual((leader.message_id, leader.malicious), (1, False))
+        #Another student's copy joins the flood, a copy to another teacher leads a flood of its own
+        self.assertIs(self.index.leader_of("jan.vitek", "john", dedup.simhash(self.text), 3, now=2), leader)
+        self.assertIsNone(self.index.leader_of("ben.lerner", "jane", dedup.simhash(self.text), 4, now=3))
+        #A retried leader is not its own duplicate
+        self.assertIsNone(self.index.leader_of("jan.vitek", "jane", dedup.simhash(self.text), 1, now=4))
+
+    def test_join_once_per_student(self):
+        self.index.leader_of("jan.vitek", "jane", dedup.simhash(self.text), 1, now=0)
+        leader = self.index.leader_of("jan.vitek", "john", dedup.simhash(self.text), 2, now=1)
+        self.assertFalse(self.index.join(leader, "jane"))
+        self.assertTrue(self.index.join(leader, "john"))
+        self.assertFalse(self.index.join(leader, "john"))
+
+    def test_wait_for_decision(self):
+        self.index.leader_of("jan.vitek", "jane", dedup.simhash(self.text), 1)
+        leader = self.index.leader_of("jan.vitek", "john", dedup.simhash(self.text), 2)
+        self.assertFalse(self.index.wait(leader, 0.01))
+        threading.Timer(0.05, self.index.decide, (1, True)).start()
+        self.assertTrue(self.index.wait(leader, 5))
+        self.assertTrue(leader.malicious)
+
+    def test_eviction(self):
+        fingerprint = dedup.simhash(self.text)
+        self.index.leader_of("jan.vitek", "jane", fingerprint, 1, now=0)
+        self.assertIsNone(self.index.leader_of("jan.vitek", "jane", fingerprint, 2, now=61))
+        for message_id in range(3, 6):
+            self.index.leader_of(f"teacher {message_id}", "jane", fingerprint, message_id, now=62)
+        self.assertEqual(len(self.index), 3)
+        self.assertIsNone(self.index.leader_of("jan.vitek", "jane", fingerprint, 6, now=62))
+
+
+@override_settings(DEDUP_ENABLED=True)
+class NearDuplicateMessageTests(TestCase):
+    def setUp(self):
+        dedup._index = None
+        self.addCleanup(setattr, dedup, "_index", None)
+        self.teacher = Teacher.objects.create(email="jan.vitek@northeastern.edu", teacher_name="Jan Vitek",
+                                              college="Khoury")
+        self.jane = StudentAccount.objects.create_user("jane.doe@northeastern.edu", "correct horse")
+        self.john = StudentAccount.objects.create_user("john.roe@northeastern.edu", "correct horse")
+
+    def send(self, student, text, malicious=False):
+        message = Message.objects.create(student=student, teacher=self.teacher, message_body=text)
+        with mock.patch.object(Message, "is_malicious_msg", return_value=malicious) as moderate:
+            result = message.email_message()
+        message.refresh_from_db()
+        return message, result, moderate.called
+
+    def test_students_share_the_decision_but_are_not_suppressed_by_each_other(self):
+        message, _, moderated = self.send(self.jane, "Thanks for a great class")
+        self.assertTrue(moderated)
+        self.assertTrue(message.outbox_email)
+        message, _, moderated = self.send(self.john, "thanks for a great class!")
+        self.assertFalse(moderated)
+        self.assertEqual(message.status, Message.Status.PENDING)
+        self.assertTrue(message.outbox_email)
+
+    def test_repeats_are_suppressed(self):
+        self.send(self.jane, "Thanks for a great class")
+        message, result, moderated = self.send(self.jane, "thanks for a great class!!")
+        self.assertFalse(moderated)
+        self.assertEqual(message.status, Message.Status.SUPPRESSED)
+        self.assertFalse(OutboxEmail.objects.filter(message=message).exists())
+
+    def test_repeats_of_malicious_message_cost_no_infraction(self):
+        _, result, _ = self.send(self.jane, "you are a terrible teacher and a worse person", malicious=True)
+        self.assertIn("1 malicious messages", result["Rejected"])
+        message, result, moderated = self.send(self.jane, "You are a terrible teacher, and a worse person!",
+                                               malicious=True)
+        self.assertFalse(moderated)
+        self.assertEqual(result, REPEATED_RESULT)
+        self.assertEqual((message.status, message.is_malicious), (Message.Status.REJECTED, True))
+        self.jane.refresh_from_db()
+        self.assertEqual(self.jane.num_infractions, 1)
+
+    def test_flood_from_several_accounts_is_moderated_once(self):
+        self.send(self.jane, "you are a terrible teacher and a worse person", malicious=True)
+        message, result, moderated = self.send(self.john, "You are a terrible teacher, and a worse person!")
+        self.assertFalse(moderated)
+        self.assertIn("1 malicious messages", result["Rejected"])
+        self.assertEqual((message.status, message.is_malicious), (Message.Status.REJECTED, True))
+        self.assertFalse(OutboxEmail.objects.exists())
+        self.john.refresh_from_db()
+        self.assertEqual(self.john.num_infractions, 1)
+
+    @override_settings(PERSPECTIVE_DEADLINE=0.05)
+    def test_copies_of_an_undecided_leader_are_held_until_it_is_decided(self):
+        #The leader is still being moderated
+        leader = Message.objects.create(student=self.jane, teacher=self.teacher,
+                                        message_body="you are a terrible teacher and a worse person")
+        dedup.leader_of(leader)
+        message = Message.objects.create(student=self.john, teacher=self.teacher,
+                                         message_body="You are a terrible teacher, and a worse person!")
+        job = pipeline.enqueue_message(message)
+        with mock.patch.object(Message, "is_malicious_msg") as moderate:
+            pipeline.process_job(job)
+            message.refresh_from_db()
+            self.assertEqual(message.status, Message.Status.HELD)
+            self.assertTrue(MessageJob.objects.filter(pk=job.pk).exists())
+
+            dedup.decide(leader, True)
+            pipeline.process_job(job)
+        self.assertFalse(moderate.called)
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.is_malicious), (Message.Status.REJECTED, True))
+
+
+class BatchMessageTests(TestCase):
+    def setUp(self):
+        caches[settings.THROTTLE_CACHE_ALIAS].clear()
+        dedup._index = None
+        self.addCleanup(setattr, dedup, "_index", None)
+        self.teachers = [
+            Teacher.objects.create(email=f"{name.lower().replace(' ', '.')}@northeastern.edu", teacher_name=name,
+                                   college="Khoury")
+            for name in ("Amal Ahmed", "Ben Lerner", "Jan Vitek")
+        ]
+        self.course = Course.objects.create(subject="CS", course_num=2500, class_name="Fundies 1", semester="FA",
+                                            year=2023)
+        self.course.teachers.set(self.teachers)
+        self.jane = StudentAccount.objects.create_user("jane.doe@northeastern.edu", "correct horse")
+        self.john = StudentAccount.objects.create_user("john.roe@northeastern.edu", "correct horse")
+        self.client = APIClient()
+        self.client.force_authenticate(self.jane)
+
+    def send(self, data, malicious=False, **kwargs):
+        with mock.patch.object(Message, "is_malicious_msg", return_value=malicious, **kwargs) as moderate:
+            response = self.client.post("/message/batch", data, format="json")
+        return response, moderate.call_count
+
+    def test_requires_authentication(self):
+        response = APIClient().post("/message/batch", {"course": self.course.pk, "message_body": "hi"}, format="json")
+        self.assertEqual(response.status_code, 401)
+
+    def test_course_batch(self):
+        #Posing as another student has no effect
+        response, moderations = self.send({"student": self.john.pk, "course": self.course.pk,
+                                           "message_body": "Thanks for a great semester"})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(moderations, 1)
+        self.assertEqual([message["teacher"] for message in response.json()["messages"]],
+                         [teacher.pk for teacher in self.teachers])
+        messages = Message.objects.filter(pk__in=[message["id"] for message in response.json()["messages"]])
+        self.assertEqual({message.student_id for message in messages}, {self.jane.pk})
+        self.assertEqual(sorted(OutboxEmail.objects.values_list("recipient", flat=True)),
+                         [teacher.pk for teacher in self.teachers])
+
+    def test_malicious_batch_costs_one_infraction(self):
+        response, moderations = self.send({"teachers": [self.teachers[0].pk, self.teachers[1].pk],
+                                           "message_body": "you are all terrible"}, malicious=True)
+        self.assertEqual((response.status_code, moderations), (201, 1))
+        self.assertIn("1 malicious messages", response.json()["Rejected"])
+        self.assertEqual(set(Message.objects.values_list("status", "is_malicious")), {(Message.Status.REJECTED, True)})
+        self.assertFalse(OutboxEmail.objects.exists())
+        self.jane.refresh_from_db()
+        self.assertEqual(self.jane.num_infractions, 1)
+
+    def test_failed_moderation_queues_messages(self):
+        response, _ = self.send({"course": self.course.pk, "message_body": "hello"}, side_effect=RuntimeError)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(MessageJob.objects.count(), 3)
+
+    @override_settings(MESSAGE_BATCH_MAX_TEACHERS=2)
+    def test_validation(self):
+        for data in ({"message_body": "hello"},
+                     {"course": self.course.pk, "teachers": [self.teachers[0].pk], "message_body": "hello"},
+                     {"teachers": ["nobody@northeastern.edu"], "message_body": "hello"},
+                     {"course": self.course.pk, "message_body": "hello"}):
+            response, moderations = self.send(data)
+            self.assertEqual((response.status_code, moderations), (400, 0), data)
+        self.assertFalse(Message.objects.exists())
+
+
+class RethresholdTests(TestCase):
+    def setUp(self):
+        teacher = Teacher.objects.create(email="jan.vitek@northeastern.edu", teacher_name="Jan Vitek",
+                                         college="Khoury")
+        student = StudentAccount.objects.create_user("jane.doe@northeastern.edu", "correct horse")
+        self.messages = {}
+        for name, status, toxicity in (("clean", Message.Status.SENT, 0.6), ("borderline", Message.Status.SENT, 0.68),
+                                       ("toxic", Message.Status.REJECTED, 0.72),
+                                       ("very toxic", Message.Status.REJECTED, 0.9),
+                                       ("in flight", Message.Status.PENDING, 0.68)):
+            message = Message.objects.create(student=student, teacher=teacher, message_body=name, status=status,
+                                             is_malicious=status == Message.Status.REJECTED)
+            scoring.store([message], {"TOXICITY": toxicity})
+            self.messages[name] = message
+        #Rejected by the pre-screen, without scores
+        self.messages["blocklisted"] = Message.objects.create(student=student, teacher=teacher, message_body="x",
+                                                              status=Message.Status.REJECTED, is_malicious=True)
+
+    def decisions(self) -> dict:
+        return {message.message_body: (message.status, message.is_malicious) for message in Message.objects.all()}
+
+    def test_stricter_thresholds_flag_sent_messages(self):
+        before = self.decisions()
+        self.assertEqual(scoring.rethreshold({"TOXICITY": 0.65}, chunk_size=2, dry_run=True),
+                         Counter({(False, False): 1, (False, True): 1, (True, True): 2}))
+        self.assertEqual(self.decisions(), before)
+
+        #Delivered all the same, so it stays Sent
+        scoring.rethreshold({"TOXICITY": 0.65}, chunk_size=2)
+        self.assertEqual(self.decisions(), {**before, "borderline": (Message.Status.SENT, True)})
+
+    def test_looser_thresholds_clear_rejections(self):
+        before = self.decisions()
+        self.assertEqual(scoring.rethreshold({"TOXICITY": 0.8}, chunk_size=2),
+                         Counter({(False, False): 2, (True, False): 1, (True, True): 1}))
+        #Never delivered, so it stays Rejected
+        self.assertEqual(self.decisions(), {**before, "toxic": (Message.Status.REJECTED, False)})
+
+    def test_matches_moderation_decision(self):
+        thresholds = {"TOXICITY": 0.68}
+        scoring.rethreshold(thresholds)
+        for name, toxicity in (("clean", 0.6), ("borderline", 0.68), ("toxic", 0.72)):
+            self.assertEqual(self.decisions()[name][1], scoring.exceeds({"TOXICITY": toxicity}, thresholds), name)
@@ -0,0 +1,144 @@
+"""
+Cache of Perspective verdicts keyed by a hash of the normalized message text.
+
+Repeated texts (spam waves, copy-pasted complaints) are scored once: the per-attribute scores
+are kept for MODERATION_VERDICT_TTL seconds in an in-process LRU in front of the
+ModerationVerdict table. Hit counters and the measured API latency show how much quota and
+time the cache saves.
+"""
+import hashlib
+import threading
+import unicodedata
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import models
+from .lru import LRUCache
+
+_local = None
+_local_lock = threading.Lock()
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def local_cache() -> LRUCache:
+    """Return the in-process LRU of verdicts."""
+
+    global _local
+    if _local is None:
+        with _local_lock:
+            if _local is None:
+                _local = LRUCache(settings.MODERATION_VERDICT_LOCAL_SIZE, settings.MODERATION_VERDICT_TTL)
+    return _local
+
+
+def text_digest(text: str) -> str:
+    """Return the SHA-256 hex digest of the text after normalizing case, unicode forms and whitespace."""
+
+    normalized = " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def record(event: str, amount: float = 1):
+    with _stats_lock:
+        _stats[event] += amount
+
+
+def lookup(text: str):
+    """Return the cached {attribute: score} dict for the text, or None if it has not been scored recently."""
+
+    digest = text_digest(text)
+    scores = local_cache().get(digest)
+    if scores is not None:
+        record("local_hits")
+        return scores
+
+    cutoff = timezone.now() - timedelta(seconds=settings.MODERATION_VERDICT_TTL)
+    verdict = models.ModerationVerdict.objects.filter(digest=digest, created_at__gte=cutoff).first()
+    if verdict is None:
+        record("misses")
+        return None
+
+    record("db_hits")
+    local_cache().set(digest, verdict.scores)
+    return verdict.scores
+
+
+def store(text: str, scores: dict, api_seconds: float = None):
+    """Cache the scores returned by Perspective for the text, and how long the API call took."""
+
+    digest = text_digest(text)
+    models.ModerationVerdict.objects.update_or_create(
+        digest=digest, defaults={"scores": scores, "created_at": timezone.now()}
+    )
+    local_cache().set(digest, scores)
+    if api_seconds is not None:
+        record("api_calls")
+        record("api_seconds", api_seconds)
+
+
+async def alookup(text: str):
+    """Asynchronous lookup, reading the verdict table with the async ORM."""
+
+    digest = text_digest(text)
+    scores = local_cache().get(digest)
+    if scores is not None:
+        record("local_hits")
+        return scores
+
+    cutoff = timezone.now() - timedelta(seconds=settings.MODERATION_VERDICT_TTL)
+    verdict = await models.ModerationVerdict.objects.filter(digest=digest, created_at__gte=cutoff).afirst()
+    if verdict is None:
+        record("misses")
+        return None
+
+    record("db_hits")
+    local_cache().set(digest, verdict.scores)
+    return verdict.scores
+
+
+async def astore(text: str, scores: dict, api_seconds: float = None):
+    """Asynchronous store, writing the verdict table with the async ORM."""
+
+    digest = text_digest(text)
+    await models.ModerationVerdict.objects.aupdate_or_create(
+        digest=digest, defaults={"scores": scores, "created_at": timezone.now()}
+    )
+    local_cache().set(digest, scores)
+    if api_seconds is not None:
+        record("api_calls")
+        record("api_seconds", api_seconds)
+
+
+def purge_expired() -> int:
+    """Delete verdicts older than the TTL from the database and return how many were deleted."""
+
+    cutoff = timezone.now() - timedelta(seconds=settings.MODERATION_VERDICT_TTL)
+    deleted, _ = models.ModerationVerdict.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
+
+
+def stats() -> dict:
+    """
+    Return this process's verdict cache counters: hits per level, misses, hit rate, API calls
+    saved and the API time they are estimated to have saved.
+    """
+
+    with _stats_lock:
+        counts = dict(_stats)
+    hits = counts.get("local_hits", 0) + counts.get("db_hits", 0)
+    lookups = hits + counts.get("misses", 0)
+    api_calls = counts.get("api_calls", 0)
+    mean_latency = counts.get("api_seconds", 0) / api_calls if api_calls else 0.0
+    return {
+        "local_hits": counts.get("local_hits", 0),
+        "db_hits": counts.get("db_hits", 0),
+        "misses": counts.get("misses", 0),
+        "hit_rate": hits / lookups if lookups else 0.0,
+        "api_calls_saved": hits,
+        "mean_api_seconds": mean_latency,
+        "estimated_seconds_saved": hits * mean_latency,
+    }
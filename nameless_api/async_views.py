@@ -0,0 +1,172 @@
+"""
+Asynchronous variants of the search, teacher and message endpoints, for ASGI deployments.
+
+These are plain Django async views rather than DRF views: database access goes through the async
+ORM and moderation through the async Perspective client, so one worker can hold many requests
+in flight while they wait on I/O. Responses are rendered the same way as the synchronous views.
+Streaming (stream=1) is only served by the synchronous endpoints.
+"""
+import json
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAuthenticated, Throttled
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from feedback_man.models import Teacher, Course
+from feedback_man import moderation, pipeline
+from .serializers import MessageSerializer
+from .views import TEACHER_SEARCH_ORDERING, COURSE_SEARCH_ORDERING, FAST_TEACHER, FAST_COURSE
+from . import cache, pagination
+from .fast_serializers import render_json
+from .throttling import MessageThrottle, check_moderation
+
+
+def json_response(data, status_code: int = status.HTTP_200_OK) -> HttpResponse:
+    return HttpResponse(JSONRenderer().render(data), status=status_code, content_type="application/json")
+
+
+def async_api_view(methods: list):
+    """
+    Decorator for async views, in the spirit of DRF's api_view: rejects other HTTP methods,
+    exempts the view from CSRF and turns API exceptions into JSON error responses.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return json_response({"detail": f'Method "{request.method}" not allowed.'},
+                                     status.HTTP_405_METHOD_NOT_ALLOWED)
+            try:
+                return await view(request, *args, **kwargs)
+            except APIException as e:
+                detail = e.detail if isinstance(e.detail, (dict, list)) else {"detail": e.detail}
+                response = json_response(detail, e.status_code)
+                if getattr(e, "wait", None):
+                    response["Retry-After"] = "%d" % e.wait
+                return response
+
+        wrapper.csrf_exempt = True
+        return wrapper
+
+    return decorator
+
+
+async def authenticate(request):
+    """Set request.user with the configured REST framework authentication classes."""
+
+    request.user = AnonymousUser()
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        result = await sync_to_async(authentication_class().authenticate)(request)
+        if result is not None:
+            request.user, request.auth = result
+            return
+
+@async_api_view(['GET'])
+async def searchTeacher(request, name):
+    """
+    Asynchronous searchTeacher: a JSON response of the teachers who match the given name, paginated.
+    """
+    teachers = Teacher.objects.search_teacher_name(name)
+    cursor, limit = pagination.page_params(request)
+
+    async def search():
+        rows = FAST_TEACHER.values(teachers, *[field.lstrip("-") for field in TEACHER_SEARCH_ORDERING])
+        page, next_cursor = await pagination.apaginate(rows, TEACHER_SEARCH_ORDERING, cursor, limit)
+        return {"results": FAST_TEACHER.serialize(page), "next": next_cursor}
+
+    return await cache.acached_response("teacher", name, search, cursor=cursor, limit=limit)
+
+@async_api_view(['GET'])
+async def searchCourse(request, name):
+    """
+    Asynchronous searchCourse: a JSON response of the courses which match the given course, paginated.
+    """
+    courses = Course.objects.search_course_name(name)
+    cursor, limit = pagination.page_params(request)
+
+    async def search():
+        rows = FAST_COURSE.values(courses, *[field.lstrip("-") for field in COURSE_SEARCH_ORDERING])
+        page, next_cursor = await pagination.apaginate(rows, COURSE_SEARCH_ORDERING, cursor, limit)
+        return {"results": await FAST_COURSE.aserialize(page), "next": next_cursor}
+
+    return await cache.acached_response("course", name, search, cursor=cursor, limit=limit)
+
+@async_api_view(['GET'])
+async def autocompleteCourse(request, query):
+    """
+    Asynchronous autocompleteCourse: a JSON response of the top k courses matching the partially typed query.
+    """
+    try:
+        k = int(request.GET.get("k", settings.COURSE_AUTOCOMPLETE_LIMIT))
+    except ValueError:
+        return json_response({"k": "Must be an integer."}, status.HTTP_400_BAD_REQUEST)
+    k = max(1, min(k, settings.COURSE_AUTOCOMPLETE_MAX_LIMIT))
+
+    async def search():
+        return [course async for course in Course.objects.search_course_name(query).values(
+            "id", "subject", "course_num", "class_name", "semester", "year"
+        )[:k]]
+
+    return await cache.acached_response("autocomplete", query, search, k=k)
+
+@async_api_view(['GET'])
+async def getTeacher(request, pk):
+    """
+    Asynchronous getTeacher: a JSON response of the teacher with the given email.
+    """
+
+    try:
+        teacher = await FAST_TEACHER.values(Teacher.objects.all()).aget(pk=pk)
+    except Teacher.DoesNotExist:
+        return json_response({"detail": "Not found."}, status.HTTP_404_NOT_FOUND)
+    return HttpResponse(render_json(FAST_TEACHER.serialize([teacher])[0]), content_type="application/json")
+
+@async_api_view(['POST'])
+async def sendMessage(request):
+    """
+    Send an anonymous message to the teacher from the requesting student, as specified by the message body.
+    Unlike the synchronous endpoint, the message is moderated before responding, so the response carries
+    its final status. If moderation fails, the message is queued for the pipeline workers instead,
+    and held if Perspective is unavailable.
+    Students sending too many messages get a 429 response with a Retry-After header, and everyone
+    a 503 response with one while Perspective is down in the "reject" degraded mode.
+    """
+
+    await authenticate(request)
+    if not request.user.is_authenticated:
+        raise NotAuthenticated()
+    throttle = MessageThrottle()
+    if not await sync_to_async(throttle.allow_request)(request, None):
+        raise Throttled(throttle.wait())
+    check_moderation()
+
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return json_response({"detail": "JSON parse error."}, status.HTTP_400_BAD_REQUEST)
+
+    serializer = MessageSerializer(data=data)
+    if not await sync_to_async(serializer.is_valid)():
+        return json_response(serializer.errors, status.HTTP_400_BAD_REQUEST)
+
+    #Stored with its job, so the pipeline workers pick the message up if this request never finishes
+    message, job = await sync_to_async(pipeline.submit_message)(student=request.user, **serializer.validated_data)
+    try:
+        result = await message.aemail_message()
+    except moderation.ModerationUnavailable as e:
+        await sync_to_async(pipeline.hold_message)(message, e.retry_after)
+        return json_response({"id": message.id, "status": message.get_status_display()}, status.HTTP_202_ACCEPTED)
+    except Exception:
+        #Leave the message pending for the pipeline workers to retry
+        await sync_to_async(pipeline.release_job)(job)
+        return json_response({"id": message.id, "status": message.get_status_display()}, status.HTTP_202_ACCEPTED)
+
+    await sync_to_async(job.delete)()
+    return json_response({"id": message.id, "status": message.get_status_display(), **result},
+                         status.HTTP_201_CREATED)
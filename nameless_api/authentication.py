@@ -0,0 +1,58 @@
+"""
+JWT authentication which resolves the token's student without a database query on most requests.
+
+CachedJWTAuthentication looks the student up in feedback_man.accounts before falling back to the
+database. ReadOnlyJWTAuthentication is for endpoints which never act on the student's account:
+with AUTH_STATELESS_READS set it trusts the token alone and returns a TokenUser carrying only
+the token's claims.
+"""
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from feedback_man import accounts
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication resolving the student through the account cache."""
+
+    def get_user(self, validated_token):
+        #Revocation compares the password hash, which is not cached
+        if api_settings.CHECK_REVOKE_TOKEN or api_settings.USER_ID_FIELD != self.user_model._meta.pk.name:
+            return super().get_user(validated_token)
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = accounts.lookup(self.user_model, user_id)
+        if user is None:
+            try:
+                user = self.user_model.objects.get(pk=user_id)
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            accounts.store(user)
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        return user
+
+
+class ReadOnlyJWTAuthentication(CachedJWTAuthentication):
+    """
+    Authentication for read-only endpoints. With AUTH_STATELESS_READS, the user is a TokenUser built
+    from the token, so neither the cache nor the database is consulted and deactivated students keep
+    read access until their token expires.
+    """
+
+    def get_user(self, validated_token):
+        if not settings.AUTH_STATELESS_READS:
+            return super().get_user(validated_token)
+
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        return api_settings.TOKEN_USER_CLASS(validated_token)
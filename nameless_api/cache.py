@@ -0,0 +1,112 @@
+"""
+Cache of serialized search responses.
+
+Responses are cached as rendered JSON bytes, so a hit skips both the search query and
+serialization. Keys combine the endpoint, the normalized query and the catalog version, which
+feedback_man.signals bumps whenever a teacher, course or course's teachers change. Entries live
+in an in-process LRU in front of the shared search cache, both expiring after the search cache's
+timeout.
+"""
+import hashlib
+import re
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+from feedback_man.lru import LRUCache
+from feedback_man.search import acatalog_version, catalog_version
+from .fast_serializers import render_json
+
+_local = None
+_local_lock = threading.Lock()
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def local_cache() -> LRUCache:
+    """Return the in-process LRU of search responses."""
+
+    global _local
+    if _local is None:
+        with _local_lock:
+            if _local is None:
+                _local = LRUCache(settings.SEARCH_CACHE_LOCAL_SIZE, caches[settings.SEARCH_CACHE_ALIAS].default_timeout)
+    return _local
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a search query the way the search managers tokenize it."""
+
+    return " ".join(re.sub(r"[\W_]+", " ", query.lower()).split())
+
+
+def cache_key(endpoint: str, query: str, version: int, **params) -> str:
+    """Return the cache key of a search on the given endpoint under the given catalog version."""
+
+    raw = "|".join([normalize_query(query)] + [f"{name}={params[name]}" for name in sorted(params)])
+    digest = hashlib.sha1(raw.encode()).hexdigest()
+    return f"search:{endpoint}:{version}:{digest}"
+
+
+def record(event: str):
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def stats() -> dict:
+    """Return the hit and miss counters of this process, and the hit rate."""
+
+    with _stats_lock:
+        counts = {event: _stats[event] for event in ("local_hits", "shared_hits", "misses")}
+    lookups = sum(counts.values())
+    counts["hit_rate"] = (counts["local_hits"] + counts["shared_hits"]) / lookups if lookups else 0.0
+    counts["local_entries"] = len(local_cache())
+    return counts
+
+
+def cached_response(endpoint: str, query: str, search, **params) -> HttpResponse:
+    """
+    Return a JSON response of the search results for the query on the endpoint, calling
+    search() for the serialized results only when no cached response exists.
+    """
+
+    key = cache_key(endpoint, query, catalog_version(), **params)
+    body = local_cache().get(key)
+    if body is not None:
+        record("local_hits")
+    else:
+        shared = caches[settings.SEARCH_CACHE_ALIAS]
+        body = shared.get(key)
+        if body is not None:
+            record("shared_hits")
+        else:
+            record("misses")
+            body = render_json(search())
+            shared.set(key, body)
+        local_cache().set(key, body)
+
+    return HttpResponse(body, content_type="application/json")
+
+
+async def acached_response(endpoint: str, query: str, search, **params) -> HttpResponse:
+    """Asynchronous cached_response, awaiting search() on a miss."""
+
+    key = cache_key(endpoint, query, await acatalog_version(), **params)
+    body = local_cache().get(key)
+    if body is not None:
+        record("local_hits")
+    else:
+        shared = caches[settings.SEARCH_CACHE_ALIAS]
+        body = await shared.aget(key)
+        if body is not None:
+            record("shared_hits")
+        else:
+            record("misses")
+            body = render_json(await search())
+            await shared.aset(key, body)
+        local_cache().set(key, body)
+
+    return HttpResponse(body, content_type="application/json")
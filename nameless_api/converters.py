@@ -0,0 +1,10 @@
+class EmailConverter:
+    """Matches an email address in a URL path, as teachers' primary keys are."""
+
+    regex = r"[^/@\s]+@[^/@\s]+"
+
+    def to_python(self, value: str) -> str:
+        return value
+
+    def to_url(self, value: str) -> str:
+        return value
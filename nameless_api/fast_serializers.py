@@ -0,0 +1,135 @@
+"""
+Fast-path serialization and rendering of the read endpoints' results.
+
+TeacherSerializer and CourseSerializer instantiate and run a DRF field per column of every row.
+The fast path fetches rows as .values() dicts and maps them with extractors compiled once per
+serializer class from its fields: columns whose representation is the database value are copied
+as they are, and many-to-many primary key fields are filled from one query on the through
+table. The results, and their rendering with render_json, are byte-identical to the serializers
+rendered by DRF's JSONRenderer.
+"""
+from collections import defaultdict
+
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+#Serializer fields whose representation of the value read from their model field is the value itself
+IDENTITY_FIELDS = (serializers.CharField, serializers.EmailField, serializers.IntegerField)
+
+
+def render_json(data) -> bytes:
+    """
+    Render data as DRF's JSONRenderer does (compact, unescaped unicode but for U+2028 and U+2029),
+    with orjson when it is installed. Only for data of strings, integers, None, lists and dicts:
+    orjson formats floats differently.
+    """
+
+    if orjson is not None:
+        try:
+            body = orjson.dumps(data)
+        except TypeError:
+            #Types orjson does not serialize, such as lazy translations
+            pass
+        else:
+            return body.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+    return JSONRenderer().render(data)
+
+
+class FastSerializer:
+    """
+    The representations of a ModelSerializer's model rows, built from .values() dicts.
+    Supports fields sourced from a column of the model and many-to-many primary key fields.
+    """
+
+    def __init__(self, serializer_class):
+        self.model = serializer_class.Meta.model
+        self.pk = self.model._meta.pk.attname
+        #Column fields, in the serializer's order
+        self.columns = []
+        #(name, convert) of the columns whose representation differs from the database value
+        self.converters = []
+        #(name, many-to-many model field)
+        self.relations = []
+
+        names = []
+        for name, field in serializer_class().fields.items():
+            if field.write_only:
+                continue
+            names.append(name)
+            if isinstance(field, serializers.ManyRelatedField) and \
+                    isinstance(field.child_relation, serializers.PrimaryKeyRelatedField) and \
+                    field.child_relation.pk_field is None:
+                self.relations.append((name, self.model._meta.get_field(field.source)))
+            elif field.source == name and not isinstance(field, serializers.RelatedField):
+                self.columns.append(name)
+                if not self.is_identity(field):
+                    self.converters.append((name, field.to_representation))
+            else:
+                raise TypeError(f"{serializer_class.__name__}.{name} has no fast path")
+        #Columns fetched with values(): the serializer's, then the primary key if missing
+        self.fetch = self.columns + ([self.pk] if self.relations and self.pk not in self.columns else [])
+        #Whether the dicts of values() can be reused as they are, with the relations appended
+        self.in_order = names == self.columns + [name for name, _ in self.relations]
+        self.names = names
+
+    def is_identity(self, field) -> bool:
+        if type(field) in IDENTITY_FIELDS:
+            return True
+        if type(field) is serializers.ChoiceField:
+            #Choices keyed by strings are represented by the key itself
+            return all(type(key) is str for key in field.choices)
+        return False
+
+    def values(self, queryset, *extra):
+        """Return the queryset's rows as values() dicts of the fetched columns and the extra fields."""
+
+        return queryset.values(*self.fetch, *[field for field in extra if field not in self.fetch])
+
+    def serialize(self, rows: list) -> list:
+        """Turn values() dicts of the rows into their representations, in place where possible."""
+
+        links = {name: group(self.links(field, rows)) for name, field in self.relations}
+        return self.build(rows, links)
+
+    async def aserialize(self, rows: list) -> list:
+        """Asynchronous serialize, reading the many-to-many fields with the async ORM."""
+
+        links = {name: group([link async for link in self.links(field, rows)]) for name, field in self.relations}
+        return self.build(rows, links)
+
+    def links(self, field, rows: list):
+        """Return the (pk, related pk) pairs of the rows' many-to-many field, related pks in ascending order."""
+
+        through = field.remote_field.through
+        source = f"{field.m2m_field_name()}_id"
+        target = f"{field.m2m_reverse_field_name()}_id"
+        return through.objects.filter(**{f"{source}__in": [row[self.pk] for row in rows]}) \
+            .order_by(target).values_list(source, target)
+
+    def build(self, rows: list, links: dict) -> list:
+        results = []
+        for row in rows:
+            for name, convert in self.converters:
+                if row[name] is not None:
+                    row[name] = convert(row[name])
+            for name, related in links.items():
+                row[name] = related.get(row[self.pk], [])
+            if self.in_order and len(row) == len(self.names):
+                results.append(row)
+            else:
+                results.append({name: row[name] for name in self.names})
+        return results
+
+
+def group(links) -> dict:
+    """Group (pk, related pk) pairs into {pk: [related pk, ...]}."""
+
+    related = defaultdict(list)
+    for pk, related_pk in links:
+        related[pk].append(related_pk)
+    return related
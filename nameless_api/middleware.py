@@ -0,0 +1,126 @@
+"""
+Performance middleware: MetricsMiddleware records per-request wall time, SQL query count and SQL
+time, labelled by the matched URL route (see feedback_man.metrics), ProfilingMiddleware
+profiles requests on demand (see nameless_api.profiling), and ReplicaPinningMiddleware keeps
+users reading their own writes when catalog reads go to replicas (see feedback_man.routers).
+"""
+import asyncio
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.utils.decorators import sync_and_async_middleware
+
+from feedback_man import metrics, routers
+from . import profiling
+
+
+def record(request, response, recorder: metrics.QueryRecorder, seconds: float):
+    match = request.resolver_match
+    route = match.route if match else "unmatched"
+    metrics.REQUESTS.inc(route, request.method, str(response.status_code))
+    metrics.REQUEST_SECONDS.observe(seconds, route, request.method)
+    metrics.REQUEST_QUERIES.observe(recorder.count, route, request.method)
+    metrics.REQUEST_QUERY_SECONDS.observe(recorder.seconds, route, request.method)
+
+
+@sync_and_async_middleware
+def MetricsMiddleware(get_response):
+    """
+    Record the metrics of every request. SQL is observed with connection.execute_wrapper on the
+    thread running the request's database work: the request thread under WSGI, and the request's
+    thread-sensitive worker thread under ASGI.
+    """
+
+    if not settings.METRICS_ENABLED:
+        raise MiddlewareNotUsed
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            recorder = metrics.QueryRecorder()
+            queries = ExitStack()
+            await sync_to_async(lambda: queries.enter_context(connection.execute_wrapper(recorder)))()
+            start = time.perf_counter()
+            try:
+                response = await get_response(request)
+            finally:
+                await sync_to_async(queries.close)()
+            record(request, response, recorder, time.perf_counter() - start)
+            return response
+    else:
+        def middleware(request):
+            recorder = metrics.QueryRecorder()
+            start = time.perf_counter()
+            with connection.execute_wrapper(recorder):
+                response = get_response(request)
+            record(request, response, recorder, time.perf_counter() - start)
+            return response
+
+    return middleware
+
+
+@sync_and_async_middleware
+def ProfilingMiddleware(get_response):
+    """
+    Profile the requests asking for it with the profiling token, and a PROFILING_SAMPLE_RATE
+    fraction of all requests. Removed from the stack unless PROFILING_ENABLED is set.
+    """
+
+    if not settings.PROFILING_ENABLED:
+        raise MiddlewareNotUsed
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            profile = profiling.begin(request)
+            if profile is None:
+                return await get_response(request)
+            response = None
+            try:
+                response = await get_response(request)
+            finally:
+                profiling.finish(profile, request, response)
+            return response
+    else:
+        def middleware(request):
+            profile = profiling.begin(request)
+            if profile is None:
+                return get_response(request)
+            response = None
+            try:
+                response = get_response(request)
+            finally:
+                profiling.finish(profile, request, response)
+            return response
+
+    return middleware
+
+
+@sync_and_async_middleware
+def ReplicaPinningMiddleware(get_response):
+    """
+    Route the database work of every request with its own routing state, and pin the catalog
+    reads of users whose request wrote to the primary for REPLICA_PIN_SECONDS.
+    Removed from the stack unless DATABASE_REPLICAS are configured.
+    """
+
+    if not settings.DATABASE_REPLICAS:
+        raise MiddlewareNotUsed
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            with routers.routing(request) as state:
+                response = await get_response(request)
+            if state.wrote:
+                await sync_to_async(routers.remember_writes)(state)
+            return response
+    else:
+        def middleware(request):
+            with routers.routing(request) as state:
+                response = get_response(request)
+            routers.remember_writes(state)
+            return response
+
+    return middleware
@@ -0,0 +1,188 @@
+"""
+Keyset (cursor) pagination and NDJSON streaming for list endpoints.
+
+A page is the first `limit` rows after the last row of the previous page in a fixed, total
+ordering, so every page costs the same index range scan no matter how deep it is. The cursor
+is an opaque URL-safe encoding of the ordering values of the last row returned.
+NULLs sort first in ascending and last in descending order on every database backend.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+from functools import reduce
+from operator import and_, or_
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder keeping the microseconds of datetimes, which it would round to milliseconds."""
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values: list) -> str:
+    """Encode the ordering values of a row as an opaque cursor."""
+
+    raw = json.dumps(values, cls=CursorEncoder, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, length: int) -> list:
+    """Decode a cursor made by encode_cursor. Raises ValidationError if it is malformed."""
+
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        raise ValidationError({"cursor": "Invalid cursor."})
+    if not isinstance(values, list) or len(values) != length:
+        raise ValidationError({"cursor": "Invalid cursor."})
+    return values
+
+
+def page_params(request) -> tuple:
+    """
+    Return the (cursor, limit) requested by the cursor and limit query parameters, with limit
+    defaulting to PAGE_SIZE and capped at MAX_PAGE_SIZE. Accepts DRF and plain Django requests.
+    """
+
+    params = getattr(request, "query_params", request.GET)
+    try:
+        limit = int(params.get("limit", settings.PAGE_SIZE))
+    except ValueError:
+        raise ValidationError({"limit": "Must be an integer."})
+    return params.get("cursor"), max(1, min(limit, settings.MAX_PAGE_SIZE))
+
+
+def nullable_fields(model, ordering: list) -> set:
+    """Return the names of the ordering fields which are nullable fields of the model. Annotations are assumed non-null."""
+
+    names = set()
+    for field in ordering:
+        name = field.lstrip("-")
+        try:
+            if model._meta.get_field(name).null:
+                names.add(name)
+        except FieldDoesNotExist:
+            pass
+    return names
+
+
+def order(queryset, ordering: list):
+    """Order the queryset by the ordering fields ("-" prefixed for descending), NULLs first."""
+
+    nullable = nullable_fields(queryset.model, ordering)
+
+    def expression(field):
+        name = field.lstrip("-")
+        if name not in nullable:
+            #A plain ORDER BY, which an index can serve on every backend
+            return field
+        return F(name).desc(nulls_last=True) if field.startswith("-") else F(name).asc(nulls_first=True)
+
+    return queryset.order_by(*[expression(field) for field in ordering])
+
+
+def after(ordering: list, values: list, nullable: set = None) -> Q:
+    """
+    Return a Q matching the rows which come after the row with the given ordering values.
+    nullable is the set of fields which may be NULL; by default, any of them may be.
+    """
+
+    clauses = []
+    for i, field in enumerate(ordering):
+        name = field.lstrip("-")
+        equal = [Q(**{f"{prev.lstrip('-')}__isnull": True}) if value is None else Q(**{prev.lstrip("-"): value})
+                 for prev, value in zip(ordering[:i], values[:i])]
+        value = values[i]
+        if nullable is not None and name not in nullable:
+            beyond = Q(**{f"{name}__lt" if field.startswith("-") else f"{name}__gt": value})
+        elif field.startswith("-"):
+            #Descending, NULLs last: after v comes anything smaller, then NULL; nothing comes after NULL
+            if value is None:
+                continue
+            beyond = Q(**{f"{name}__lt": value}) | Q(**{f"{name}__isnull": True})
+        else:
+            #Ascending, NULLs first: after NULL comes any value, after v anything larger
+            beyond = Q(**{f"{name}__isnull": False}) if value is None else Q(**{f"{name}__gt": value})
+        clauses.append(reduce(and_, equal + [beyond]))
+    if not clauses:
+        return Q(pk__in=[])
+    condition = reduce(or_, clauses)
+    first = ordering[0].lstrip("-")
+    if nullable is not None and first not in nullable:
+        #Implied by the clauses, but lets the database seek the index to the cursor instead of filtering from the top
+        condition &= Q(**{f"{first}__lte" if ordering[0].startswith("-") else f"{first}__gte": values[0]})
+    return condition
+
+
+def page_queryset(queryset, ordering: list, cursor: str, limit: int):
+    """Return the ordered queryset of the (up to limit + 1) rows after the cursor."""
+
+    nullable = nullable_fields(queryset.model, ordering)
+    queryset = order(queryset, ordering)
+    if cursor:
+        values = decode_cursor(cursor, len(ordering))
+        #Values of the wrong type for their field, e.g. from a tampered cursor, fail as the lookups are built
+        try:
+            queryset = queryset.filter(after(ordering, values, nullable))
+        except (TypeError, ValueError, DjangoValidationError):
+            raise ValidationError({"cursor": "Invalid cursor."})
+    return queryset[:limit + 1]
+
+
+def page_rows(rows: list, ordering: list, limit: int) -> tuple:
+    """
+    Split fetched rows, model instances or values() dicts, into the page and the cursor of the
+    next page (None on the last page).
+    """
+
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    if isinstance(last, dict):
+        return rows, encode_cursor([last[field.lstrip("-")] for field in ordering])
+    return rows, encode_cursor([getattr(last, field.lstrip("-")) for field in ordering])
+
+
+def paginate(queryset, ordering: list, cursor: str, limit: int) -> tuple:
+    """
+    Return (rows, next_cursor) for the page of at most limit rows after the cursor (or the
+    first page when cursor is None). The last field of ordering must be unique.
+    next_cursor is None on the last page.
+    """
+
+    return page_rows(list(page_queryset(queryset, ordering, cursor, limit)), ordering, limit)
+
+
+async def apaginate(queryset, ordering: list, cursor: str, limit: int) -> tuple:
+    """Asynchronous paginate, fetching the page with the async ORM."""
+
+    rows = [row async for row in page_queryset(queryset, ordering, cursor, limit)]
+    return page_rows(rows, ordering, limit)
+
+
+def stream_ndjson(queryset, serializer_class, chunk_size: int = 500) -> StreamingHttpResponse:
+    """
+    Stream every row of the queryset as newline-delimited JSON, serializing rows as they are
+    read from the database cursor so memory use stays flat however many rows match.
+    """
+
+    renderer = JSONRenderer()
+
+    def rows():
+        for obj in queryset.iterator(chunk_size=chunk_size):
+            yield renderer.render(serializer_class(obj).data) + b"\n"
+
+    return StreamingHttpResponse(rows(), content_type="application/x-ndjson")
@@ -0,0 +1,143 @@
+"""
+On-demand profiling of single requests.
+
+A request is profiled when it carries the PROFILING_TOKEN in the X-Profile header or the profile
+query parameter, or when it is picked by PROFILING_SAMPLE_RATE. It is profiled with cProfile (a
+pstats file) or with a statistical sampler (a collapsed-stack file, as read by flamegraph.pl and
+speedscope), written under PROFILING_DIR in a directory named after the request's URL route.
+Only one request per process is profiled at a time. Under ASGI, the event loop interleaves other
+requests with the profiled one, and they show up in its profile.
+"""
+import cProfile
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+
+MODES = ("cprofile", "sampler")
+
+_busy = threading.Lock()
+
+
+def requested_mode(request):
+    """Return the profiling mode if the request should be profiled, else None."""
+
+    token = request.headers.get("X-Profile") or request.GET.get("profile")
+    if token and settings.PROFILING_TOKEN and hmac.compare_digest(token, settings.PROFILING_TOKEN):
+        mode = request.headers.get("X-Profile-Mode") or request.GET.get("profile_mode")
+        return mode if mode in MODES else settings.PROFILING_MODE
+    if settings.PROFILING_SAMPLE_RATE and random.random() < settings.PROFILING_SAMPLE_RATE:
+        return settings.PROFILING_MODE
+    return None
+
+
+class Sampler:
+    """
+    A statistical profiler sampling the call stack of one thread every interval seconds from a
+    background thread, and counting identical stacks.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def dump(self, path: Path):
+        with path.open("w") as fp:
+            for stack, count in self.stacks.most_common():
+                fp.write(f"{stack} {count}\n")
+
+
+class Profile:
+    """A profile of one request in the given mode. Use start() and stop() around the request."""
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        if mode == "cprofile":
+            self.profiler = cProfile.Profile()
+        else:
+            self.profiler = Sampler(threading.get_ident(), settings.PROFILING_SAMPLE_INTERVAL)
+
+    def start(self):
+        if self.mode == "cprofile":
+            self.profiler.enable()
+        else:
+            self.profiler.start()
+
+    def stop(self):
+        if self.mode == "cprofile":
+            self.profiler.disable()
+        else:
+            self.profiler.stop()
+
+    def save(self, request) -> Path:
+        """Write the profile under PROFILING_DIR and return its path relative to PROFILING_DIR."""
+
+        match = request.resolver_match
+        route = re.sub(r"[^\w.-]+", "_", match.route).strip("_") if match else "unmatched"
+        directory = Path(settings.PROFILING_DIR) / (route or "root")
+        directory.mkdir(parents=True, exist_ok=True)
+        suffix = "prof" if self.mode == "cprofile" else "collapsed"
+        path = directory / f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{os.getpid()}-{request.method}.{suffix}"
+        if self.mode == "cprofile":
+            self.profiler.dump_stats(path)
+        else:
+            self.profiler.dump(path)
+        return path.relative_to(settings.PROFILING_DIR)
+
+
+def begin(request):
+    """Start and return a Profile if the request should be profiled and no other request is, else None."""
+
+    mode = requested_mode(request)
+    if mode is None or not _busy.acquire(blocking=False):
+        return None
+    try:
+        profile = Profile(mode)
+        profile.start()
+    except BaseException:
+        _busy.release()
+        raise
+    return profile
+
+
+def finish(profile: Profile, request, response):
+    """
+    Stop the profile, save it and name the file in the response's X-Profile header.
+    response is None if the request raised.
+    """
+
+    try:
+        profile.stop()
+        path = profile.save(request)
+        if response is not None:
+            response["X-Profile"] = str(path)
+    finally:
+        _busy.release()
@@ -1,10 +1,54 @@
+from django.conf import settings
 from rest_framework import serializers
 from feedback_man.models import Message, Teacher, Course
 
 class MessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
-        exclude = ["is_malicious"]
+        exclude = ["is_malicious", "status", "created_at"]
+        #The sender is always the requesting student
+        read_only_fields = ["student"]
+
+class BatchMessageSerializer(serializers.Serializer):
+    """One message body for every teacher of a course, or for a list of teachers. The sender is the requesting student."""
+
+    message_body = serializers.CharField()
+    course = serializers.PrimaryKeyRelatedField(queryset=Course.objects.all(), required=False)
+    teachers = serializers.ListField(child=serializers.EmailField(), required=False, allow_empty=False)
+
+    def validate(self, data):
+        """Resolve the teachers with one query into data["teachers"], in email order."""
+        if ("course" in data) == ("teachers" in data):
+            raise serializers.ValidationError("Give either a course or a list of teachers.")
+
+        if "course" in data:
+            teachers = list(data["course"].teachers.order_by("pk"))
+            if not teachers:
+                raise serializers.ValidationError({"course": "This course has no teachers."})
+        else:
+            emails = set(data["teachers"])
+            teachers = list(Teacher.objects.filter(pk__in=emails).order_by("pk"))
+            missing = emails - {teacher.pk for teacher in teachers}
+            if missing:
+                raise serializers.ValidationError({"teachers": [f"No teacher {email}." for email in sorted(missing)]})
+
+        if len(teachers) > settings.MESSAGE_BATCH_MAX_TEACHERS:
+            raise serializers.ValidationError(f"At most {settings.MESSAGE_BATCH_MAX_TEACHERS} teachers per message.")
+        data["teachers"] = teachers
+        return data
+
+class InboxMessageSerializer(serializers.ModelSerializer):
+    #Messages are anonymous: the teacher never sees the student
+    class Meta:
+        model = Message
+        fields = ["id", "message_body", "created_at"]
+
+class MessageHistorySerializer(serializers.ModelSerializer):
+    status = serializers.CharField(source="get_status_display")
+
+    class Meta:
+        model = Message
+        fields = ["id", "teacher", "message_body", "status", "created_at"]
 
 class TeacherSerializer(serializers.ModelSerializer):
     
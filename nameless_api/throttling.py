@@ -0,0 +1,99 @@
+"""
+Per-student throttling of message submission.
+
+A token bucket per student account, kept in the shared throttle cache so every worker process
+enforces the same limit. The bucket is stored as its theoretical arrival time (GCRA) and moved
+with atomic cache increments, so concurrent requests never admit more than the bucket holds.
+Students with infractions refill more slowly and may burst less.
+In the "reject" moderation degraded mode, messages are refused outright while Perspective is down,
+as published to the shared cache by whichever process's circuit breaker opened.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.throttling import BaseThrottle
+from feedback_man import moderation
+
+
+class MessageThrottle(BaseThrottle):
+    """
+    Token bucket of MESSAGE_THROTTLE_BURST messages refilling at MESSAGE_THROTTLE_RATE messages
+    per MESSAGE_THROTTLE_PERIOD seconds. Each infraction stretches the refill interval by
+    MESSAGE_THROTTLE_INFRACTION_PENALTY and shrinks the burst by one message.
+    Anonymous requests are throttled per client IP.
+    """
+
+    def __init__(self):
+        self.retry_after = None
+
+    def get_limits(self, request) -> tuple:
+        """Return the (refill interval in ms, burst) for the requesting student."""
+
+        infractions = getattr(request.user, "num_infractions", 0) or 0
+        interval = settings.MESSAGE_THROTTLE_PERIOD / settings.MESSAGE_THROTTLE_RATE
+        interval *= 1 + infractions * settings.MESSAGE_THROTTLE_INFRACTION_PENALTY
+        burst = max(1, settings.MESSAGE_THROTTLE_BURST - infractions)
+        return int(interval * 1000), burst
+
+    def get_cache_key(self, request) -> str:
+        if request.user and request.user.is_authenticated:
+            return f"throttle:message:{request.user.pk}"
+        return f"throttle:message:ip:{self.get_ident(request)}"
+
+    def allow_request(self, request, view) -> bool:
+        cache = caches[settings.THROTTLE_CACHE_ALIAS]
+        key = self.get_cache_key(request)
+        interval, burst = self.get_limits(request)
+        now = int(time.time() * 1000)
+
+        #The stored value is the time at which the bucket will be full again
+        cache.add(key, now, math.ceil(interval / 1000))
+        try:
+            full_at = cache.incr(key, interval)
+        except ValueError:
+            cache.add(key, now + interval, math.ceil(interval / 1000))
+            full_at = now + interval
+        if full_at - interval < now:
+            #The bucket was already full: move it up to now with another atomic increment rather than
+            #banking idle time, so concurrent requests keep every token they took
+            full_at = cache.incr(key, now - (full_at - interval))
+
+        if full_at - now <= burst * interval:
+            #Expire an interval after the bucket is full again, so requests rarely find it already full,
+            #and concurrent ones which do only move it up by the little time since
+            cache.touch(key, math.ceil((full_at - now + interval) / 1000))
+            return True
+
+        #Over the limit: give the token back and report when one will be available
+        cache.decr(key, interval)
+        self.retry_after = (full_at - burst * interval - now) / 1000
+        return False
+
+    def wait(self):
+        return self.retry_after
+
+
+class ServiceUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Messages cannot be moderated right now. Please try again later."
+    default_code = "moderation_unavailable"
+
+    def __init__(self, wait: float):
+        super().__init__()
+        self.wait = math.ceil(wait)
+
+
+def check_moderation():
+    """
+    In the "reject" degraded mode, raise ServiceUnavailable (503 with a Retry-After header) while
+    the moderation circuit breaker of this process, or of any process calling Perspective, is open.
+    """
+
+    if settings.MODERATION_DEGRADED_MODE == "reject":
+        retry_after = max(moderation.get_breaker().retry_after(), moderation.shared_retry_after())
+        if retry_after:
+            raise ServiceUnavailable(retry_after)
@@ -1,10 +1,25 @@
-from django.urls import path
-from . import views
+from django.urls import path, register_converter
+from . import async_views, converters, views
+
+register_converter(converters.EmailConverter, "email")
 
 urlpatterns = [
     path("", views.getData),
     path("search/teacher/<str:name>", views.searchTeacher),
     path("search/course/<str:name>", views.searchCourse),
+    path("search/course/autocomplete/<str:query>", views.autocompleteCourse),
+    path("stats/cache", views.getCacheStats),
+    path("metrics", views.getMetrics),
     path("teacher/<email:pk>", views.getTeacher),
-    path("message", views.sendMessage)
+    path("teacher/<email:pk>/inbox", views.getTeacherInbox),
+    path("message", views.sendMessage),
+    path("message/history", views.getMessageHistory),
+    path("message/batch", views.sendBatchMessage),
+    path("message/<int:pk>", views.getMessageStatus),
+    #Async variants for ASGI deployments
+    path("async/search/teacher/<str:name>", async_views.searchTeacher),
+    path("async/search/course/<str:name>", async_views.searchCourse),
+    path("async/search/course/autocomplete/<str:query>", async_views.autocompleteCourse),
+    path("async/teacher/<email:pk>", async_views.getTeacher),
+    path("async/message", async_views.sendMessage),
 ]
\ No newline at end of file
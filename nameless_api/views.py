@@ -1,53 +1,214 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from rest_framework import status
 from rest_framework.response import Response
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, throttle_classes
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from feedback_man.models import Message, Teacher, Course
-from .serializers import MessageSerializer, TeacherSerializer, CourseSerializer
+from feedback_man import accounts, batch, dedup, metrics, moderation, pipeline, prescreen, verdicts
+from .serializers import (
+    MessageSerializer, TeacherSerializer, CourseSerializer, InboxMessageSerializer, MessageHistorySerializer,
+    BatchMessageSerializer
+)
+from . import cache, pagination
+from .fast_serializers import FastSerializer, render_json
+from .authentication import ReadOnlyJWTAuthentication
+from .throttling import MessageThrottle, check_moderation
 
 # TODO: Test endpoints
 
+#Keyset orderings of the paginated search endpoints; the last field of each is unique
+TEACHER_SEARCH_ORDERING = ["-matches", "teacher_name"]
+COURSE_SEARCH_ORDERING = ["subject", "course_num", "-year", "semester", "id"]
+#Fast paths of the search and teacher endpoints
+FAST_TEACHER = FastSerializer(TeacherSerializer)
+FAST_COURSE = FastSerializer(CourseSerializer)
+#A course's teachers in primary key order, as FastSerializer lists them
+COURSE_TEACHERS = Prefetch("teachers", queryset=Teacher.objects.order_by("pk"))
+#Newest first, in the order of the message_teacher_inbox and message_student_history indexes
+MESSAGE_ORDERING = ["-created_at", "-id"]
+
 @api_view(['GET'])
 def getData(request):
     student = {'emeail':"sepulveda.s@northeastern.edu"}
     return Response(student)
 
 @api_view(['GET'])
+@authentication_classes([ReadOnlyJWTAuthentication])
 def searchTeacher(request, name):
     """
-    Return a JSON response of all teachers in the database who match the given name.
+    Return a JSON response of the teachers in the database who match the given name, best matches first.
+    Results are paginated as {"results": [...], "next": cursor}: pass the cursor query parameter to get the
+    next page, and limit to set the page size. With stream=1, stream every match as newline-delimited JSON.
     """
     teachers = Teacher.objects.search_teacher_name(name)
-    serializer = TeacherSerializer(teachers, many=True)
-    return Response(serializer.data)
+    if request.query_params.get("stream"):
+        return pagination.stream_ndjson(teachers, TeacherSerializer)
+
+    cursor, limit = pagination.page_params(request)
+
+    def search():
+        rows = FAST_TEACHER.values(teachers, *[field.lstrip("-") for field in TEACHER_SEARCH_ORDERING])
+        page, next_cursor = pagination.paginate(rows, TEACHER_SEARCH_ORDERING, cursor, limit)
+        return {"results": FAST_TEACHER.serialize(page), "next": next_cursor}
+
+    return cache.cached_response("teacher", name, search, cursor=cursor, limit=limit)
 
 @api_view(['GET'])
+@authentication_classes([ReadOnlyJWTAuthentication])
 def searchCourse(request, name):
     """
-    Return a JSON response of all courses in the database who match the given course.
+    Return a JSON response of the courses in the database who match the given course.
+    Paginated and streamable like searchTeacher.
     """
     courses = Course.objects.search_course_name(name)
-    serializer = CourseSerializer(courses, many=True)
-    return Response(serializer.data)
+    if request.query_params.get("stream"):
+        return pagination.stream_ndjson(courses.prefetch_related(COURSE_TEACHERS), CourseSerializer)
+
+    cursor, limit = pagination.page_params(request)
+
+    def search():
+        rows = FAST_COURSE.values(courses, *[field.lstrip("-") for field in COURSE_SEARCH_ORDERING])
+        page, next_cursor = pagination.paginate(rows, COURSE_SEARCH_ORDERING, cursor, limit)
+        return {"results": FAST_COURSE.serialize(page), "next": next_cursor}
+
+    return cache.cached_response("course", name, search, cursor=cursor, limit=limit)
+
+@api_view(['GET'])
+@authentication_classes([ReadOnlyJWTAuthentication])
+def autocompleteCourse(request, query):
+    """
+    Return a JSON response of the top k courses matching the partially typed query,
+    where k is given by the k query parameter (capped at COURSE_AUTOCOMPLETE_MAX_LIMIT).
+    """
+    try:
+        k = int(request.query_params.get("k", settings.COURSE_AUTOCOMPLETE_LIMIT))
+    except ValueError:
+        return Response({"k": "Must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+    k = max(1, min(k, settings.COURSE_AUTOCOMPLETE_MAX_LIMIT))
+
+    def search():
+        return list(Course.objects.search_course_name(query).values(
+            "id", "subject", "course_num", "class_name", "semester", "year"
+        )[:k])
+
+    return cache.cached_response("autocomplete", query, search, k=k)
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def getCacheStats(request):
+    """
+    Return a JSON response of this process's search cache, moderation verdict cache, moderation
+    pre-screen, account cache, near-duplicate and moderation gateway counters.
+    """
+    return Response({"search": cache.stats(), "moderation": verdicts.stats(), "prescreen": prescreen.stats(),
+                     "auth": accounts.stats(), "dedup": dedup.stats(), "gateway": moderation.stats()})
 
 @api_view(['GET'])
+@permission_classes([IsAdminUser])
+def getMetrics(request):
+    """
+    Return this process's request and span metrics in the Prometheus text format.
+    """
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@api_view(['GET'])
+@authentication_classes([ReadOnlyJWTAuthentication])
 def getTeacher(request, pk):
     """
     Return a JSON response of the teacher with the given email.
     """
 
-    teacher = Teacher.objects.get(id=pk)
-    serializer = TeacherSerializer(teacher)
-    return Response(serializer.data)
+    teacher = get_object_or_404(FAST_TEACHER.values(Teacher.objects.all()), pk=pk)
+    return HttpResponse(render_json(FAST_TEACHER.serialize([teacher])[0]), content_type="application/json")
 
 @api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@throttle_classes([MessageThrottle])
 def sendMessage(request):
     """
-    Send an anonymous message to the teacher from the student,
+    Queue an anonymous message to the teacher from the requesting student,
     as specified by the message body.
+    The message is moderated and emailed by the pipeline workers; poll its status with getMessageStatus.
+    Students sending too many messages get a 429 response with a Retry-After header, and everyone
+    a 503 response with one while Perspective is down in the "reject" degraded mode.
     """
 
+    check_moderation()
     serializer = MessageSerializer(data=request.data)
 
     if serializer.is_valid():
-        #Save to the database and send the message contents to the teacher's email
-        response = serializer.save().send_email()
-        return Response(response)
+        #Save to the database and queue the message for moderation and delivery
+        with transaction.atomic():
+            message = serializer.save(student=request.user)
+            pipeline.enqueue_message(message)
+        return Response({"id": message.id, "status": message.get_status_display()}, status=status.HTTP_202_ACCEPTED)
+
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@throttle_classes([MessageThrottle])
+def sendBatchMessage(request):
+    """
+    Send one anonymous message from the requesting student to every teacher of a course (course) or to a
+    list of teachers (teachers), moderated once and stored in one transaction.
+    Returns the id and status of the message to each teacher; 202 if moderation failed and the
+    messages were queued for the pipeline workers instead.
+    """
+
+    check_moderation()
+    serializer = BatchMessageSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    data = serializer.validated_data
+    messages, result = batch.send_to_teachers(request.user, data["teachers"], data["message_body"])
+    body = {"messages": [{"id": message.id, "teacher": message.teacher_id, "status": message.get_status_display()}
+                         for message in messages]}
+    if result is None:
+        return Response(body, status=status.HTTP_202_ACCEPTED)
+    return Response({**body, **result}, status=status.HTTP_201_CREATED)
+
+@api_view(['GET'])
+@authentication_classes([ReadOnlyJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def getMessageStatus(request, pk):
+    """
+    Return a JSON response with the status of the requesting student's message with the given id:
+    Pending, Held, Rejected, Sent, Suppressed or Failed. Other students' messages are not found.
+    """
+
+    message = get_object_or_404(Message, pk=pk, student_id=request.user.pk)
+    return Response({"id": message.id, "status": message.get_status_display()})
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def getTeacherInbox(request, pk):
+    """
+    Return a JSON response of the messages sent to the teacher with the given email, newest first,
+    without their senders. Paginated like searchTeacher; every page is one index range scan.
+    """
+
+    get_object_or_404(Teacher, pk=pk)
+    cursor, limit = pagination.page_params(request)
+    #is_malicious__in rather than is_malicious=False, which renders as NOT is_malicious and cannot seek the index
+    messages = Message.objects.filter(teacher_id=pk, is_malicious__in=[False], status=Message.Status.SENT)
+    page, next_cursor = pagination.paginate(messages, MESSAGE_ORDERING, cursor, limit)
+    return Response({"results": InboxMessageSerializer(page, many=True).data, "next": next_cursor})
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def getMessageHistory(request):
+    """
+    Return a JSON response of the messages the requesting student has sent, newest first, with their status.
+    Paginated like getTeacherInbox.
+    """
+
+    cursor, limit = pagination.page_params(request)
+    messages = Message.objects.filter(student_id=request.user.pk, is_malicious__in=[False])
+    page, next_cursor = pagination.paginate(messages, MESSAGE_ORDERING, cursor, limit)
+    return Response({"results": MessageHistorySerializer(page, many=True).data, "next": next_cursor})